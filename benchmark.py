@@ -0,0 +1,397 @@
+'''
+Benchmarks each stage of the pipeline (cleaning, sentiment scoring and
+simulating) on synthetic data, without needing the Kaggle dataset or access
+to Yahoo Finance. The synthetic Reddit posts and stock prices are generated
+from a seed, so every run with the same arguments benchmarks exactly the same
+data.
+
+Usage examples
+--------------
+$python benchmark.py
+    benchmarks every stage at the small scale (10k posts, 100 symbols)
+
+$python benchmark.py --scale large --stages clean simulate
+    benchmarks cleaning and simulating 10M posts mentioning 10k symbols
+
+$python benchmark.py --save-baseline baseline.json
+$python benchmark.py --baseline baseline.json
+    records a baseline, then compares a later run against it, exiting with
+    an error if any stage's throughput dropped by more than --tolerance
+
+Arguments
+---------
+--scale : small, medium or large, see SCALES
+--posts : Number of posts to generate, overrides --scale
+--symbols : Number of symbols to generate, overrides --scale
+--days : Number of calendar days the posts and prices cover
+--seed : Seed for the synthetic data
+--stages : The stages to benchmark (clean, score, simulate)
+--repeat : Number of times to time each stage, the fastest is reported
+--no-memory : Skip measuring each stage's peak memory
+--save-baseline : Write the results to this JSON file
+--baseline : Compare the results to this JSON file
+--tolerance : Allowed drop in throughput before a stage counts as a
+    regression, default: 0.1 (10%)
+
+Methods
+-------
+generate_symbols(n -> int, rng) -> dict
+generate_posts(n -> int, stocks -> dict, days -> int, rng, chunksize -> int)
+    -> generator<pandas.core.frame.DataFrame>
+write_posts(chunks -> iterable<pandas.core.frame.DataFrame>, path -> str)
+    -> int
+generate_prices(symbols -> List<str>, days -> int, rng) -> dict
+run_benchmarks(...) -> dict
+compare(results -> dict, baseline -> dict, tolerance -> float) -> List<str>
+'''
+import argparse
+import datetime
+import json
+import os
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import clean_reddit_data
+import sentiment_analyzer
+import simulate
+from price_store import PriceStore, write_price_store
+
+parser = argparse.ArgumentParser(description='Benchmark the pipeline on '\
+    'synthetic data')
+parser.add_argument('--scale', choices=['small', 'medium', 'large'],
+    default='small', help='Size of the synthetic data, default: small')
+parser.add_argument('--posts', type=int,
+    help='Number of posts to generate, overrides --scale')
+parser.add_argument('--symbols', type=int,
+    help='Number of symbols to generate, overrides --scale')
+parser.add_argument('--days', type=int, default=640,
+    help='Number of calendar days the data covers, default: 640')
+parser.add_argument('--seed', type=int, default=542,
+    help='Seed for the synthetic data, default: 542')
+parser.add_argument('--stages', nargs='+', default=['clean', 'score', 'simulate'],
+    choices=['clean', 'score', 'simulate'], help='Stages to benchmark')
+parser.add_argument('--repeat', type=int, default=1,
+    help='Number of times to time each stage, default: 1')
+parser.add_argument('--no-memory', action='store_true',
+    help="Skip measuring each stage's peak memory")
+parser.add_argument('--save-baseline', help='Write the results to this file')
+parser.add_argument('--baseline', help='Compare the results to this file')
+parser.add_argument('--tolerance', type=float, default=0.1,
+    help='Allowed drop in throughput, default: 0.1')
+
+# (posts, symbols) generated at each scale
+SCALES = {
+    'small' : (10_000, 100),
+    'medium' : (1_000_000, 1_000),
+    'large' : (10_000_000, 10_000),
+}
+
+# Posts are generated, written and read back this many at a time, so even
+# the large scale never holds every post in memory at once
+CHUNKSIZE = 100_000
+
+START_DATE = datetime.date(2019, 4, 27)
+SUBREDDITS = ['wallstreetbets', 'investing', 'stocks']
+POSITIVE = ['moon', 'great', 'love', 'bullish', 'buy', 'win', 'rocket', 'good']
+NEGATIVE = ['crash', 'terrible', 'hate', 'bearish', 'sell', 'lose', 'bad']
+NEUTRAL = ['the', 'stock', 'market', 'today', 'earnings', 'of', 'and', 'is',
+    'price', 'shares', 'week', 'report', 'think', 'about']
+POST_COLUMNS = ['title', 'score', 'id', 'url', 'comms_num', 'created', 'body',
+    'timestamp', 'subreddit', 'date']
+
+
+def generate_symbols(n, rng):
+    '''
+    Generates <n> distinct, made up symbols and company names
+
+    Returns
+    -------
+    stocks : dict<symbol, name>
+        In the same form as clean_reddit_data.read_stock_data() returns
+    '''
+    letters = np.array(list(string.ascii_uppercase))
+    stocks = {}
+    while len(stocks) < n:
+        length = rng.integers(2, 6)
+        symbol = ''.join(rng.choice(letters, length))
+        name = ''.join(rng.choice(letters, 7)).title()
+        stocks.setdefault(symbol, f'{name} Inc. - Common Stock')
+
+    return stocks
+
+
+def generate_posts(n, stocks, days, rng, chunksize=CHUNKSIZE):
+    '''
+    Generates <n> Reddit posts in the same layout as the Kaggle dataset's
+    reddit.csv, <chunksize> posts at a time. Each post is a mix of positive,
+    negative and neutral words mentioning up to three symbols (most mention
+    one)
+
+    Returns
+    -------
+    generator<pandas.core.frame.DataFrame>
+        The posts, in chunks of <chunksize> (the last may be smaller)
+    '''
+    symbols = np.array(list(stocks))
+    vocabulary = np.array(POSITIVE + NEGATIVE + NEUTRAL)
+    for first in range(0, n, chunksize):
+        yield _generate_chunk(first, min(chunksize, n - first), symbols,
+            vocabulary, days, rng)
+
+
+def _generate_chunk(first, n, symbols, vocabulary, days, rng):
+    words = rng.choice(vocabulary, (n, 12))
+    mentions = rng.choice(symbols, (n, 3))
+    mention_counts = rng.choice([0, 1, 1, 1, 2, 3], n)
+    titles, bodies = [], []
+    for post_words, post_mentions, count in zip(words.tolist(),
+            mentions.tolist(), mention_counts.tolist()):
+        post_words[1:1 + count] = post_mentions[:count]
+        titles.append(' '.join(post_words[:5]) + '!')
+        bodies.append(' '.join(post_words[5:]) + '.')
+
+    minutes = rng.integers(0, days * 24 * 60, n)
+    dates = (np.datetime64(START_DATE, 'm') + minutes.astype('timedelta64[m]'))
+    return pd.DataFrame({
+        'title' : titles,
+        'score' : rng.integers(1, 10_000, n),
+        'id' : np.arange(first, first + n),
+        'url' : 'https://reddit.com',
+        'comms_num' : rng.integers(0, 500, n),
+        'created' : 0,
+        'body' : bodies,
+        'timestamp' : 0,
+        'subreddit' : rng.choice(SUBREDDITS, n),
+        'date' : np.datetime_as_string(dates).astype(object),
+    }).assign(date=lambda df: df['date'].str.replace('T', ' ') + ':00')
+
+
+def write_posts(chunks, path):
+    '''
+    Writes each chunk of <chunks> (see generate_posts) to the csv file
+    <path> as it is generated, so only one chunk is ever held in memory
+
+    Returns
+    -------
+    posts : int
+        The number of posts written
+    '''
+    posts = 0
+    mode = 'w'
+    for chunk in chunks:
+        chunk.to_csv(path, mode=mode, header=(mode == 'w'), index=False)
+        mode = 'a'
+        posts += len(chunk)
+
+    if mode == 'w':
+        # No posts, still write the header
+        pd.DataFrame(columns=POST_COLUMNS).to_csv(path, index=False)
+
+    return posts
+
+
+def generate_prices(symbols, days, rng):
+    '''
+    Generates a random walk of daily prices for each of <symbols>, on every
+    weekday of the <days> days the posts cover
+
+    Returns
+    -------
+    frames : dict<str, pandas.core.frame.DataFrame>
+        Each symbol's prices, indexed by Date, as collect_stock_data.py
+        downloads them
+    '''
+    dates = pd.bdate_range(START_DATE, periods=max(1, days * 5 // 7),
+        name='Date').strftime('%Y-%m-%d')
+    returns = 1 + rng.normal(0, 0.02, (len(dates), len(symbols)))
+    prices = rng.uniform(5, 500, len(symbols)) * np.cumprod(returns, axis=0)
+    return {symbol: pd.DataFrame({'Open': prices[:, j], 'Close': prices[:, j]},
+        index=dates) for j, symbol in enumerate(symbols)}
+
+
+def _measure(stage, items, memory, repeat=1):
+    '''
+    Runs <stage> (a function taking no arguments) <repeat> times for its
+    fastest time, and once more under tracemalloc for its peak memory when
+    <memory> is True (tracemalloc slows the stage down, so it is not timed)
+
+    Returns
+    -------
+    result : dict
+    '''
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stage()
+        seconds = min(seconds, time.perf_counter() - start)
+    result = {
+        'seconds' : seconds,
+        'items' : items,
+        'throughput' : items / seconds if seconds else float('inf'),
+    }
+    if memory:
+        tracemalloc.start()
+        stage()
+        result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    return result
+
+
+def run_benchmarks(posts, symbols, days, seed, stages, memory=True, repeat=1):
+    '''
+    Generates the synthetic data and benchmarks each of <stages> on it.
+    Stages run in a temporary working directory, so nothing in data/ is
+    touched. The posts are written to data/reddit.csv there and every stage
+    streams its input back from disk <CHUNKSIZE> rows at a time, as
+    clean_reddit_data.py --chunksize does, so memory stays bounded at every
+    scale
+
+    Returns
+    -------
+    results : dict<str, dict>
+        For each stage: seconds taken, items processed (posts for clean,
+        texts for score, trader days for simulate), throughput in items per
+        second and (unless <memory> is False) peak memory in MB
+    '''
+    rng = np.random.default_rng(seed)
+    stocks = generate_symbols(symbols, rng)
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            os.makedirs('data/results')
+            posts = write_posts(generate_posts(posts, stocks, days, rng),
+                'data/reddit.csv')
+
+            def clean():
+                return clean_reddit_data.clean_reddit_data_in_chunks(
+                    'data/reddit.csv', stocks, CHUNKSIZE,
+                    'data/clean_reddit.csv')
+
+            rows = clean()
+            if 'clean' in stages:
+                results['clean'] = _measure(clean, posts, memory, repeat)
+
+            if 'score' in stages:
+                try:
+                    sentiment_analyzer.get_analyzer()
+                except ImportError as e:
+                    print(f'Skipping the score stage: {e}')
+                else:
+                    results['score'] = _measure(_score_clean_data, rows,
+                        memory, repeat)
+
+            if 'simulate' in stages:
+                results.update(_benchmark_simulate(stocks, days, rng, memory,
+                    repeat))
+        finally:
+            os.chdir(cwd)
+
+    return results
+
+
+def _score_clean_data():
+    for chunk in pd.read_csv('data/clean_reddit.csv',
+            usecols=['title', 'body'], chunksize=CHUNKSIZE):
+        sentiment_analyzer.score_texts([f'{title} {body}'
+            for title, body in zip(chunk['title'], chunk['body'])])
+
+
+def _benchmark_simulate(stocks, days, rng, memory, repeat):
+    # Scoring is benchmarked separately, random scores are enough to trade
+    # on. Only the columns the simulation uses are read, see
+    # simulate.compact_data()
+    scored = pd.read_csv('data/clean_reddit.csv',
+        usecols=['subreddit', 'stock', 'date', 'score'],
+        dtype={'subreddit': 'category', 'stock': 'category'})
+    scored = simulate.compact_data(scored.assign(pos=rng.random(len(scored)),
+        neg=rng.random(len(scored))))
+    end_date = START_DATE + datetime.timedelta(days=days)
+    write_price_store('data/price_store',
+        generate_prices(list(stocks), days, rng))
+    store = PriceStore('data/price_store')
+
+    def run(engine):
+        traders = [simulate.Trader(subreddit, scored)
+            for subreddit in SUBREDDITS]
+        market = simulate.Market(traders, 'data/stock_data',
+            START_DATE, end_date, store=store)
+        if engine == 'vectorized':
+            market.simulate_vectorized()
+        else:
+            market.simulate()
+
+    trader_days = len(SUBREDDITS) * len(list(
+        simulate.trading_days(START_DATE, end_date)))
+    return {
+        'simulate' : _measure(lambda: run('loop'), trader_days, memory,
+            repeat),
+        'simulate_vectorized' : _measure(lambda: run('vectorized'),
+            trader_days, memory, repeat),
+    }
+
+
+def compare(results, baseline, tolerance=0.1):
+    '''
+    Compares each stage's throughput in <results> to <baseline>
+
+    Returns
+    -------
+    regressions : List<str>
+        A description of every stage whose throughput dropped by more than
+        <tolerance> (ex: 0.1 is 10%)
+    '''
+    regressions = []
+    for stage, result in results.items():
+        if stage not in baseline:
+            continue
+        ratio = result['throughput'] / baseline[stage]['throughput']
+        print(f'{stage:>20}: {ratio:6.2f}x baseline throughput')
+        if ratio < 1 - tolerance:
+            regressions.append(f'{stage} throughput fell to {ratio:.2f}x '\
+                'of the baseline')
+
+    return regressions
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    posts, symbols = SCALES[args.scale]
+    posts = args.posts or posts
+    symbols = args.symbols or symbols
+
+    print(f'Benchmarking {posts} posts, {symbols} symbols, {args.days} days')
+    results = run_benchmarks(posts, symbols, args.days, args.seed,
+        args.stages, not args.no_memory, args.repeat)
+    for stage, result in results.items():
+        peak = f', peak {result["peak_mb"]:.1f} MB' if 'peak_mb' in result else ''
+        print(f'{stage:>20}: {result["seconds"]:8.3f}s, '\
+            f'{result["throughput"]:12.1f} items/s{peak}')
+
+    report = {
+        'config' : {'posts': posts, 'symbols': symbols, 'days': args.days,
+            'seed': args.seed},
+        'results' : results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['config'] != report['config']:
+            print(f'WARNING: baseline was run with {baseline["config"]}')
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+        if regressions:
+            sys.exit(1)
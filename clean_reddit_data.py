@@ -5,23 +5,59 @@ clean_reddit.csv. The new file takes the form of:
   stock                          title   body       subreddit   score                 date
 0   GME  GME YOLO update — Jan 28 2021  empty  wallstreetbets  230844  2021-01-29 08:06:23
 
+Passing --chunksize N streams reddit.csv N rows at a time instead of reading it
+all into memory, appending each cleaned chunk to clean_reddit.csv as it goes.
+Passing --workers N splits the posts into shards that are cleaned by N worker
+processes, the output is the same as (and in the same order as) a single
+process run.
+
+Passing --metrics PATH writes the time spent reading, matching and writing,
+the number of posts read and (post, stock) rows matched, and posts per second
+to PATH (see instrument.py). --profile PATH writes cProfile stats to PATH.
+
 Methods
 -------
 read_stock_data(symbols_names)
+build_matcher(stocks, names)
+match_posts(reddit_df, matcher)
+clean_chunks(chunks, stocks, workers)
 clean_reddit_data(reddit_data)
+clean_reddit_data_in_chunks(reddit_data, stocks, chunksize)
+
+The command line is only parsed when this file is run as a script, importing
+it (ex: from pipeline.py) uses the defaults of every argument.
 '''
 import argparse
-import re
+import math
+import multiprocessing
+from collections import deque
 
 import pandas as pd
 
-import nltk
+import instrument
+from symbol_matcher import SymbolMatcher
 
 parser = argparse.ArgumentParser(description='Clean reddit data')
 parser.add_argument('-d', '--debug', action='store_true',
     help='Enter debug mode')
 parser.add_argument('-v', '--verbose', action='store_true', help='Be verbose')
-args = parser.parse_args()
+parser.add_argument('-n', '--names', action='store_true',
+    help='Also match company names (ex: Apple for AAPL), not just symbols')
+parser.add_argument('-c', '--chunksize', type=int,
+    help='Stream the reddit data this many rows at a time, keeping memory '\
+        'use bounded by the chunk size instead of the dataset size')
+parser.add_argument('-w', '--workers', type=int, default=1,
+    help='Number of worker processes to clean the data with, default: 1')
+parser.add_argument('--metrics',
+    help='Write timings and counters to this file (.prom for Prometheus)')
+parser.add_argument('--profile', help='Write cProfile stats to this file')
+# Replaced by the real command line arguments when run as a script
+args = parser.parse_args([])
+
+metrics = instrument.Metrics('clean_reddit_data')
+metrics.rate('posts_per_second', 'posts', 'clean')
+
+CLEAN_COLUMNS = ['stock', 'title', 'body', 'subreddit', 'score', 'date']
 
 def read_stock_data(symbols_names):
     '''
@@ -53,7 +89,138 @@ def read_reddit_data(reddit_data):
     return pd.read_csv(reddit_data)
 
 
-def clean_reddit_data(reddit_df, stocks):
+def build_matcher(stocks, names=False):
+    '''
+    Builds the SymbolMatcher used to find the stocks mentioned in each post
+
+    Parameters
+    ----------
+    stocks : dict<symbol, name>
+        returned from read_stock_data
+
+    names : bool
+        Whether to also match company names
+
+    Returns
+    -------
+    matcher : symbol_matcher.SymbolMatcher
+    '''
+    import nltk
+
+    #nltk.download('stopwords')
+    stops = set(nltk.corpus.stopwords.words('english'))
+    return SymbolMatcher(stocks, stops, names)
+
+
+def match_posts(reddit_df, matcher):
+    '''
+    Finds the stocks mentioned in each post/comment, creating one row for
+    every (post, stock) pair
+
+    Parameters
+    ----------
+    reddit_df : pandas.core.frame.DataFrame
+        returned from read_reddit_data(), with missing values filled in
+
+    matcher : symbol_matcher.SymbolMatcher
+        Built once from the stocks returned by read_stock_data()
+
+    Returns
+    ----------
+    clean_data : pandas.core.frame.DataFrame
+    '''
+    clean_data = []
+    for title, body, subreddit, score, date in zip(reddit_df['title'],
+            reddit_df['body'], reddit_df['subreddit'], reddit_df['score'],
+            reddit_df['date']):
+        for key in matcher.match(f'{title} {body}'):
+            clean_data.append(
+                {
+                    'stock' : key,
+                    'title' : title,
+                    'body' : body,
+                    'subreddit' : subreddit,
+                    'score' : score,
+                    'date' : date.split(' ')[0]
+                    # Strip time from date column ^
+                }
+            )
+
+    return pd.DataFrame(clean_data, columns=CLEAN_COLUMNS)
+
+
+# Each worker process builds its own matcher once, when the pool starts
+_worker_matcher = None
+
+
+def _init_worker(stocks, names):
+    global _worker_matcher
+    _worker_matcher = build_matcher(stocks, names)
+
+
+def _match_chunk(chunk):
+    return match_posts(chunk.fillna('empty'), _worker_matcher)
+
+
+def clean_chunks(chunks, stocks, workers=1, names=False):
+    '''
+    Runs match_posts() over each chunk of posts/comments, either in this
+    process or spread over a pool of <workers> processes. At most two chunks
+    per worker are in flight at once, so memory stays bounded when <chunks>
+    is streamed from disk
+
+    Parameters
+    ----------
+    chunks : iterable<pandas.core.frame.DataFrame>
+        The posts/comments to clean, as returned from read_reddit_data()
+
+    stocks : dict<symbol, name>
+        returned from read_stock_data
+
+    workers : int
+        The number of worker processes to use
+
+    names : bool
+        Whether to also match company names, see build_matcher()
+
+    Yields
+    ------
+    (rows_read, clean_chunk) : tuple(int, pandas.core.frame.DataFrame)
+        The size of each input chunk and its cleaned rows, in input order
+    '''
+    if workers <= 1:
+        matcher = build_matcher(stocks, names)
+        for chunk in chunks:
+            with metrics.timer('match'):
+                clean_chunk = match_posts(chunk.fillna('empty'), matcher)
+            metrics.count('posts', len(chunk))
+            metrics.count('matches', len(clean_chunk))
+            yield len(chunk), clean_chunk
+        return
+
+    with multiprocessing.Pool(workers, _init_worker,
+            (stocks, names)) as pool:
+        pending = deque()
+
+        def collect():
+            rows_read, result = pending.popleft()
+            # Only the time spent waiting on the workers, not their CPU time
+            with metrics.timer('match'):
+                clean_chunk = result.get()
+            metrics.count('posts', rows_read)
+            metrics.count('matches', len(clean_chunk))
+            return rows_read, clean_chunk
+
+        for chunk in chunks:
+            pending.append((len(chunk), pool.apply_async(_match_chunk, (chunk,))))
+            if len(pending) >= 2 * workers:
+                yield collect()
+        while pending:
+            yield collect()
+
+
+def clean_reddit_data(reddit_df, stocks, output='data/clean_reddit.csv',
+        workers=1, names=False):
     '''
     Perform general data pre-processing, including removing all posts/comments
     that make no mention of a security in the stocks list. Merge the stock
@@ -64,41 +231,38 @@ def clean_reddit_data(reddit_df, stocks):
     reddit_df : pandas.core.frame.DataFrame
         returned from read_reddit_data()
 
-    stocks : pandas.core.frame.DataFrame
+    stocks : dict<symbol, name>
         returned from read_stock_data
 
+    output : str OR None
+        The file path the clean data is written to, None to only return it
+
+    workers : int
+        The number of worker processes to clean the data with
+
+    names : bool
+        Whether to also match company names, see build_matcher()
+
     Returns
     ----------
     clean_data : pandas.core.frame.DataFrame
     '''
-    #nltk.download('stopwords')
     if args.debug:
         reddit_df = reddit_df.head(10)
-    reddit_df = reddit_df.fillna('empty')
 
-    clean_data = []
-    stops = set(nltk.corpus.stopwords.words('english'))
-    for i in range(len(reddit_df)):
-        text = re.sub(r'[^\w\s]', '', f'{reddit_df.loc[i, "title"]} '\
-            f'{str(reddit_df.loc[i, "body"])}').split(' ')
-        text = [word for word in text if word not in stops]
-        for key in stocks.keys():
-            if key in text:
-                clean_data.append(
-                    {
-                        'stock' : key,
-                        'title' : reddit_df.loc[i, 'title'],
-                        'body' : reddit_df.loc[i, 'body'],
-                        'subreddit' : reddit_df.loc[i, 'subreddit'],
-                        'score' : reddit_df.loc[i, 'score'],
-                        'date' : reddit_df.loc[i, 'date'].split(' ')[0]
-                        # Strip time from date column ^
-                    }
-                )
-
-
-    clean_data = pd.DataFrame(clean_data)
-    clean_data.to_csv('data/clean_reddit.csv')
+    # A few shards per worker keeps them all busy when shards are uneven
+    shard_size = max(1, math.ceil(len(reddit_df) / (4 * workers)))
+    shards = (reddit_df.iloc[i:i + shard_size]
+        for i in range(0, len(reddit_df), shard_size))
+    clean_data = [clean_chunk
+        for _, clean_chunk in clean_chunks(shards, stocks, workers, names)]
+    if clean_data:
+        clean_data = pd.concat(clean_data, ignore_index=True)
+    else:
+        clean_data = pd.DataFrame(columns=CLEAN_COLUMNS)
+    if output is not None:
+        with metrics.timer('write'):
+            clean_data.to_csv(output)
 
     if args.verbose:
         print(f'cleaned data:\n {clean_data}')
@@ -106,7 +270,76 @@ def clean_reddit_data(reddit_df, stocks):
     return clean_data
 
 
+def clean_reddit_data_in_chunks(reddit_data, stocks, chunksize,
+        output='data/clean_reddit.csv', workers=1, names=False):
+    '''
+    Same as clean_reddit_data(), but reads <reddit_data> <chunksize> rows at a
+    time and appends each cleaned chunk to <output>, so only one chunk is ever
+    held in memory. The output is identical to clean_reddit_data()'s
+
+    Parameters
+    ----------
+    reddit_data : str
+        The file path to the reddit csv file
+
+    stocks : dict<symbol, name>
+        returned from read_stock_data
+
+    chunksize : int
+        The number of posts/comments to read at a time
+
+    output : str
+        The file path the clean data is written to
+
+    workers : int
+        The number of worker processes to clean the data with
+
+    names : bool
+        Whether to also match company names, see build_matcher()
+
+    Returns
+    ----------
+    rows_written : int
+        The number of (post, stock) rows written to <output>
+    '''
+    nrows = 10 if args.debug else None
+    chunks = metrics.timed('read',
+        pd.read_csv(reddit_data, chunksize=chunksize, nrows=nrows))
+    rows_read = 0
+    rows_written = 0
+    mode = 'w'
+    for chunk_size, clean_chunk in clean_chunks(chunks, stocks, workers,
+            names):
+        # Keep the index running across chunks, as if written in one go
+        clean_chunk.index += rows_written
+        with metrics.timer('write'):
+            clean_chunk.to_csv(output, mode=mode, header=(mode == 'w'))
+        mode = 'a'
+        rows_read += chunk_size
+        rows_written += len(clean_chunk)
+        if args.verbose:
+            print(f'cleaned {rows_read} posts, {rows_written} rows written')
+
+    if mode == 'w':
+        # Empty input, still write the header
+        pd.DataFrame(columns=CLEAN_COLUMNS).to_csv(output)
+
+    return rows_written
+
+
 if __name__ == '__main__':
-    stocks = read_stock_data('data/symbols_names.csv')
-    reddit_df = read_reddit_data('data/reddit.csv')
-    clean_reddit_data(reddit_df, stocks)
+    args = parser.parse_args()
+    with instrument.profiled(args.profile), metrics.timer('clean'):
+        with metrics.timer('read'):
+            stocks = read_stock_data('data/symbols_names.csv')
+        if args.chunksize:
+            clean_reddit_data_in_chunks('data/reddit.csv', stocks,
+                args.chunksize, workers=args.workers, names=args.names)
+        else:
+            with metrics.timer('read'):
+                reddit_df = read_reddit_data('data/reddit.csv')
+            clean_reddit_data(reddit_df, stocks, workers=args.workers,
+                names=args.names)
+
+    if args.metrics:
+        metrics.write(args.metrics)
@@ -11,21 +11,59 @@ $python collect_stock_data.py -s 2020-01-01 -e 2021-01-01
 $python collect_stock_data.py -p 5y
     collects stock data from 5 years ago to today
 
+$python collect_stock_data.py -p 1d
+    run daily, only downloads the days since the last run
+
+$python collect_stock_data.py --from-reddit data/clean_reddit.csv
+    only collects the stocks mentioned in the cleaned reddit data, over the
+    dates those posts cover
+
+$python collect_stock_data.py -s 2020-01-01 -e 2021-01-01 --backend local \
+    --source canned_data/
+    "collects" the stock data in canned_data/ instead of downloading it,
+    without touching the network
+
 Defaults
 --------
 If no arguments are passed when collect_stock_data is called, the period
-will be set to one month
+will be set to one month. Symbols are downloaded 50 to a request, with 4
+requests in flight at a time, no more than 2 requests per second, and up to 3
+retries of failed requests. Symbols that still fail are listed in
+data/failed_symbols.csv
+
+Collection is incremental: data/stock_data/manifest.json records the dates
+already downloaded for each symbol, and only the missing dates are downloaded
+and merged into the existing csv files. An interrupted run picks up where it
+left off when run again. Use --full to download everything again
+
+Passing --store also consolidates every csv file into a single price store in
+data/price_store (see price_store.py), which simulate.py can read with
+--price-store data/price_store
+
+Passing --metrics PATH writes the time spent downloading, writing and
+building the store, and the number of symbols downloaded and failed to PATH
+(see instrument.py). --profile PATH writes cProfile stats to PATH.
 
 Methods
 -------
 validate_args() -> str
 collect_symbols() -> List
-collect_data() -> None
+reddit_universe(clean_reddit) -> tuple
+get_backend() -> stock_downloader.YahooBackend
+merge_stock_data() -> None
+collect_data() -> stock_downloader.DownloadReport
+
+The command line is only parsed when this file is run as a script, importing
+it uses the defaults of every argument.
 '''
 import os
 import argparse
+import datetime
 import pandas as pd
-import yfinance as yf
+
+import instrument
+import price_store
+import stock_downloader
 
 parser = argparse.ArgumentParser(description='Download Yahoo Finance stock '\
     'data. WARNING: This script may take a very long time to run.')
@@ -39,7 +77,35 @@ parser.add_argument('-p', '--period',
 parser.add_argument('-v', '--verbose', action='store_true', help='Be verbose')
 parser.add_argument('-d', '--debug', action='store_true',
     help='Enter debug mode')
-args = parser.parse_args()
+parser.add_argument('-w', '--workers', type=int, default=4,
+    help='Number of requests to have in flight at once, default: 4')
+parser.add_argument('-b', '--batch-size', type=int, default=50,
+    help='Number of symbols to download per request, default: 50')
+parser.add_argument('-r', '--rate', type=float, default=2.0,
+    help='Maximum number of requests per second, default: 2')
+parser.add_argument('--retries', type=int, default=3,
+    help='Number of times to retry a failed request, default: 3')
+parser.add_argument('--backend', choices=['yahoo', 'local'], default='yahoo',
+    help='Where to get the stock data from, default: yahoo')
+parser.add_argument('--source',
+    help='Directory of <SYMBOL>.csv files to use with --backend local')
+parser.add_argument('--full', action='store_true',
+    help='Download the full date range for every symbol, even dates that '\
+        'have already been downloaded')
+parser.add_argument('--from-reddit', metavar='CLEAN_REDDIT',
+    help='Only collect the stocks mentioned in this file (ex: '\
+        'data/clean_reddit.csv), from the first to the last post\'s date '\
+        'unless --start/--end or --period are given')
+parser.add_argument('--store', action='store_true',
+    help='Also build a consolidated price store in data/price_store')
+parser.add_argument('--metrics',
+    help='Write timings and counters to this file (.prom for Prometheus)')
+parser.add_argument('--profile', help='Write cProfile stats to this file')
+# Replaced by the real command line arguments when run as a script
+args = parser.parse_args([])
+
+metrics = instrument.Metrics('collect_stock_data')
+metrics.rate('symbols_per_second', 'symbols_downloaded', 'download')
 
 
 def validate_args():
@@ -56,6 +122,9 @@ def validate_args():
         date_range will either be a single string when -p was used, or a tuple
         containing the start and end dates when -s and -e were used
     '''
+    if args.backend == 'local' and not args.source:
+        parser.error('ERROR: --backend local requires --source.')
+
     if args.start and not args.end:
         parser.error('ERROR: You must specify an end date with --end, '\
             'or use --period.')
@@ -69,7 +138,7 @@ def validate_args():
         else:
             date_range = (args.start, args.end)
     elif args.period:
-        if args.period not in ['1d', '5d', '1mo', '3mo', '6mo', '1y', '5y', '10y', 'ytd', 'max']:
+        if args.period not in ['1d', '5d', '1mo', '3mo', '6mo', '1y', '2y', '5y', '10y', 'ytd', 'max']:
             parser.error('ERROR: period must be '\
                 f'1d,5d,1mo,3mo,6mo,1y,2y,5y,10y,ytd,max, got {args.period}.')
         date_range = args.period
@@ -108,7 +177,76 @@ def collect_symbols():
     return symbols
 
 
-def collect_data(symbols, date_range):
+def reddit_universe(clean_reddit):
+    '''
+    Finds the stocks the simulation can actually trade: the ones that made it
+    through clean_reddit_data.py, and the dates their posts cover
+
+    Parameters
+    ----------
+    clean_reddit : str
+        The file path to clean_reddit.csv
+
+    Returns
+    -------
+    (symbols, date_range) : tuple(List<str>, tuple(<str>, <str>))
+        The symbols mentioned, and the (start, end) dates from the first
+        post's date up to and including the last post's date
+    '''
+    symbols = set()
+    first, last = None, None
+    for chunk in pd.read_csv(clean_reddit, usecols=['stock', 'date'],
+            chunksize=1_000_000):
+        symbols.update(chunk['stock'].dropna())
+        dates = chunk['date'].dropna().astype(str).str[:10]
+        if not dates.empty:
+            first = min(first or dates.min(), dates.min())
+            last = max(last or dates.max(), dates.max())
+
+    if first is None:
+        return sorted(symbols), None
+    end = datetime.date.fromisoformat(last) + datetime.timedelta(days=1)
+    return sorted(symbols), (first, str(end))
+
+
+def get_backend():
+    '''
+    Creates the backend stock data is downloaded from, as chosen with the
+    --backend flag
+
+    Returns
+    -------
+    backend : stock_downloader.YahooBackend OR stock_downloader.LocalBackend
+    '''
+    if args.backend == 'local':
+        return stock_downloader.LocalBackend(args.source)
+    return stock_downloader.YahooBackend()
+
+
+def merge_stock_data(path, data):
+    '''
+    Merges newly downloaded <data> into the csv file at <path>, newly
+    downloaded rows replace existing rows with the same date
+
+    Parameters
+    ----------
+    path : str
+        The stock's csv file, created if it does not exist
+
+    data : pandas.core.frame.DataFrame
+        The newly downloaded data, indexed by Date
+    '''
+    if os.path.exists(path):
+        existing = pd.read_csv(path, index_col='Date')
+        data = data.copy()
+        data.index = data.index.astype(str).str[:10]
+        existing.index = existing.index.astype(str).str[:10]
+        data = pd.concat([existing, data])
+        data = data[~data.index.duplicated(keep='last')].sort_index()
+    data.to_csv(path)
+
+
+def collect_data(symbols, date_range, backend):
     '''
     Download historic stock market data for each symbol returned by
     collect_symbols(), for each symbol, create a new csv file in the
@@ -123,46 +261,127 @@ def collect_data(symbols, date_range):
     date_range : str OR tuple(<str>, <str>)
         The date range returned by validate_args()
 
+    backend : stock_downloader.YahooBackend OR stock_downloader.LocalBackend
+        Where to download the data from, returned by get_backend()
+
+    Returns
+    -------
+    report : stock_downloader.DownloadReport
+        Which symbols were downloaded, and which failed and why
 
     Outputs
     -------
-    csv file for each stock
+    csv file for each stock, header only for symbols that could not be
+        downloaded
+    data/stock_data/manifest.json recording the dates downloaded
+    data/failed_symbols.csv listing the symbols that could not be downloaded
     '''
     if not os.path.exists('data/stock_data'):
         if args.verbose:
             print('stock data directory not found, creating a new one')
         os.mkdir('data/stock_data')
 
-    if isinstance(date_range, tuple):
-        start, end = date_range
-        if args.verbose:
-            print(f'Collecting data from {start} to {end}')
-        for symbol in symbols:
-            try:
-                data = yf.download(symbol, start=start, end=end)
-
-                data.to_csv(f'data/stock_data/{symbol}.csv')
-            except:
-                print(f'Symbol {symbol} appears to be broken, ignoring')
-                continue
-    else:
-        if args.verbose:
+    if args.verbose:
+        if isinstance(date_range, tuple):
+            print(f'Collecting data from {date_range[0]} to {date_range[1]}')
+        else:
             print(f'Collecting data over a period of {date_range}')
-        for symbol in symbols:
-            try:
-                data = yf.download(symbol, period=date_range)
+    if not isinstance(date_range, tuple):
+        date_range = stock_downloader.period_to_range(date_range)
+    start, end = date_range
+
+    # Group the symbols by the dates they are missing, so each group can be
+    # downloaded in shared batches
+    manifest = stock_downloader.Manifest('data/stock_data/manifest.json')
+    missing = {}
+    for symbol in symbols:
+        if args.full:
+            ranges = [(start, end)]
+        else:
+            ranges = manifest.missing_ranges(symbol, start, end)
+        for missing_range in ranges:
+            missing.setdefault(missing_range, []).append(symbol)
+    if args.verbose:
+        print(f'{sum(map(len, missing.values()))} symbol date ranges to '\
+            f'download, {len(symbols)} symbols')
+
+    report = stock_downloader.DownloadReport()
+    for (range_start, range_end), group in missing.items():
+        def write(symbol, data):
+            path = f'data/stock_data/{symbol}.csv'
+            with metrics.timer('write'):
+                if args.full:
+                    data.to_csv(path)
+                else:
+                    merge_stock_data(path, data)
+                manifest.record(symbol, range_start,
+                    stock_downloader.covered_end(range_end, data), args.full)
 
-                data.to_csv(f'data/stock_data/{symbol}.csv')
-            except:
-                print(f'Symbol: {symbol} appears to be broken, ignoring')
-                continue
+        # Includes the time spent in write(), called as each batch arrives
+        with metrics.timer('download'):
+            group_report = stock_downloader.download(group,
+                (range_start, range_end), backend, write, args.batch_size,
+                args.workers, args.rate, args.retries, verbose=args.verbose)
+        report.succeeded.extend(group_report.succeeded)
+        for symbol, reason in group_report.failed.items():
+            if reason == stock_downloader.NO_DATA and symbol in manifest.coverage:
+                # Nothing to download (ex: no trading days since the last
+                # run), up to today at least
+                covered = stock_downloader.covered_end(range_end)
+                if covered > range_start:
+                    manifest.record(symbol, range_start, covered)
+            else:
+                report.failed[symbol] = reason
+    manifest.save()
+    # A symbol missing dates on both sides of what it covers is downloaded
+    # once per range, but only counted once
+    report.succeeded = list(dict.fromkeys(report.succeeded))
+    for symbol in report.failed:
+        path = f'data/stock_data/{symbol}.csv'
+        if not os.path.exists(path):
+            # A header only placeholder, simulate.py prices the symbol at 0.
+            # It is not recorded in the manifest, so it is retried next run
+            pd.DataFrame(columns=['Date'] + price_store.FIELDS).to_csv(path,
+                index=False)
+    metrics.count('symbols_downloaded', len(report.succeeded))
+    metrics.count('symbols_failed', len(report.failed))
+
+    report.to_frame().to_csv('data/failed_symbols.csv', index=False)
+    for symbol, reason in report.failed.items():
+        print(f'Symbol {symbol} appears to be broken, ignoring ({reason})')
+    if args.verbose:
+        print(f'Downloaded {len(report.succeeded)} symbols, '\
+            f'{len(report.failed)} failed')
+
+    return report
 
 
 if __name__ == '__main__':
+    args = parser.parse_args()
     if not os.path.exists('data/'):
         if args.verbose:
             print('data directory not found, creating a new one')
         os.mkdir('data/')
     date_range = validate_args()
-    symbols = collect_symbols()
-    collect_data(symbols, date_range)
+    backend = get_backend()
+    if args.from_reddit:
+        symbols, reddit_range = reddit_universe(args.from_reddit)
+        if reddit_range and not (args.start or args.end or args.period):
+            date_range = reddit_range
+        if args.verbose:
+            print(f'{len(symbols)} symbols mentioned in {args.from_reddit}')
+    elif args.backend == 'local':
+        symbols = backend.symbols()
+    else:
+        symbols = collect_symbols()
+    with instrument.profiled(args.profile):
+        collect_data(symbols, date_range, backend)
+        if args.store:
+            if args.verbose:
+                print('Building price store in data/price_store')
+            with metrics.timer('store'):
+                price_store.build_from_csv_dir('data/stock_data',
+                    'data/price_store')
+
+    if args.metrics:
+        metrics.write(args.metrics)
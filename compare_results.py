@@ -1,21 +1,252 @@
+'''
+Plots how each subreddit's portfolio value changed over time, for every
+data/results/<subreddit>_p_value.csv file simulate.py wrote. The series are
+aligned on their dates, so subreddits simulated over different days can be
+compared.
+
+Long series are downsampled before plotting with Largest-Triangle-Three-
+Buckets (LTTB)[1], which keeps the points that define the shape of the line
+(peaks, troughs, jumps) rather than every nth point, so even millions of
+points per series render quickly and look the same as the full series.
+
+[1] Steinarsson, S. (2013). Downsampling Time Series for Visual
+Representation. MSc thesis, University of Iceland.
+
+Usage examples
+--------------
+$python compare_results.py
+    shows the plot in a window
+
+$python compare_results.py -o results.png
+    writes the plot to results.png without opening a window (.svg, .pdf, ...
+    work too), for use on machines with no display
+
+$python compare_results.py --db data/results/results.sqlite --runs 3 4
+    plots runs 3 and 4 from the results store simulate.py records to (see
+    results_store.py), the latest run if --runs is not given
+
+Arguments
+---------
+-r --results-dir : The directory holding the results, default: data/results
+-o --output : Write the plot to this file instead of showing it
+-m --max-points : Downsample each series to at most this many points,
+    default: 2000, 0 to plot every point
+--db : Plot runs from this results store instead of the csv files
+--runs : The run ids to plot from --db, default: the latest run
+
+Methods
+-------
+read_results(results_dir -> str, max_points -> int)
+    -> pandas.core.frame.DataFrame
+read_db_results(path -> str, run_ids -> List<int>, max_points -> int)
+    -> pandas.core.frame.DataFrame
+lttb(x -> numpy.ndarray, y -> numpy.ndarray, n_out -> int) -> numpy.ndarray
+downsample(series -> pandas.core.series.Series, max_points -> int)
+    -> pandas.core.series.Series
+plot_results(results -> pandas.core.frame.DataFrame, output -> str) -> None
+'''
+import argparse
+import glob
+import os
+
+import numpy as np
 import pandas as pd
 
-import matplotlib.pyplot as plt
-
-wallstreetbets = pd.read_csv('data/results/wallstreetbets_p_value.csv')
-stocks = pd.read_csv('data/results/stocks_p_value.csv')
-investing = pd.read_csv('data/results/investing_p_value.csv')
-
-dates = wallstreetbets['Unnamed: 0']
-df = pd.DataFrame()
-df['date'] = dates
-df['stocks'] = stocks['0']
-df['investing'] = investing['0']
-df['wallstreetbets'] = wallstreetbets['0']
-
-plt.plot(df['date'], df['stocks'], label = 'r/stocks', linestyle='-')
-plt.plot(df['date'], df['investing'], label = 'r/investing')
-plt.plot(df['date'], df['wallstreetbets'], label = 'r/wallstreetbets')
-plt.xlabel('date')
-plt.ylabel('portfolio value')
-plt.show()
+from results_store import ResultsStore
+
+parser = argparse.ArgumentParser(description='Plot portfolio values')
+parser.add_argument('-r', '--results-dir', default='data/results',
+    help='Directory holding the results, default: data/results')
+parser.add_argument('-o', '--output',
+    help='Write the plot to this file (ex: results.png) instead of showing it')
+parser.add_argument('-m', '--max-points', type=int, default=2000,
+    help='Downsample each series to at most this many points, default: '\
+        '2000, 0 to plot every point')
+parser.add_argument('--db',
+    help='Plot runs from this results store (see results_store.py) instead '\
+        'of the csv files')
+parser.add_argument('--runs', type=int, nargs='+',
+    help='The run ids to plot from --db, default: the latest run')
+
+MAX_LEGEND_ENTRIES = 20
+
+
+def lttb(x, y, n_out):
+    '''
+    Picks <n_out> of the points (<x>, <y>) that best preserve the shape of
+    the line through them, using Largest-Triangle-Three-Buckets. The first
+    and last points are always kept, the rest are split into <n_out> - 2
+    buckets and from each bucket the point forming the largest triangle with
+    the previously picked point and the average of the next bucket is kept
+
+    Parameters
+    ----------
+    x : numpy.ndarray<float64>
+        The x coordinates, sorted
+
+    y : numpy.ndarray<float64>
+        The y coordinates
+
+    n_out : int
+        The number of points to keep
+
+    Returns
+    -------
+    indices : numpy.ndarray<int64>
+        The indices of the points kept, in order
+    '''
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    picked = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_end = end, edges[bucket + 2]
+        else:
+            next_start, next_end = n - 1, n
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+
+        # Twice the area of each candidate's triangle, the constant factor
+        # does not change which is largest
+        areas = np.abs((x[picked] - next_x) * (y[start:end] - y[picked])
+            - (x[picked] - x[start:end]) * (next_y - y[picked]))
+        picked = start + int(np.argmax(areas))
+        indices[bucket + 1] = picked
+
+    return indices
+
+
+def downsample(series, max_points):
+    '''
+    Downsamples <series> (indexed by date) to at most <max_points> points
+    with lttb(), missing values are dropped
+
+    Returns
+    -------
+    pandas.core.series.Series
+    '''
+    series = series.dropna()
+    if not max_points or len(series) <= max_points:
+        return series
+
+    x = series.index.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    indices = lttb(x.astype(np.float64), series.to_numpy(dtype=np.float64),
+        max_points)
+    return series.iloc[indices]
+
+
+def read_results(results_dir='data/results', max_points=2000):
+    '''
+    Reads every <subreddit>_p_value.csv file in <results_dir>, downsampling
+    each series to <max_points> points before reading the next one, so only
+    one full series is ever held at once
+
+    Returns
+    -------
+    results : pandas.core.frame.DataFrame
+        One column per subreddit, indexed by date (the union of every
+        series' dates, NaN where a series has no point)
+    '''
+    series = []
+    for path in sorted(glob.glob(os.path.join(results_dir, '*_p_value.csv'))):
+        subreddit = os.path.basename(path)[:-len('_p_value.csv')]
+        values = pd.read_csv(path, index_col=0).iloc[:, 0]
+        values.index = pd.to_datetime(values.index)
+        series.append(downsample(values, max_points).rename(subreddit))
+
+    if not series:
+        return pd.DataFrame()
+    return pd.concat(series, axis=1, join='outer', sort=True)
+
+
+def read_db_results(path, run_ids=None, max_points=2000):
+    '''
+    Reads the daily portfolio values of runs <run_ids> (the latest run if
+    None) from the results store at <path>, downsampling each series
+
+    Returns
+    -------
+    results : pandas.core.frame.DataFrame
+        See read_results(), the columns are named <trader> when plotting a
+        single run and <trader> (run <run_id>) otherwise
+
+    Raises FileNotFoundError if there is no results store at <path>, rather
+    than creating an empty one there
+    '''
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'No results store at {path}')
+    store = ResultsStore(path)
+    try:
+        if run_ids is None:
+            run_ids = store.runs().index[-1:].tolist()
+        series = []
+        for run_id in run_ids:
+            values = store.daily_values(run_id)
+            for trader, trader_values in values.groupby('trader', sort=True):
+                name = trader if len(run_ids) == 1 \
+                    else f'{trader} (run {run_id})'
+                trader_values = pd.Series(trader_values['value'].to_numpy(),
+                    index=pd.to_datetime(trader_values['date']), name=name)
+                series.append(downsample(trader_values, max_points))
+    finally:
+        store.close()
+
+    if not series:
+        return pd.DataFrame()
+    return pd.concat(series, axis=1, join='outer', sort=True)
+
+
+def plot_results(results, output=None):
+    '''
+    Plots each column of <results> (see read_results) as a line
+
+    Parameters
+    ----------
+    results : pandas.core.frame.DataFrame
+
+    output : str OR None
+        The file to write the plot to (its extension picks the format, ex:
+        .png or .svg), None to show it in a window instead
+    '''
+    import matplotlib
+    if output is not None:
+        # Renders without a display
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(12, 6))
+    for subreddit in results.columns:
+        values = results[subreddit].dropna()
+        ax.plot(values.index, values.to_numpy(), label=f'r/{subreddit}')
+    ax.set_xlabel('date')
+    ax.set_ylabel('portfolio value')
+    # A legend of hundreds of runs would hide the plot
+    if len(results.columns) <= MAX_LEGEND_ENTRIES:
+        ax.legend()
+
+    if output is not None:
+        fig.savefig(output, bbox_inches='tight')
+        plt.close(fig)
+    else:
+        plt.show()
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.db and not os.path.exists(args.db):
+        parser.error(f'ERROR: --db {args.db} does not exist.')
+    if args.db:
+        results = read_db_results(args.db, args.runs, args.max_points)
+    else:
+        results = read_results(args.results_dir, args.max_points)
+    if results.empty:
+        print(f'No results found in {args.db or args.results_dir}')
+    else:
+        plot_results(results, args.output)
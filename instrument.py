@@ -0,0 +1,244 @@
+'''
+Lightweight instrumentation shared by the pipeline's scripts: named timers
+around each stage (read, clean, match, score, trade, valuation, write, ...),
+counters (posts, matches, cache hits, failed price lookups, ...), rates
+derived from the two (ex: posts per second) and samples of the process's
+peak resident set size (RSS). Each script keeps one Metrics object for the
+run and, when given --metrics PATH, writes its report there, either as JSON
+or, if PATH ends in .prom, in the Prometheus textfile format (for
+node_exporter's textfile collector).
+
+--profile PATH runs the script under cProfile and writes the stats to PATH,
+read them with ex: python -m pstats PATH. Work done in worker processes is
+not included in the profile.
+
+Objects
+-------
+Metrics
+    timer(name -> str) -> context manager
+    timed(name -> str, iterable) -> generator
+    count(name -> str, n -> int) -> None
+    rate(name -> str, counter -> str, timer -> str) -> None
+    report() -> dict
+    write(path -> str) -> None
+
+Methods
+-------
+peak_rss_mb() -> float
+profiled(path -> str) -> context manager
+'''
+import contextlib
+import cProfile
+import json
+import os
+import re
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is reported as None there
+    resource = None
+
+
+def peak_rss_mb():
+    '''
+    Returns
+    -------
+    peak : float OR None
+        The most memory (RSS) this process has held at once so far, in MB
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes everywhere else
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+@contextlib.contextmanager
+def profiled(path):
+    '''
+    Runs the body of the with statement under cProfile, writing the stats to
+    <path>. Does nothing if <path> is None
+    '''
+    if path is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+class Metrics():
+    '''
+    The timers, counters and rates collected over one run of a script
+
+    Attributes
+    ----------
+    self.script : str
+        The name of the script being measured (ex: simulate)
+
+    self.timers : dict<str, dict>
+        For each timer, the number of times it ran (calls), the total time
+        spent in it (seconds) and the process's peak RSS the last time it
+        finished (peak_rss_mb)
+
+    self.counters : dict<str, int>
+        The running total of each counter
+
+    self.rates : dict<str, tuple(<str>, <str>)>
+        For each rate, the counter and the timer it is the quotient of
+
+    Methods
+    -------
+    timer(name -> str) -> context manager
+    timed(name -> str, iterable) -> generator
+    count(name -> str, n -> int) -> None
+    rate(name -> str, counter -> str, timer -> str) -> None
+    report() -> dict
+    write(path -> str) -> None
+    '''
+    def __init__(self, script):
+        self.script = script
+        self.timers = {}
+        self.counters = {}
+        self.rates = {}
+        self._started = time.perf_counter()
+
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        '''
+        Times the body of the with statement, adding it to the timer <name>
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+
+    def add_time(self, name, seconds):
+        '''
+        Adds <seconds> to the timer <name> and samples the peak RSS
+        '''
+        timer = self.timers.setdefault(name,
+            {'calls': 0, 'seconds': 0.0, 'peak_rss_mb': None})
+        timer['calls'] += 1
+        timer['seconds'] += seconds
+        timer['peak_rss_mb'] = peak_rss_mb()
+
+
+    def timed(self, name, iterable):
+        '''
+        Yields each item of <iterable>, adding the time spent producing the
+        items (ex: reading chunks of a csv file) to the timer <name>
+        '''
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add_time(name, time.perf_counter() - start)
+            yield item
+
+
+    def count(self, name, n=1):
+        '''
+        Adds <n> to the counter <name>
+        '''
+        self.counters[name] = self.counters.get(name, 0) + n
+
+
+    def rate(self, name, counter, timer):
+        '''
+        Reports <counter> per second of <timer> as <name> (ex: rate(
+        'posts_per_second', 'posts', 'clean'))
+        '''
+        self.rates[name] = (counter, timer)
+
+
+    def report(self):
+        '''
+        Returns
+        -------
+        report : dict
+            Everything measured so far, in the form written by write()
+        '''
+        rates = {}
+        for name, (counter, timer) in self.rates.items():
+            seconds = self.timers.get(timer, {}).get('seconds', 0)
+            if seconds:
+                rates[name] = self.counters.get(counter, 0) / seconds
+
+        return {
+            'script' : self.script,
+            'elapsed_seconds' : time.perf_counter() - self._started,
+            'peak_rss_mb' : peak_rss_mb(),
+            'timers' : self.timers,
+            'counters' : self.counters,
+            'rates' : rates,
+        }
+
+
+    def to_prometheus(self):
+        '''
+        Returns
+        -------
+        text : str
+            report() in the Prometheus text exposition format
+        '''
+        report = self.report()
+        script = f'script="{self.script}"'
+        lines = []
+
+        def metric(name, kind, samples):
+            lines.append(f'# TYPE pipeline_{name} {kind}')
+            for labels, value in samples:
+                if value is not None:
+                    lines.append(f'pipeline_{name}{{{labels}}} {value}')
+
+        metric('run_seconds', 'gauge', [(script, report['elapsed_seconds'])])
+        if report['peak_rss_mb'] is not None:
+            metric('peak_rss_bytes', 'gauge',
+                [(script, int(report['peak_rss_mb'] * 2 ** 20))])
+        timers = sorted(report['timers'].items())
+        metric('stage_seconds_total', 'counter',
+            [(f'{script},stage="{name}"', timer['seconds'])
+                for name, timer in timers])
+        metric('stage_calls_total', 'counter',
+            [(f'{script},stage="{name}"', timer['calls'])
+                for name, timer in timers])
+        for name, value in sorted(report['counters'].items()):
+            metric(f'{_metric_name(name)}_total', 'counter', [(script, value)])
+        for name, value in sorted(report['rates'].items()):
+            metric(_metric_name(name), 'gauge', [(script, value)])
+
+        return '\n'.join(lines) + '\n'
+
+
+    def write(self, path):
+        '''
+        Writes report() to <path>, in the Prometheus textfile format if
+        <path> ends in .prom and as JSON otherwise. The previous file is
+        replaced in one step, so a collector never reads a half written one
+        '''
+        with open(f'{path}.tmp', 'w') as f:
+            if path.endswith('.prom'):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.report(), f, indent=2)
+        os.replace(f'{path}.tmp', path)
+
+
+def _metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
@@ -0,0 +1,626 @@
+'''
+Runs the whole analysis, clean -> score -> simulate, in a single process.
+Each stage hands its DataFrame straight to the next one instead of writing it
+to a csv file for the next script to read back in.
+
+Every stage's output is cached in data/pipeline_cache/, keyed by a
+fingerprint of everything the stage depends on: its input files (their
+path, size and modification time), its settings, the code implementing it and
+the fingerprint of the stage before it. A stage whose fingerprint has not
+changed since the last run is skipped and its cached output used instead, so
+rerunning the pipeline after, ex: changing --start, only re-runs the
+simulation.
+
+Usage examples
+--------------
+$python pipeline.py
+    cleans data/reddit.csv, scores it and simulates each subreddit's
+    portfolio, writing the results to data/results/ like simulate.py
+
+$python pipeline.py --engine vectorized --price-store data/price_store -w 8
+
+$python pipeline.py --write-csv
+    also writes data/clean_reddit.csv and data/scored_reddit.csv, for use
+    with the individual scripts
+
+$python pipeline.py --incremental
+    run daily, after new posts have been appended to data/reddit.csv: only
+    the new posts are cleaned and scored, and each trader resumes from where
+    the last run left off, simulating only the new trading days
+
+Incremental mode
+----------------
+data/online_state.json records how far into data/reddit.csv (in bytes) the
+last incremental run read, the last day it simulated, a checkpoint of each
+trader's portfolio (see simulate.Trader.checkpoint) and the scored posts
+dated after that day. Each run reads only the posts appended since,
+simulates the trading days after the last one up to --end, then updates the
+state. By default --end is the day before the newest post's date, as posts
+for the newest day may still be coming in. The first run, with no state,
+reads every post and simulates from --start. Posts appended late, dated on
+days that were already simulated, are not traded on. Incremental runs always
+use the loop engine, which can resume mid-simulation.
+
+Arguments
+---------
+-v --verbose : Be verbose
+-w --workers : Number of worker processes to clean and score the data with
+-n --names : Also match company names, see clean_reddit_data.py
+-c --cache : File to cache sentiment scores in, see sentiment_analyzer.py
+-m --mode : post or window, see sentiment_analyzer.py
+--window : Sentences either side of each mention to score with --mode window
+--no-cache : Score every text from scratch
+-e --engine : loop or vectorized, see simulate.py
+-s --subreddits : The subreddits to simulate
+--all-subreddits : Simulate every subreddit in the data
+--start : The first day of the simulation (YYYY-MM-DD)
+--end : The last day of the simulation (YYYY-MM-DD)
+-a --asof : See simulate.py
+-p --price-store : Read stock prices from a price store
+--stage-cache : Directory to cache each stage's output in, default:
+    data/pipeline_cache
+--force : Run every stage, even those whose output is cached
+--write-csv : Also write data/clean_reddit.csv and data/scored_reddit.csv
+--incremental : Only process posts added since the last incremental run
+--state : The incremental run's state file, default: data/online_state.json
+--results-db : Also record every run, its holdings and daily portfolio values
+    in this results store (see results_store.py), default:
+    data/results/results.sqlite. The csv files are still written
+--no-results-db : Do not record the results in the results store
+--metrics : Write the time spent in each stage to this file
+--profile : Write cProfile stats to this file
+
+Objects
+-------
+StageCache
+    get(stage -> str, key -> str) -> object
+    put(stage -> str, key -> str, output -> object) -> None
+
+Methods
+-------
+file_fingerprint(path -> str) -> tuple
+fingerprint(*parts) -> str
+mention_matcher(symbols_names -> str, names -> bool, mode -> str)
+    -> symbol_matcher.SymbolMatcher
+run_pipeline(...) -> dict
+read_new_posts(reddit_data -> str, offset -> int) -> tuple
+run_incremental(...) -> dict
+'''
+import argparse
+import datetime
+import glob
+import hashlib
+import io
+import json
+import os
+import pickle
+
+import pandas as pd
+
+import clean_reddit_data
+import instrument
+import price_store
+import sentiment_analyzer
+import simulate
+import symbol_matcher
+import trading_calendar
+from results_store import ResultsStore
+
+parser = argparse.ArgumentParser(description='Clean, score and simulate in '\
+    'one process')
+parser.add_argument('-v', '--verbose', action='store_true', help='Be verbose')
+parser.add_argument('-w', '--workers', type=int, default=1,
+    help='Number of worker processes to clean and score with, default: 1')
+parser.add_argument('-n', '--names', action='store_true',
+    help='Also match company names (ex: Apple for AAPL), not just symbols')
+parser.add_argument('-c', '--cache', default='data/sentiment_cache.sqlite',
+    help='File to cache sentiment scores in, '\
+        'default: data/sentiment_cache.sqlite')
+parser.add_argument('--no-cache', action='store_true',
+    help='Score every text from scratch without reading or writing the cache')
+parser.add_argument('-m', '--mode', choices=['post', 'window'], default='post',
+    help='Score whole posts or only the sentences mentioning each stock, see '\
+        'sentiment_analyzer.py')
+parser.add_argument('--window', type=int, default=0,
+    help='With --mode window, also score this many sentences either side of '\
+        'each mention, default: 0')
+parser.add_argument('-e', '--engine', choices=['loop', 'vectorized'],
+    default='loop', help='Simulation engine, see simulate.py')
+parser.add_argument('-s', '--subreddits', nargs='+',
+    default=['wallstreetbets', 'investing', 'stocks'],
+    help='Subreddits to simulate, default: wallstreetbets investing stocks')
+parser.add_argument('--all-subreddits', action='store_true',
+    help='Simulate every subreddit in the data')
+parser.add_argument('--start', type=datetime.date.fromisoformat,
+    default=datetime.date(2019, 4, 27),
+    help='First day of the simulation, default: 2019-04-27')
+parser.add_argument('--end', type=datetime.date.fromisoformat,
+    help='Last day of the simulation, default: 2021-01-27, or the newest '\
+        "post's date with --incremental")
+parser.add_argument('-a', '--asof', action='store_true',
+    help='Use the last known open price when a stock has no price on a date')
+parser.add_argument('-p', '--price-store',
+    help='Read stock prices from this price store (see price_store.py) '\
+        'instead of the csv files in data/stock_data')
+parser.add_argument('--stage-cache', default='data/pipeline_cache',
+    help='Directory to cache stage outputs in, default: data/pipeline_cache')
+parser.add_argument('--force', action='store_true',
+    help='Run every stage, even those whose output is cached')
+parser.add_argument('--write-csv', action='store_true',
+    help='Also write data/clean_reddit.csv and data/scored_reddit.csv')
+parser.add_argument('--incremental', action='store_true',
+    help='Only clean, score and simulate what is new since the last '\
+        'incremental run')
+parser.add_argument('--state', default='data/online_state.json',
+    help='State file of --incremental, default: data/online_state.json')
+parser.add_argument('--results-db', default='data/results/results.sqlite',
+    help='Also record the results in this results store (see '\
+        'results_store.py), default: data/results/results.sqlite')
+parser.add_argument('--no-results-db', action='store_true',
+    help='Do not record the results in the results store')
+parser.add_argument('--metrics',
+    help='Write timings and counters to this file (.prom for Prometheus)')
+parser.add_argument('--profile', help='Write cProfile stats to this file')
+# Replaced by the real command line arguments when run as a script
+args = parser.parse_args([])
+
+metrics = instrument.Metrics('pipeline')
+
+# The last day simulated when --end is not given, outside of --incremental
+DEFAULT_END = datetime.date(2021, 1, 27)
+
+
+def file_fingerprint(path):
+    '''
+    Identifies the current version of the file (or every file in the
+    directory) at <path> by name, size and modification time, which is far
+    cheaper than hashing the contents of gigabytes of data
+
+    Returns
+    -------
+    fingerprint : tuple
+    '''
+    if os.path.isdir(path):
+        return tuple(file_fingerprint(os.path.join(path, name))
+            for name in sorted(os.listdir(path)))
+    if not os.path.exists(path):
+        return (path, None)
+    stat = os.stat(path)
+    return (path, stat.st_size, stat.st_mtime_ns)
+
+
+def fingerprint(*parts):
+    '''
+    Hashes <parts> (anything with a stable repr(), ex: settings and
+    file_fingerprint()s) into a key
+
+    Returns
+    -------
+    key : str
+    '''
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+
+class StageCache():
+    '''
+    Pickled outputs of the pipeline's stages, one file per stage named
+    <stage>-<key>.pkl. Only the latest output of each stage is kept
+
+    Attributes
+    ----------
+    self.cache_dir : str
+        The directory holding the cached outputs
+
+    Methods
+    -------
+    get(stage -> str, key -> str) -> object
+    put(stage -> str, key -> str, output -> object) -> None
+    '''
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+    def _path(self, stage, key):
+        return os.path.join(self.cache_dir, f'{stage}-{key}.pkl')
+
+
+    def get(self, stage, key):
+        '''
+        Returns
+        -------
+        output : object OR None
+            <stage>'s output cached under <key>, None if there is none
+        '''
+        path = self._path(stage, key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+    def put(self, stage, key, output):
+        '''
+        Caches <output> as <stage>'s output under <key>, replacing any
+        output cached for <stage> under a different key
+        '''
+        path = self._path(stage, key)
+        with open(f'{path}.tmp', 'wb') as f:
+            pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f'{path}.tmp', path)
+        for stale in glob.glob(self._path(glob.escape(stage), '*')):
+            if stale != path:
+                os.remove(stale)
+
+
+def _run_stage(cache, stage, key, run, force=False, verbose=False):
+    output = None if force else cache.get(stage, key)
+    if output is not None:
+        metrics.count('stages_cached')
+        if verbose:
+            print(f'{stage}: inputs unchanged, using cached output')
+        return output
+
+    with metrics.timer(stage):
+        output = run()
+    cache.put(stage, key, output)
+    metrics.count('stages_run')
+    if verbose:
+        print(f'{stage}: done')
+    return output
+
+
+def mention_matcher(symbols_names, names, mode):
+    '''
+    Builds the matcher sentiment_analyzer.score_data uses to find the
+    sentences mentioning each stock, None when posts are scored whole
+
+    Returns
+    -------
+    matcher : symbol_matcher.SymbolMatcher OR None
+    '''
+    if mode != 'window':
+        return None
+    return symbol_matcher.SymbolMatcher(
+        clean_reddit_data.read_stock_data(symbols_names), names=names)
+
+
+def _record_run(results_db, config, results):
+    # Records a run the same way simulate.py does, see run_pipeline() for
+    # the form of <results>
+    store = ResultsStore(results_db)
+    try:
+        run_id = store.start_run({'script': 'pipeline', **config})
+        for subreddit, result in results.items():
+            store.record_portfolio(run_id, subreddit, result['owned_stocks'],
+                result['dated_portfolio_values'],
+                result.get('dated_cost_basis'))
+    finally:
+        store.close()
+
+
+def run_pipeline(reddit_data='data/reddit.csv',
+        symbols_names='data/symbols_names.csv', stock_data_dir='data/stock_data',
+        store_path=None, subreddits=('wallstreetbets', 'investing', 'stocks'),
+        start_date=datetime.date(2019, 4, 27),
+        end_date=DEFAULT_END, engine='loop', asof=False,
+        workers=1, names=False, sentiment_cache='data/sentiment_cache.sqlite',
+        stage_cache='data/pipeline_cache', force=False, write_csv=False,
+        verbose=False, mode='post', window=0,
+        results_db='data/results/results.sqlite'):
+    '''
+    Cleans <reddit_data>, scores it and simulates each of <subreddits>,
+    writing each trader's portfolio to data/results/ (see
+    simulate.write_portfolio) and recording the run in <results_db>
+
+    Parameters
+    ----------
+    reddit_data : str
+        The file path to the reddit csv file
+
+    symbols_names : str
+        The file path to the csv file of stock symbols and company names
+
+    stock_data_dir : str
+        Filepath to directory containing all the csv files for each stock
+
+    store_path : str OR None
+        If given, the price store to read stock prices from instead
+
+    subreddits : iterable<str> OR None
+        The subreddits to simulate, None for every subreddit in the data
+
+    start_date, end_date : datetime.date
+        The first and last day of the simulation
+
+    engine : str
+        loop or vectorized, see simulate.Market
+
+    asof : bool
+        See simulate.Stock.get_open
+
+    workers : int
+        The number of worker processes to clean and score the data with
+
+    names : bool
+        Whether to also match company names, see clean_reddit_data
+
+    sentiment_cache : str OR None
+        The file to cache sentiment scores in, None to not cache them
+
+    stage_cache : str
+        The directory to cache each stage's output in
+
+    force : bool
+        Whether to run every stage, even those whose output is cached
+
+    write_csv : bool
+        Whether to also write data/clean_reddit.csv and
+        data/scored_reddit.csv
+
+    verbose : bool
+        Whether to report progress
+
+    mode, window
+        How posts are scored, see sentiment_analyzer.score_data
+
+    results_db : str OR None
+        The results store (see results_store.py) to record the run in, None
+        to not record it
+
+    Returns
+    -------
+    outputs : dict
+        The output of each stage: clean and scored (DataFrames), and results
+        (for each subreddit, a dictionary of its owned_stocks, cost_basis,
+        dated_portfolio_values and dated_cost_basis)
+    '''
+    cache = StageCache(stage_cache)
+
+    def clean():
+        stocks = clean_reddit_data.read_stock_data(symbols_names)
+        reddit_df = clean_reddit_data.read_reddit_data(reddit_data)
+        return clean_reddit_data.clean_reddit_data(reddit_df, stocks, None,
+            workers, names)
+
+    clean_key = fingerprint(file_fingerprint(reddit_data),
+        file_fingerprint(symbols_names), names,
+        file_fingerprint(clean_reddit_data.__file__),
+        file_fingerprint(symbol_matcher.__file__))
+    clean_data = _run_stage(cache, 'clean', clean_key, clean, force, verbose)
+
+    def score():
+        scores_cache = None
+        if sentiment_cache is not None:
+            scores_cache = sentiment_analyzer.SentimentCache(sentiment_cache)
+        try:
+            return sentiment_analyzer.score_data(clean_data, workers,
+                scores_cache, mode, window,
+                mention_matcher(symbols_names, names, mode))
+        finally:
+            if scores_cache is not None:
+                scores_cache.close()
+
+    score_key = fingerprint(clean_key, sentiment_analyzer.CACHE_VERSION,
+        mode, window, file_fingerprint(sentiment_analyzer.__file__))
+    scored = _run_stage(cache, 'score', score_key, score, force, verbose)
+
+    if subreddits is None:
+        subreddits = sorted(scored['subreddit'].unique())
+    subreddits = list(subreddits)
+
+    def simulate_traders():
+        store = price_store.PriceStore(store_path) if store_path else None
+        data = simulate.compact_data(scored)
+        traders = [simulate.Trader(subreddit, data)
+            for subreddit in subreddits]
+        market = simulate.Market(traders, stock_data_dir, start_date,
+            end_date, store=store, asof=asof)
+        if engine == 'vectorized':
+            market.simulate_vectorized()
+        else:
+            market.simulate()
+        return {trader.subreddit: {
+            'owned_stocks' : trader.owned_stocks,
+            'cost_basis' : trader.cost_basis,
+            'dated_portfolio_values' : trader.dated_portfolio_values,
+            'dated_cost_basis' : trader.dated_cost_basis,
+        } for trader in traders}
+
+    prices = store_path if store_path else stock_data_dir
+    simulate_key = fingerprint(score_key, file_fingerprint(prices), subreddits,
+        start_date, end_date, engine, asof,
+        file_fingerprint(simulate.__file__),
+        file_fingerprint(trading_calendar.__file__))
+    os.makedirs('data/results', exist_ok=True)
+    results = _run_stage(cache, 'simulate', simulate_key, simulate_traders,
+        force, verbose)
+    # Written even when the simulation was skipped, so data/results/ always
+    # matches this run
+    for subreddit, result in results.items():
+        simulate.write_portfolio(subreddit, result['owned_stocks'],
+            result['dated_portfolio_values'])
+    if results_db is not None:
+        with metrics.timer('record'):
+            _record_run(results_db, {'engine': engine,
+                'subreddits': subreddits, 'start': start_date,
+                'end': end_date, 'asof': asof, 'price_store': store_path,
+                'mode': mode, 'window': window}, results)
+
+    if write_csv:
+        clean_data.to_csv('data/clean_reddit.csv')
+        scored.to_csv('data/scored_reddit.csv')
+
+    return {'clean': clean_data, 'scored': scored, 'results': results}
+
+
+def read_new_posts(reddit_data, offset=0):
+    '''
+    Reads the posts appended to <reddit_data> after the first <offset> bytes,
+    without reading the rest of the file
+
+    Returns
+    -------
+    (reddit_df, offset) : tuple(pandas.core.frame.DataFrame, int)
+        The new posts, and the offset to read from next time
+    '''
+    with open(reddit_data, 'rb') as f:
+        header = f.readline()
+        offset = max(offset, len(header))
+        if offset > os.fstat(f.fileno()).st_size:
+            raise ValueError(f'{reddit_data} is shorter than when it was last '\
+                'read, delete the incremental state to start over')
+        f.seek(offset)
+        new = f.read()
+
+    # Leave a partially written last line for the next run
+    new = new[:new.rfind(b'\n') + 1]
+    return pd.read_csv(io.BytesIO(header + new)), offset + len(new)
+
+
+def run_incremental(reddit_data='data/reddit.csv',
+        symbols_names='data/symbols_names.csv', stock_data_dir='data/stock_data',
+        store_path=None, subreddits=('wallstreetbets', 'investing', 'stocks'),
+        start_date=datetime.date(2019, 4, 27), end_date=None, asof=False,
+        workers=1, names=False, sentiment_cache='data/sentiment_cache.sqlite',
+        state_path='data/online_state.json', verbose=False, mode='post',
+        window=0, results_db='data/results/results.sqlite'):
+    '''
+    Cleans and scores the posts appended to <reddit_data> since the last
+    incremental run, then resumes each trader from its checkpoint and
+    simulates the trading days since the last run, up to <end_date>. Each
+    trader's whole portfolio history is written to data/results/ and
+    recorded as a run in <results_db>
+
+    Parameters
+    ----------
+    end_date : datetime.date OR None
+        The last day to simulate, None for the day before the newest post's
+        date
+
+    state_path : str
+        The file the watermark and checkpoints are kept in
+
+    See run_pipeline() for the rest
+
+    Returns
+    -------
+    state : dict
+        The new state, as written to <state_path>
+    '''
+    state = {'offset': 0, 'last_day': None, 'traders': {}, 'pending': []}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+
+    with metrics.timer('read'):
+        reddit_df, offset = read_new_posts(reddit_data, state['offset'])
+    metrics.count('new_posts', len(reddit_df))
+    with metrics.timer('clean'):
+        stocks = clean_reddit_data.read_stock_data(symbols_names)
+        clean_data = clean_reddit_data.clean_reddit_data(reddit_df, stocks,
+            None, workers, names)
+    with metrics.timer('score'):
+        scores_cache = None
+        if sentiment_cache is not None:
+            scores_cache = sentiment_analyzer.SentimentCache(sentiment_cache)
+        try:
+            scored = sentiment_analyzer.score_data(clean_data, workers,
+                scores_cache, mode, window,
+                mention_matcher(symbols_names, names, mode))
+        finally:
+            if scores_cache is not None:
+                scores_cache.close()
+    # Posts left over from the last run come first, as they came first in
+    # <reddit_data>
+    scored = pd.concat([pd.DataFrame(state['pending'],
+        columns=scored.columns).astype(scored.dtypes), scored],
+        ignore_index=True)
+
+    if subreddits is None:
+        subreddits = sorted(set(scored['subreddit']) | set(state['traders']))
+    if state['last_day'] is not None:
+        start_date = datetime.date.fromisoformat(state['last_day']) \
+            + datetime.timedelta(days=1)
+    if end_date is None:
+        newest = max(scored['date'], default=None)
+        end_date = datetime.date.fromisoformat(newest) if newest \
+            else start_date
+        end_date -= datetime.timedelta(days=1)
+    if verbose:
+        print(f'{len(reddit_df)} new posts, {len(clean_data)} mentions, '\
+            f'simulating {start_date} to {end_date}')
+
+    with metrics.timer('simulate'):
+        store = price_store.PriceStore(store_path) if store_path else None
+        data = simulate.compact_data(scored)
+        traders = []
+        for subreddit in subreddits:
+            trader = simulate.Trader(subreddit, data)
+            if subreddit in state['traders']:
+                trader.restore(state['traders'][subreddit])
+            traders.append(trader)
+        os.makedirs('data/results', exist_ok=True)
+        market = simulate.Market(traders, stock_data_dir, start_date, end_date,
+            store=store, asof=asof)
+        market.simulate()
+    metrics.count('trader_days', len(traders) * len(list(market.trading_days())))
+    if results_db is not None:
+        with metrics.timer('record'):
+            _record_run(results_db, {'engine': 'loop', 'incremental': True,
+                'subreddits': subreddits, 'start': start_date,
+                'end': end_date, 'asof': asof, 'price_store': store_path,
+                'mode': mode, 'window': window},
+                {trader.subreddit: {
+                    'owned_stocks' : trader.owned_stocks,
+                    'dated_portfolio_values' : trader.dated_portfolio_values,
+                    'dated_cost_basis' : trader.dated_cost_basis,
+                } for trader in traders})
+
+    last_day = str(max(end_date, start_date - datetime.timedelta(days=1)))
+    state = {
+        'offset' : offset,
+        'last_day' : last_day,
+        'traders' : {**state['traders'],
+            **{trader.subreddit: trader.checkpoint() for trader in traders}},
+        'pending' : scored[scored['date'] > last_day].to_dict('records'),
+    }
+    with open(f'{state_path}.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(f'{state_path}.tmp', state_path)
+    return state
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    with instrument.profiled(args.profile), metrics.timer('pipeline'):
+        if args.incremental:
+            run_incremental(store_path=args.price_store,
+                subreddits=None if args.all_subreddits else args.subreddits,
+                start_date=args.start, end_date=args.end, asof=args.asof,
+                workers=args.workers, names=args.names,
+                sentiment_cache=None if args.no_cache else args.cache,
+                state_path=args.state, verbose=args.verbose, mode=args.mode,
+                window=args.window,
+                results_db=None if args.no_results_db else args.results_db)
+        else:
+            outputs = run_pipeline(store_path=args.price_store,
+                subreddits=None if args.all_subreddits else args.subreddits,
+                start_date=args.start, end_date=args.end or DEFAULT_END,
+                engine=args.engine, asof=args.asof, workers=args.workers,
+                names=args.names,
+                sentiment_cache=None if args.no_cache else args.cache,
+                stage_cache=args.stage_cache, force=args.force,
+                write_csv=args.write_csv, verbose=args.verbose,
+                mode=args.mode, window=args.window,
+                results_db=None if args.no_results_db else args.results_db)
+            if args.verbose:
+                for subreddit, result in outputs['results'].items():
+                    values = result['dated_portfolio_values']
+                    if values:
+                        last = max(values)
+                        print(f"r/{subreddit}'s portfolio is worth "\
+                            f"${values[last]} on {last}. They spent "\
+                            f"${result['cost_basis']}")
+    if args.metrics:
+        metrics.write(args.metrics)
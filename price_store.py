@@ -0,0 +1,164 @@
+'''
+A consolidated store of historic stock prices, replacing thousands of small
+<SYMBOL>.csv files with one (dates x symbols) array per field (Open, Close,
+...) saved as .npy files, plus an index of the dates and symbols. The arrays
+are memory mapped when read, so opening the store is nearly instant no matter
+how many symbols it holds, and only the pages of the columns actually used
+are ever read from disk. Arrays are stored column major, so each symbol's
+column is contiguous and reading it is zero-copy.
+
+The store is a directory taking the form:
+    price_store/
+    ├── dates.npy        (datetime64[D], sorted)
+    ├── symbols.json     (list of symbols, in column order)
+    ├── Open.npy         (float64, dates x symbols, NaN where missing)
+    ├── . . .
+
+Usage example
+-------------
+$python price_store.py data/stock_data data/price_store
+    builds a store from the csv files collect_stock_data.py writes
+
+Objects
+-------
+PriceStore
+    field(name -> str) -> numpy.ndarray
+    column(symbol -> str, field -> str) -> numpy.ndarray
+
+Methods
+-------
+write_price_store(path -> str, frames -> dict, fields -> List<str>) -> None
+build_from_csv_dir(stock_data_dir -> str, path -> str) -> None
+'''
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+FIELDS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+
+def _field_file(path, field):
+    return os.path.join(path, f'{field.replace(" ", "_")}.npy')
+
+
+def _dates(frame):
+    return frame.index.astype(str).str[:10].to_numpy(dtype=str).astype(
+        'datetime64[D]')
+
+
+def write_price_store(path, frames, fields=FIELDS):
+    '''
+    Writes a price store to the directory <path>
+
+    Parameters
+    ----------
+    path : str
+        The directory to write the store to, created if it does not exist
+
+    frames : dict<str, pandas.core.frame.DataFrame>
+        Each symbol's data, indexed by Date (as collect_stock_data.py
+        downloads it)
+
+    fields : List<str>
+        The columns to store, columns missing from a frame are stored as NaN
+    '''
+    os.makedirs(path, exist_ok=True)
+    symbols = sorted(frames)
+    frame_dates = {symbol: _dates(frames[symbol]) for symbol in symbols}
+    dates = np.unique(np.concatenate([np.empty(0, dtype='datetime64[D]')]
+        + list(frame_dates.values())))
+
+    for field in fields:
+        prices = np.full((len(dates), len(symbols)), np.nan, order='F')
+        for j, symbol in enumerate(symbols):
+            if field in frames[symbol].columns:
+                rows = np.searchsorted(dates, frame_dates[symbol])
+                prices[rows, j] = frames[symbol][field].to_numpy(
+                    dtype=np.float64)
+        np.save(_field_file(path, field), prices)
+
+    np.save(os.path.join(path, 'dates.npy'), dates)
+    with open(os.path.join(path, 'symbols.json'), 'w') as f:
+        json.dump(symbols, f)
+
+
+def build_from_csv_dir(stock_data_dir, path, fields=FIELDS):
+    '''
+    Builds a price store at <path> from every <SYMBOL>.csv file in
+    <stock_data_dir>
+    '''
+    frames = {}
+    for name in os.listdir(stock_data_dir):
+        if name.endswith('.csv'):
+            frame = pd.read_csv(os.path.join(stock_data_dir, name),
+                index_col='Date')
+            frames[os.path.splitext(name)[0]] = frame[
+                ~frame.index.duplicated(keep='last')]
+
+    write_price_store(path, frames, fields)
+
+
+class PriceStore():
+    '''
+    Read only, memory mapped access to a price store written by
+    write_price_store()
+
+    Attributes
+    ----------
+    self.path : str
+        The directory holding the store
+
+    self.dates : numpy.ndarray<datetime64[D]>
+        The sorted dates, the rows of every field
+
+    self.symbols : List<str>
+        The symbols, the columns of every field
+
+    Methods
+    -------
+    field(name -> str) -> numpy.ndarray
+    column(symbol -> str, field -> str) -> numpy.ndarray
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.dates = np.load(os.path.join(path, 'dates.npy'))
+        with open(os.path.join(path, 'symbols.json')) as f:
+            self.symbols = json.load(f)
+        self._columns = {symbol: j for j, symbol in enumerate(self.symbols)}
+        self._fields = {}
+
+
+    def __contains__(self, symbol):
+        return symbol in self._columns
+
+
+    def field(self, name):
+        '''
+        Returns
+        -------
+        prices : numpy.memmap<float64>
+            The (dates x symbols) array of <name> (ex: 'Open'), NaN where a
+            symbol has no data
+        '''
+        if name not in self._fields:
+            self._fields[name] = np.load(_field_file(self.path, name),
+                mmap_mode='r')
+        return self._fields[name]
+
+
+    def column(self, symbol, field='Open'):
+        '''
+        Returns
+        -------
+        prices : numpy.memmap<float64>
+            <symbol>'s <field> on each of self.dates, a view into the memory
+            mapped file rather than a copy
+        '''
+        return self.field(field)[:, self._columns[symbol]]
+
+
+if __name__ == '__main__':
+    build_from_csv_dir(sys.argv[1], sys.argv[2])
@@ -0,0 +1,229 @@
+'''
+A single SQLite database of simulation results, so runs are added to it
+rather than overwriting each other's csv files, and comparing runs (ex: the
+final value of every subreddit across every date window of a sweep) is a
+query rather than a crawl over files.
+
+The database takes the form:
+    runs          (run_id, created, start_date, end_date, config)
+    holdings      (run_id, trader, stock, quantity)
+    daily_values  (run_id, trader, date, value, cost_basis)
+where config is the run's settings as JSON. holdings and daily_values are
+keyed by (run_id, trader, ...), and daily_values is also indexed by (trader,
+date) for queries across runs.
+
+Usage example
+-------------
+$python results_store.py data/results/results.sqlite
+    prints the final value of every trader in every run
+
+Objects
+-------
+ResultsStore
+    start_run(config -> dict) -> int
+    record_portfolio(run_id -> int, trader -> str, owned_stocks -> dict,
+        dated_portfolio_values -> dict, dated_cost_basis -> dict) -> None
+    flush() -> None
+    close() -> None
+    runs() -> pandas.core.frame.DataFrame
+    daily_values(run_id -> int, trader -> str) -> pandas.core.frame.DataFrame
+    final_values() -> pandas.core.frame.DataFrame
+'''
+import datetime
+import json
+import sqlite3
+import sys
+
+import pandas as pd
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    created TEXT,
+    start_date TEXT,
+    end_date TEXT,
+    config TEXT
+);
+CREATE TABLE IF NOT EXISTS holdings (
+    run_id INTEGER,
+    trader TEXT,
+    stock TEXT,
+    quantity INTEGER,
+    PRIMARY KEY (run_id, trader, stock)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS daily_values (
+    run_id INTEGER,
+    trader TEXT,
+    date TEXT,
+    value REAL,
+    cost_basis REAL,
+    PRIMARY KEY (run_id, trader, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS daily_values_trader_date
+    ON daily_values (trader, date);
+'''
+
+
+class ResultsStore():
+    '''
+    Writes simulation results to, and queries them from, a SQLite database.
+    Rows are buffered and written <BATCH_SIZE> at a time, call close() (or
+    flush()) once done so the last of them are written
+
+    Attributes
+    ----------
+    self.path : str
+        The file path of the SQLite database
+
+    Methods
+    -------
+    start_run(config -> dict) -> int
+    record_portfolio(run_id -> int, trader -> str, owned_stocks -> dict,
+        dated_portfolio_values -> dict, dated_cost_basis -> dict) -> None
+    flush() -> None
+    close() -> None
+    runs() -> pandas.core.frame.DataFrame
+    daily_values(run_id -> int, trader -> str) -> pandas.core.frame.DataFrame
+    final_values() -> pandas.core.frame.DataFrame
+    '''
+    BATCH_SIZE = 10000
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        self._holdings = []
+        self._daily_values = []
+
+
+    def start_run(self, config):
+        '''
+        Adds a run to the store
+
+        Parameters
+        ----------
+        config : dict
+            The run's settings, its start and end keys (dates) are also
+            stored in their own columns for querying
+
+        Returns
+        -------
+        run_id : int
+            The run's id, to record its portfolios under
+        '''
+        with self.connection:
+            cursor = self.connection.execute('INSERT INTO runs (created, '\
+                'start_date, end_date, config) VALUES (?, ?, ?, ?)',
+                (datetime.datetime.now().isoformat(timespec='seconds'),
+                str(config.get('start')), str(config.get('end')),
+                json.dumps(config, default=str, sort_keys=True)))
+        return cursor.lastrowid
+
+
+    def record_portfolio(self, run_id, trader, owned_stocks,
+            dated_portfolio_values, dated_cost_basis=None):
+        '''
+        Adds a trader's final holdings and daily portfolio values to run
+        <run_id>
+
+        Parameters
+        ----------
+        trader : str
+            The trader's name (ex: its subreddit)
+
+        owned_stocks : dict<str, int>
+            The number of shares held of each stock, stocks with none are
+            left out
+
+        dated_portfolio_values : dict<datetime.date, float>
+            The portfolio's value on each day
+
+        dated_cost_basis : dict<datetime.date, float> OR None
+            How much had been spent on each day, NULL if not given
+        '''
+        dated_cost_basis = dated_cost_basis or {}
+        self._holdings.extend((run_id, trader, stock, int(quantity))
+            for stock, quantity in owned_stocks.items() if quantity)
+        self._daily_values.extend((run_id, trader, str(date), float(value),
+            dated_cost_basis.get(date))
+            for date, value in dated_portfolio_values.items())
+        if len(self._holdings) + len(self._daily_values) >= self.BATCH_SIZE:
+            self.flush()
+
+
+    def flush(self):
+        '''
+        Writes every buffered row, in one transaction
+        '''
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO holdings '\
+                'VALUES (?, ?, ?, ?)', self._holdings)
+            self.connection.executemany('INSERT OR REPLACE INTO daily_values '\
+                'VALUES (?, ?, ?, ?, ?)', self._daily_values)
+        self._holdings = []
+        self._daily_values = []
+
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+    def runs(self):
+        '''
+        Returns
+        -------
+        runs : pandas.core.frame.DataFrame
+            Every run, indexed by run_id
+        '''
+        self.flush()
+        return pd.read_sql_query('SELECT * FROM runs', self.connection,
+            index_col='run_id')
+
+
+    def daily_values(self, run_id, trader=None):
+        '''
+        Returns
+        -------
+        values : pandas.core.frame.DataFrame
+            The trader, date, value and cost_basis of every day of run
+            <run_id>, for every trader or just <trader>
+        '''
+        self.flush()
+        query = 'SELECT trader, date, value, cost_basis FROM daily_values '\
+            'WHERE run_id = ?'
+        params = [run_id]
+        if trader is not None:
+            query += ' AND trader = ?'
+            params.append(trader)
+        return pd.read_sql_query(query + ' ORDER BY trader, date',
+            self.connection, params=params)
+
+
+    def final_values(self):
+        '''
+        Finds the value of each trader's portfolio on the last day of each
+        run (ex: to compare subreddits across every date window of a sweep)
+
+        Returns
+        -------
+        finals : pandas.core.frame.DataFrame
+            One row per (run_id, trader), with the run's start_date, end_date
+            and config, the last date, value and cost_basis, and profit
+        '''
+        self.flush()
+        finals = pd.read_sql_query('SELECT r.run_id, r.start_date, '\
+            'r.end_date, d.trader, d.date, d.value, d.cost_basis, r.config '\
+            'FROM runs r JOIN daily_values d ON d.run_id = r.run_id '\
+            'WHERE d.date = (SELECT MAX(date) FROM daily_values '\
+            'WHERE run_id = d.run_id AND trader = d.trader) '\
+            'ORDER BY r.run_id, d.trader', self.connection)
+        finals['profit'] = finals['value'] - finals['cost_basis']
+        return finals
+
+
+if __name__ == '__main__':
+    store = ResultsStore(sys.argv[1])
+    with pd.option_context('display.max_rows', None, 'display.width', None):
+        print(store.final_values().drop(columns='config'))
+    store.close()
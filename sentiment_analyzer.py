@@ -6,19 +6,120 @@ is positive or negative.
 [1] Hutto, C.J. & Gilbert, E.E. (2014). VADER: A Parsimonious Rule-based Model for
 Sentiment Analysis of Social Media Text. Eighth International Conference on
 Weblogs and Social Media (ICWSM-14). Ann Arbor, MI, June 2014.
+
+By default the title and body of each (post, stock) row are scored as one
+text, so every stock a post mentions gets the tone of the whole post. With
+--mode window each post is split into sentences and only the sentences that
+mention the row's stock (plus --window N sentences either side of each) are
+scored, the row's scores are the mean of those. A row whose stock is only
+matched as part of the whole text (ex: by a company name without --names)
+falls back to scoring the whole post.
+
+Scores are cached on disk (data/sentiment_cache.sqlite by default), keyed by a
+hash of each text, so a text is only ever scored once: reruns and new data
+drops only score the texts that have not been seen before.
+
+Passing --metrics PATH writes the time spent reading, scoring and writing, the
+number of texts scored, cache hits and misses, and texts per second to PATH
+(see instrument.py). --profile PATH writes cProfile stats to PATH.
+
+Objects
+-------
+SentimentCache
+    get_many(keys -> iterable<str>) -> dict
+    put_many(scores -> dict) -> None
+
+Methods
+-------
+get_analyzer() -> SentimentIntensityAnalyzer
+score_sentence(sentence -> str) -> dict
+score_texts(texts -> iterable<str>, workers -> int) -> dict
+text_key(text -> str) -> str
+score_texts_cached(texts -> iterable<str>, cache -> SentimentCache,
+    workers -> int) -> dict
+split_sentences(text -> str) -> List<str>
+mention_segments(data -> pandas.core.frame.DataFrame, window -> int,
+    matcher -> SymbolMatcher) -> tuple
+score_data(data -> pandas.core.frame.DataFrame, workers -> int,
+    cache -> SentimentCache, mode -> str, window -> int,
+    matcher -> SymbolMatcher) -> pandas.core.frame.DataFrame
+analyze_data(data -> str) -> None
+
+The command line is only parsed when this file is run as a script, importing
+it (ex: from pipeline.py) uses the defaults of every argument. VADER is only
+imported once something is scored.
 '''
 
 import argparse
-from collections import defaultdict
+import hashlib
+import multiprocessing
+import re
+import sqlite3
 
+import numpy as np
 import pandas as pd
 
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+import clean_reddit_data
+import instrument
+from symbol_matcher import SymbolMatcher
 
 parser = argparse.ArgumentParser(description='Analyze reddit data')
 parser.add_argument('-d', '--debug', action='store_true',
     help='Enter debug mode')
-args = parser.parse_args()
+parser.add_argument('-w', '--workers', type=int, default=1,
+    help='Number of worker processes to score the data with, default: 1')
+parser.add_argument('-c', '--cache', default='data/sentiment_cache.sqlite',
+    help='File to cache sentiment scores in, '\
+        'default: data/sentiment_cache.sqlite')
+parser.add_argument('--no-cache', action='store_true',
+    help='Score every text from scratch without reading or writing the cache')
+parser.add_argument('-m', '--mode', choices=['post', 'window'], default='post',
+    help='post (default) to score the whole of each post, or window to only '\
+        'score the sentences mentioning each stock')
+parser.add_argument('--window', type=int, default=0,
+    help='With --mode window, also score this many sentences either side of '\
+        'each mention, default: 0')
+parser.add_argument('-n', '--names', action='store_true',
+    help='With --mode window, also count company names (ex: Apple for AAPL) '\
+        'as mentions, see clean_reddit_data.py')
+parser.add_argument('-v', '--verbose', action='store_true', help='Be verbose')
+parser.add_argument('--metrics',
+    help='Write timings and counters to this file (.prom for Prometheus)')
+parser.add_argument('--profile', help='Write cProfile stats to this file')
+# Replaced by the real command line arguments when run as a script
+args = parser.parse_args([])
+
+metrics = instrument.Metrics('sentiment_analyzer')
+metrics.rate('texts_per_second', 'texts', 'score')
+
+# The order of the columns returned by score_texts()
+SENTIMENTS = ['neg', 'neu', 'pos', 'compound']
+
+# Part of every cache key, change this whenever the way texts are scored
+# changes (ex: a new VADER version) so stale scores are not reused
+CACHE_VERSION = 'vader-3.3.2'
+
+# Where one sentence ends and the next begins: after ., ! or ? and any
+# whitespace, or at a line break
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n+')
+
+# Loading VADER's lexicon is slow, so each process only does it once
+_analyzer = None
+
+
+def get_analyzer():
+    '''
+    Gets this process's SentimentIntensityAnalyzer, creating it on first use
+
+    Returns
+    -------
+    analyzer : vaderSentiment.vaderSentiment.SentimentIntensityAnalyzer
+    '''
+    global _analyzer
+    if _analyzer is None:
+        from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+        _analyzer = SentimentIntensityAnalyzer()
+    return _analyzer
 
 
 def score_sentence(sentence):
@@ -38,13 +139,323 @@ def score_sentence(sentence):
         {<sentiment} : <score>}
         (ex: {'neg': 0.0, 'neu': 1.0, 'pos': 0.0})
     '''
-    analyzer = SentimentIntensityAnalyzer()
-    score = analyzer.polarity_scores(sentence)
+    score = get_analyzer().polarity_scores(sentence)
     score.pop('compound') # VADER adds a compound score which we don't need
     return score
 
 
-def analyze_data(data):
+def _score_chunk(texts):
+    analyzer = get_analyzer()
+    scores = np.empty((len(texts), len(SENTIMENTS)))
+    for i, text in enumerate(texts):
+        score = analyzer.polarity_scores(text)
+        scores[i] = [score[sentiment] for sentiment in SENTIMENTS]
+    return scores
+
+
+def score_texts(texts, workers=1, chunksize=1000):
+    '''
+    Scores many texts at once, spreading them over a pool of <workers>
+    processes in chunks of <chunksize> texts
+
+    Parameters
+    ----------
+    texts : iterable<str>
+        The texts to be analyzed
+
+    workers : int
+        The number of worker processes to use
+
+    chunksize : int
+        The number of texts sent to a worker at a time
+
+    Returns
+    -------
+    scores : dict<str : numpy.ndarray<float64>>
+        One array per sentiment in SENTIMENTS, holding that sentiment's score
+        for each text, in the same order as <texts>
+        (ex: {'neg': array([0.0]), 'neu': array([1.0]), 'pos': array([0.0]),
+        'compound': array([0.0])})
+    '''
+    texts = list(texts)
+    chunks = [texts[i:i + chunksize] for i in range(0, len(texts), chunksize)]
+    if workers <= 1 or len(chunks) <= 1:
+        results = [_score_chunk(chunk) for chunk in chunks]
+    else:
+        with multiprocessing.Pool(workers, get_analyzer) as pool:
+            results = pool.map(_score_chunk, chunks)
+
+    if results:
+        scores = np.concatenate(results)
+    else:
+        scores = np.empty((0, len(SENTIMENTS)))
+    return {sentiment: scores[:, i] for i, sentiment in enumerate(SENTIMENTS)}
+
+
+def text_key(text):
+    '''
+    Hashes the normalized form of <text> (runs of whitespace collapsed into
+    single spaces, which VADER ignores anyway) into a cache key
+
+    Returns
+    -------
+    key : str
+    '''
+    normalized = ' '.join(text.split())
+    return hashlib.sha1(f'{CACHE_VERSION}\0{normalized}'.encode()).hexdigest()
+
+
+class SentimentCache():
+    '''
+    On disk (SQLite) cache of sentiment scores, keyed by text_key()
+
+    Attributes
+    ----------
+    self.path : str
+        The file path of the SQLite database
+
+    self.hits : int
+        The number of keys found by get_many()
+
+    self.misses : int
+        The number of keys not found by get_many()
+
+    Methods
+    -------
+    get_many(keys -> iterable<str>) -> dict<str, tuple<float>>
+    put_many(scores -> dict<str, tuple<float>>) -> None
+    close() -> None
+    '''
+    # SQLite limits how many parameters a single query can have
+    BATCH_SIZE = 500
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS scores ('\
+            'key TEXT PRIMARY KEY, neg REAL, neu REAL, pos REAL, '\
+            'compound REAL) WITHOUT ROWID')
+
+
+    def get_many(self, keys):
+        '''
+        Looks up the scores of <keys>
+
+        Returns
+        -------
+        scores : dict<str, tuple<float>>
+            The scores found, in SENTIMENTS order, keys that are not cached
+            are left out
+        '''
+        keys = list(keys)
+        scores = {}
+        for i in range(0, len(keys), self.BATCH_SIZE):
+            batch = keys[i:i + self.BATCH_SIZE]
+            rows = self.connection.execute('SELECT key, neg, neu, pos, '\
+                f'compound FROM scores WHERE key IN ({",".join("?" * len(batch))})',
+                batch)
+            for key, *score in rows:
+                scores[key] = tuple(score)
+
+        self.hits += len(scores)
+        self.misses += len(keys) - len(scores)
+        return scores
+
+
+    def put_many(self, scores):
+        '''
+        Adds <scores> (dict<key, tuple<float>> in SENTIMENTS order) to the
+        cache
+        '''
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO scores '\
+                'VALUES (?, ?, ?, ?, ?)',
+                ((key, *score) for key, score in scores.items()))
+
+
+    def close(self):
+        self.connection.close()
+
+
+def score_texts_cached(texts, cache=None, workers=1):
+    '''
+    Same as score_texts(), but each distinct text is only scored once, and
+    texts already in <cache> are not scored at all. Newly scored texts are
+    added to <cache>
+
+    Parameters
+    ----------
+    texts : iterable<str>
+        The texts to be analyzed
+
+    cache : SentimentCache OR None
+        The cache to use, if None texts are still only scored once per call
+
+    workers : int
+        The number of worker processes to use
+
+    Returns
+    -------
+    scores : dict<str : numpy.ndarray<float64>>
+        See score_texts()
+    '''
+    keys = []
+    unique = {}
+    for text in texts:
+        key = text_key(text)
+        keys.append(key)
+        if key not in unique:
+            unique[key] = ' '.join(text.split())
+
+    with metrics.timer('cache_read'):
+        known = cache.get_many(unique) if cache is not None else {}
+    missing = [key for key in unique if key not in known]
+    with metrics.timer('vader'):
+        scored = score_texts([unique[key] for key in missing], workers)
+    scored = dict(zip(missing,
+        zip(*(scored[sentiment].tolist() for sentiment in SENTIMENTS))))
+    if cache is not None:
+        with metrics.timer('cache_write'):
+            cache.put_many(scored)
+    known.update(scored)
+    metrics.count('texts', len(keys))
+    metrics.count('distinct_texts', len(unique))
+    metrics.count('cache_hits', len(unique) - len(missing))
+    metrics.count('cache_misses', len(missing))
+
+    if args.verbose:
+        print(f'{len(keys)} texts, {len(unique)} distinct, '\
+            f'{len(missing)} scored, {len(unique) - len(missing)} cached')
+
+    scores = np.array([known[key] for key in keys], dtype=np.float64)
+    scores = scores.reshape(len(keys), len(SENTIMENTS))
+    return {sentiment: scores[:, i] for i, sentiment in enumerate(SENTIMENTS)}
+
+
+def split_sentences(text):
+    '''
+    Splits <text> into sentences, see SENTENCE_END
+
+    Returns
+    -------
+    sentences : List<str>
+        The non-empty sentences, in order
+    '''
+    return [sentence for sentence in SENTENCE_END.split(text)
+        if sentence.strip()]
+
+
+def mention_segments(data, window=0, matcher=None):
+    '''
+    Finds the text around each mention of each row's stock. The title and
+    body of each post are split into sentences (the title being the first),
+    and for every sentence mentioning the row's stock, that sentence and the
+    <window> sentences either side of it become one segment. Rows with no
+    such sentence get the whole post (title and body) as their only segment
+
+    Parameters
+    ----------
+    data : pandas.core.frame.DataFrame
+        The clean reddit data, as written by clean_reddit_data.py
+
+    window : int
+        The number of sentences either side of a mention to include
+
+    matcher : symbol_matcher.SymbolMatcher OR None
+        Finds the stocks each sentence mentions, if None only the symbols of
+        the stocks in <data> are matched
+
+    Returns
+    -------
+    segments : List<str>
+        The text of every segment
+
+    rows : numpy.ndarray<int64>
+        The position in <data> of the row each segment belongs to
+    '''
+    if matcher is None:
+        matcher = SymbolMatcher(dict.fromkeys(pd.unique(data['stock']), ''))
+
+    segments = []
+    rows = []
+    post = None
+    for row, (stock, title, body) in enumerate(zip(data['stock'],
+            data['title'], data['body'])):
+        # A post's rows (one per stock it mentions) are next to each other,
+        # so each post is only split and matched once
+        if (title, body) != post:
+            post = (title, body)
+            sentences = split_sentences(str(title)) + split_sentences(str(body))
+            mentions = [matcher.match(sentence) for sentence in sentences]
+
+        found = [' '.join(sentences[max(i - window, 0):i + window + 1])
+            for i, mentioned in enumerate(mentions) if stock in mentioned]
+        if not found:
+            found = [f'{title} {body}']
+        segments.extend(found)
+        rows.extend([row] * len(found))
+
+    return segments, np.array(rows, dtype=np.int64)
+
+
+def score_data(data, workers=1, cache=None, mode='post', window=0,
+        matcher=None):
+    '''
+    Scores the title and body of each post/comment in <data>
+
+    Parameters
+    ----------
+    data : pandas.core.frame.DataFrame
+        The clean reddit data, as written by clean_reddit_data.py
+
+    workers : int
+        The number of worker processes to score the data with
+
+    cache : SentimentCache OR None
+        Cache of previously computed scores
+
+    mode : str
+        post to score the whole post of each row, window to only score the
+        text around the mentions of each row's stock (see mention_segments)
+        and average the scores
+
+    window : int
+        See mention_segments, only used in window mode
+
+    matcher : symbol_matcher.SymbolMatcher OR None
+        See mention_segments, only used in window mode
+
+    Returns
+    -------
+    scored : pandas.core.frame.DataFrame
+        <data> with four new float columns, pos, neu, neg and compound
+    '''
+    if mode == 'window':
+        with metrics.timer('split'):
+            texts, rows = mention_segments(data, window, matcher)
+    else:
+        texts = [f'{title} {body}'
+            for title, body in zip(data['title'], data['body'])]
+        rows = None
+    metrics.count('characters', sum(map(len, texts)))
+    with metrics.timer('score'):
+        scores = score_texts_cached(texts, cache, workers)
+
+    if rows is not None:
+        # The mean of each row's segments
+        segments = np.bincount(rows, minlength=len(data))
+        scores = {sentiment: np.bincount(rows, scores[sentiment],
+            minlength=len(data)) / np.maximum(segments, 1)
+            for sentiment in SENTIMENTS}
+
+    return data.assign(pos=scores['pos'], neu=scores['neu'],
+        neg=scores['neg'], compound=scores['compound'])
+
+
+def analyze_data(data, workers=1, cache=None, mode='post', window=0,
+        matcher=None):
     '''
     Calls score_sentence on all sentences in data
 
@@ -53,30 +464,44 @@ def analyze_data(data):
     data : str
         The file path to the csv file to be analyzed
 
-    Attributes
-    ----------
-    scores : List<dict<sentiment, score>>
-        List of scores for each sentence
-        (ex: {"pos" : 0.0, "neu" : 1.0, "neg" : 0.0})
+    workers : int
+        The number of worker processes to score the data with
+
+    cache : SentimentCache OR None
+        Cache of previously computed scores
+
+    mode, window, matcher
+        See score_data
 
     Outputs
     -------
     pandas.core.frame.DataFrame -> csv file
-        Dataframe with a new column, sentiment_score, written out to
-        scored_reddit.csv
+        Dataframe with four new float columns, pos, neu, neg and compound,
+        holding each sentence's scores, written out to scored_reddit.csv
     '''
-    data = pd.read_csv(data)
+    with metrics.timer('read'):
+        data = pd.read_csv(data)
     if args.debug:
         data = data.head(1000)
 
-    data_size = len(data)
-    scores = [defaultdict()] * data_size
-    for i in range(data_size):
-        sentence = f'{data.loc[i, "title"]} {str(data.loc[i, "body"])}'
-        scores[i] = score_sentence(sentence)
-
-    data.assign(sentiment_score=scores).to_csv('data/scored_reddit.csv')
+    scored = score_data(data, workers, cache, mode, window, matcher)
+    with metrics.timer('write'):
+        scored.to_csv('data/scored_reddit.csv')
 
 
 if __name__ == '__main__':
-    analyze_data('data/clean_reddit.csv')
+    args = parser.parse_args()
+    cache = None if args.no_cache else SentimentCache(args.cache)
+    matcher = None
+    if args.mode == 'window' and args.names:
+        matcher = SymbolMatcher(
+            clean_reddit_data.read_stock_data('data/symbols_names.csv'),
+            names=True)
+    with instrument.profiled(args.profile):
+        analyze_data('data/clean_reddit.csv', args.workers, cache, args.mode,
+            args.window, matcher)
+    if cache is not None:
+        cache.close()
+
+    if args.metrics:
+        metrics.write(args.metrics)
@@ -0,0 +1,348 @@
+'''
+A precomputed cube of the scored reddit data. For every subreddit, trading
+day and stock it holds three values:
+    net : the net upvotes behind the stock. Each post/comment's upvotes are
+        added if its sentiment is positive and subtracted otherwise, which is
+        the signal simulate.Trader trades on
+    posts : the number of posts/comments
+    upvotes : their total upvotes
+Each value is one (subreddits x days x stocks) array, saved as a .npy file
+and memory mapped when read. Backtests, plots and ad-hoc queries then read
+only the slices they need, in milliseconds, instead of rescanning every post.
+
+The cube is a directory taking the form:
+    sentiment_cube/
+    ├── axes.json     (the subreddits, stocks and days, in array order, and
+    │                  the stocks each subreddit mentioned, in order of first
+    │                  mention)
+    ├── net.npy       (int64, subreddits x days x stocks)
+    ├── posts.npy     (int32, subreddits x days x stocks)
+    ├── upvotes.npy   (int64, subreddits x days x stocks)
+
+The days are the trading days (see trading_calendar.py) from the first post
+to the last. Posts made on other days are left out, as the simulation never
+trades on them. The stocks are only those mentioned at least once, so the
+cube's size is subreddits x days x mentioned stocks.
+
+Usage examples
+--------------
+$python sentiment_cube.py data/scored_reddit.csv data/sentiment_cube
+    builds a cube from the output of sentiment_analyzer.py
+
+$python simulate.py --engine vectorized --cube data/sentiment_cube
+    simulates from the cube, without reading data/scored_reddit.csv
+
+Objects
+-------
+SentimentCube
+    field(name -> str) -> numpy.ndarray
+    slice(field -> str, subreddit -> str, stocks -> List<str>,
+        start -> datetime.date, end -> datetime.date)
+        -> pandas.core.frame.DataFrame
+    rolling(window -> int, field -> str, subreddit -> str,
+        stocks -> List<str>, start -> datetime.date, end -> datetime.date)
+        -> pandas.core.frame.DataFrame
+    top_n(n -> int, field -> str, subreddit -> str, start -> datetime.date,
+        end -> datetime.date) -> pandas.core.frame.DataFrame
+    signals(subreddits -> List<str>, stocks -> List<str>,
+        days -> List<datetime.date>) -> numpy.ndarray
+
+Methods
+-------
+build_cube(data -> pandas.core.frame.DataFrame, path -> str,
+    start -> datetime.date, end -> datetime.date) -> None
+build_from_scored_csv(scored_data -> str, path -> str) -> None
+'''
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+
+import trading_calendar
+
+FIELDS = {'net': np.int64, 'posts': np.int32, 'upvotes': np.int64}
+
+
+def _dates(dates):
+    dates = pd.Series(dates)
+    if pd.api.types.is_integer_dtype(dates.dtype):
+        # Day numbers, see simulate.compact_data()
+        return dates.to_numpy(dtype=np.int64).astype('datetime64[D]')
+
+    dates = pd.to_datetime(dates.astype(str).str[:10], format='%Y-%m-%d')
+    return dates.to_numpy(dtype='datetime64[D]')
+
+
+def build_cube(data, path, start=None, end=None):
+    '''
+    Writes the cube of <data> to the directory <path>
+
+    Parameters
+    ----------
+    data : pandas.core.frame.DataFrame
+        The scored reddit data, as returned by simulate.read_scored_data()
+        (compacted or not)
+
+    path : str
+        The directory to write the cube to, created if it does not exist
+
+    start, end : datetime.date OR None
+        The first and last day of the cube, default: the first and last
+        day posted on
+    '''
+    subreddits = pd.Categorical(data['subreddit'])
+    stocks = pd.Categorical(data['stock'])
+    dates = _dates(data['date'])
+    if start is None:
+        start = dates.min().item() if len(dates) else None
+    if end is None:
+        end = dates.max().item() if len(dates) else None
+    days = trading_calendar.sessions(start, end) if start and end \
+        else np.empty(0, dtype='datetime64[D]')
+
+    d = np.searchsorted(days, dates)
+    traded = (d < len(days)) & (subreddits.codes >= 0) & (stocks.codes >= 0)
+    traded[traded] &= days[d[traded]] == dates[traded]
+    score = data['score'].to_numpy(dtype=np.int64)
+    net = np.where(data['pos'].to_numpy() > data['neg'].to_numpy(), score,
+        -score)
+
+    os.makedirs(path, exist_ok=True)
+    shape = (len(subreddits.categories), len(days), len(stocks.categories))
+    arrays = {field: open_memmap(os.path.join(path, f'{field}.npy'), 'w+',
+        dtype, shape) for field, dtype in FIELDS.items()}
+    # One subreddit at a time, so only one (days x stocks) slice is ever
+    # built in memory
+    cells = d.astype(np.int64) * shape[2] + stocks.codes
+    for i in range(shape[0]):
+        rows = np.flatnonzero(traded & (subreddits.codes == i))
+        size = shape[1] * shape[2]
+        for field, weights in (('net', net), ('posts', None),
+                ('upvotes', score)):
+            weights = None if weights is None else weights[rows]
+            totals = np.bincount(cells[rows], weights, size)
+            arrays[field][i] = totals.reshape(shape[1:])
+    for array in arrays.values():
+        array.flush()
+
+    first = pd.DataFrame({'subreddit': subreddits.codes,
+        'stock': stocks.codes}).drop_duplicates()
+    first = first[(first['subreddit'] >= 0) & (first['stock'] >= 0)]
+    mentioned = {subreddit: [] for subreddit in subreddits.categories}
+    for i, j in zip(first['subreddit'], first['stock']):
+        mentioned[subreddits.categories[i]].append(stocks.categories[j])
+
+    with open(os.path.join(path, 'axes.json'), 'w') as f:
+        json.dump({
+            'subreddits' : list(subreddits.categories),
+            'stocks' : list(stocks.categories),
+            'days' : [str(day) for day in days],
+            'mentioned' : mentioned,
+        }, f)
+
+
+def build_from_scored_csv(scored_data, path):
+    '''
+    Builds a cube at <path> from <scored_data> (scored_reddit.csv), reading
+    only the columns the cube needs. Files written by older versions of
+    sentiment_analyzer.py are upgraded first, see simulate.read_scored_data()
+    '''
+    # simulate.py imports this module, so it is only imported once needed
+    import simulate
+
+    build_cube(simulate.read_scored_data(scored_data, compact=True), path)
+
+
+class SentimentCube():
+    '''
+    Read only, memory mapped access to a cube written by build_cube()
+
+    Attributes
+    ----------
+    self.path : str
+        The directory holding the cube
+
+    self.subreddits : List<str>
+        The first axis of every field
+
+    self.days : numpy.ndarray<datetime64[D]>
+        The trading days, the second axis of every field
+
+    self.stocks : List<str>
+        The last axis of every field
+
+    self.mentioned : dict<str, List<str>>
+        The stocks each subreddit mentioned, in order of first mention
+
+    Methods
+    -------
+    field(name -> str) -> numpy.ndarray
+    slice(...) -> pandas.core.frame.DataFrame
+    rolling(...) -> pandas.core.frame.DataFrame
+    top_n(...) -> pandas.core.frame.DataFrame
+    signals(...) -> numpy.ndarray
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'axes.json')) as f:
+            axes = json.load(f)
+        self.subreddits = axes['subreddits']
+        self.stocks = axes['stocks']
+        self.days = np.array(axes['days'], dtype='datetime64[D]')
+        self.mentioned = axes['mentioned']
+        self._subreddits = {subreddit: i
+            for i, subreddit in enumerate(self.subreddits)}
+        self._stocks = {stock: j for j, stock in enumerate(self.stocks)}
+        self._fields = {}
+
+
+    def field(self, name):
+        '''
+        Returns
+        -------
+        values : numpy.memmap
+            The (subreddits x days x stocks) array of <name> (net, posts or
+            upvotes)
+        '''
+        if name not in self._fields:
+            self._fields[name] = np.load(os.path.join(self.path,
+                f'{name}.npy'), mmap_mode='r')
+        return self._fields[name]
+
+
+    def _day_range(self, start, end):
+        first = 0 if start is None \
+            else np.searchsorted(self.days, np.datetime64(start, 'D'))
+        last = len(self.days) if end is None \
+            else np.searchsorted(self.days, np.datetime64(end, 'D'), 'right')
+        return int(first), int(last)
+
+
+    def _frame(self, field, subreddit, stocks, first, last):
+        values = self.field(field)
+        if subreddit is None:
+            values = values[:, first:last].sum(axis=0)
+        else:
+            values = values[self._subreddits[subreddit], first:last]
+        if stocks is None:
+            stocks = self.stocks
+        else:
+            values = values[:, [self._stocks[stock] for stock in stocks]]
+
+        return pd.DataFrame(np.array(values), columns=list(stocks),
+            index=pd.DatetimeIndex(self.days[first:last], name='date'))
+
+
+    def slice(self, field='net', subreddit=None, stocks=None, start=None,
+            end=None):
+        '''
+        Parameters
+        ----------
+        field : str
+            net, posts or upvotes
+
+        subreddit : str OR None
+            The subreddit to read, None for the total over every subreddit
+
+        stocks : List<str> OR None
+            The stocks to read, None for every stock
+
+        start, end : datetime.date OR None
+            The first and last day to read, None for the cube's first and
+            last day
+
+        Returns
+        -------
+        values : pandas.core.frame.DataFrame
+            The (days x stocks) values of <field>, indexed by date
+        '''
+        return self._frame(field, subreddit, stocks,
+            *self._day_range(start, end))
+
+
+    def rolling(self, window, field='net', subreddit=None, stocks=None,
+            start=None, end=None):
+        '''
+        Same as slice(), but each day holds the total of the <window> trading
+        days up to and including it. Days before <start> count towards the
+        first windows, where the cube has them
+        '''
+        first, last = self._day_range(start, end)
+        lead = min(window - 1, first)
+        values = self._frame(field, subreddit, stocks, first - lead, last)
+        return values.rolling(window, min_periods=1).sum().iloc[lead:]
+
+
+    def top_n(self, n=10, field='net', subreddit=None, start=None,
+            end=None):
+        '''
+        Finds the <n> stocks with the largest <field> on each day (ex: the
+        stocks with the most net upvotes behind them)
+
+        Returns
+        -------
+        top : pandas.core.frame.DataFrame
+            One row per day, indexed by date, with columns 1 to <n> holding
+            the stocks in order, None where fewer than <n> stocks were
+            discussed that day
+        '''
+        first, last = self._day_range(start, end)
+        values = np.array(self._frame(field, subreddit, None, first, last),
+            dtype=np.float64)
+        posts = self._frame('posts', subreddit, None, first, last).to_numpy()
+        values[posts == 0] = -np.inf
+        n = min(n, len(self.stocks))
+        order = np.argsort(-values, axis=1, kind='stable')[:, :n]
+        top = np.array(self.stocks, dtype=object)[order]
+        top[np.take_along_axis(posts, order, axis=1) == 0] = None
+        return pd.DataFrame(top, columns=range(1, n + 1),
+            index=pd.DatetimeIndex(self.days[first:last], name='date'))
+
+
+    def signals(self, subreddits, stocks, days):
+        '''
+        Lays out the net upvotes as simulate.build_signal_tensor() does, 0
+        for any subreddit, stock or day the cube does not have
+
+        Parameters
+        ----------
+        subreddits : List<str>
+            The first axis of the tensor
+
+        stocks : List<str>
+            The last axis of the tensor
+
+        days : List<datetime.date>
+            The middle axis of the tensor
+
+        Returns
+        -------
+        signals : numpy.ndarray<float64>
+            (subreddits x days x stocks) tensor of net upvotes
+        '''
+        signals = np.zeros((len(subreddits), len(days), len(stocks)))
+        days = np.array(days, dtype='datetime64[D]')
+        d = np.searchsorted(self.days, days)
+        found = d < len(self.days)
+        found[found] &= self.days[d[found]] == days[found]
+        columns = [(k, self._stocks[stock]) for k, stock in enumerate(stocks)
+            if stock in self._stocks]
+        if not columns or not found.any():
+            return signals
+
+        k, j = (np.array(axis, dtype=np.int64) for axis in zip(*columns))
+        rows = np.ix_(np.flatnonzero(found), k)
+        net = self.field('net')
+        for t, subreddit in enumerate(subreddits):
+            if subreddit in self._subreddits:
+                signals[t][rows] = net[self._subreddits[subreddit]][
+                    np.ix_(d[found], j)]
+
+        return signals
+
+
+if __name__ == '__main__':
+    build_from_scored_csv(sys.argv[1], sys.argv[2])
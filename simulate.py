@@ -24,31 +24,408 @@ Arguments
 ---------
 -d --debug : Enter debug mode
 -v --verbose : Be verbose
+-a --asof : Use the last known open price when a stock has no price on a date
+-c --cache-size : Maximum number of stocks to keep loaded at once. The loop
+    engine only looks up the stocks traders hold or trade each day, when
+    there are more of those than this they are read in again every day
+-e --engine : loop (default) to step through the simulation a day at a time,
+    or vectorized to simulate every trader at once with NumPy
+-s --subreddits : The subreddits to simulate
+--all-subreddits : Simulate every subreddit in the data
+--start : The first day of the simulation (YYYY-MM-DD), default: 2019-04-27
+--end : The last day of the simulation (YYYY-MM-DD), default: 2021-01-27
+--sweep : JSON file describing a grid of simulations to run (see run_sweep)
+-p --price-store : Read stock prices from a price store (see price_store.py)
+    instead of data/stock_data
+--cube : Read each subreddit's daily signals from a sentiment cube (see
+    sentiment_cube.py) instead of data/scored_reddit.csv, only with
+    --engine vectorized or --sweep
+-w --workers : Number of worker processes to run a sweep with
+--results-db : Also record every run, its holdings and daily portfolio values
+    in this results store (see results_store.py), default:
+    data/results/results.sqlite. The csv files are still written
+--no-results-db : Do not record the results in the results store
+--metrics : Write the time spent reading, trading, valuing portfolios and
+    writing, along with counters such as trades made and failed price
+    lookups, to this file (.prom for Prometheus, see instrument.py)
+--profile : Write cProfile stats to this file
+
+Methods
+-------
+read_scored_data(scored_data -> str, compact -> bool)
+    -> pandas.core.frame.DataFrame
+compact_data(data -> pandas.core.frame.DataFrame)
+    -> pandas.core.frame.DataFrame
+day_numbers(dates -> iterable<str>) -> numpy.ndarray
+build_price_matrix(stocks -> StockCache, symbols -> List<str>,
+    days -> List<datetime.date>, asof -> bool) -> numpy.ndarray
+build_signal_tensor(traders -> List<Trader>, symbols -> List<str>,
+    days -> List<datetime.date>) -> numpy.ndarray
+cube_traders(cube -> SentimentCube, subreddits -> List<str>) -> List<Trader>
+backtest(prices -> numpy.ndarray, signals -> numpy.ndarray,
+    buy_threshold -> float, sell_threshold -> float, shares -> int) -> tuple
+trading_days(start_date -> datetime.date, end_date -> datetime.date)
+    -> generator<datetime.date>
+to_cents(values -> numpy.ndarray) -> List<float>
+write_portfolio(subreddit -> str, owned_stocks -> dict,
+    dated_portfolio_values -> dict, results_dir -> str) -> None
+expand_grid(grid -> dict) -> List<dict>
+run_sweep(data -> pandas.core.frame.DataFrame, grid -> dict,
+    stock_data_dir -> str, workers -> int, asof -> bool,
+    store -> PriceStore, results_store -> ResultsStore, cube -> SentimentCube)
+    -> pandas.core.frame.DataFrame
 
 Objects
 -------
 Market
     read_in_stocks() -> None
-Trader
-    get_open() -> float
+    trading_days() -> generator<datetime.date>
+    simulate() -> None
+    simulate_vectorized(cube -> SentimentCube) -> None
+StockCache
 Stock
+    get_open() -> float
+    get_opens() -> numpy.ndarray
+Trader
+    column() -> pandas.core.series.Series
     day_trade() -> None
     evaluate_portfolio() -> None
     write_portfolio_to_csv() -> None
+
+The command line is only parsed when this file is run as a script, importing
+it (ex: from pipeline.py) uses the defaults of every argument.
 '''
 import time
 import os
 import datetime
 import argparse
 import ast
+import itertools
+import json
+import multiprocessing
+import tempfile
+from collections import OrderedDict
 
+import numpy as np
 import pandas as pd
 
+import instrument
+import trading_calendar
+from price_store import PriceStore
+from results_store import ResultsStore
+from sentiment_cube import SentimentCube
+
 parser = argparse.ArgumentParser(description='simulate portfolios')
 parser.add_argument('-d', '--debug', action='store_true',
     help='Enter debug mode')
 parser.add_argument('-v', '--verbose', action='store_true', help='Be verbose')
-args = parser.parse_args()
+parser.add_argument('-a', '--asof', action='store_true',
+    help='Value stocks at their last known open price when there is no '\
+        'price on a given date, instead of 0')
+parser.add_argument('-c', '--cache-size', type=int, default=1024,
+    help='Maximum number of stocks to keep loaded at once, default: 1024')
+parser.add_argument('-e', '--engine', choices=['loop', 'vectorized'],
+    default='loop', help='Simulate a day at a time (loop), or every day and '\
+        'trader at once (vectorized), default: loop')
+parser.add_argument('-s', '--subreddits', nargs='+',
+    default=['wallstreetbets', 'investing', 'stocks'],
+    help='Subreddits to simulate, default: wallstreetbets investing stocks')
+parser.add_argument('--all-subreddits', action='store_true',
+    help='Simulate every subreddit in the data, overrides --subreddits')
+parser.add_argument('--start', type=datetime.date.fromisoformat,
+    default=datetime.date(2019, 4, 27),
+    help='First day of the simulation (YYYY-MM-DD), default: 2019-04-27')
+parser.add_argument('--end', type=datetime.date.fromisoformat,
+    default=datetime.date(2021, 1, 27),
+    help='Last day of the simulation (YYYY-MM-DD), default: 2021-01-27')
+parser.add_argument('--sweep',
+    help='JSON file describing a grid of simulations to run, results are '\
+        'written to data/results/sweep_results.csv')
+parser.add_argument('-w', '--workers', type=int, default=1,
+    help='Number of worker processes to run a sweep with, default: 1')
+parser.add_argument('-p', '--price-store',
+    help='Read stock prices from this price store (see price_store.py) '\
+        'instead of the csv files in data/stock_data')
+parser.add_argument('--cube',
+    help='Read the daily signals from this sentiment cube (see '\
+        'sentiment_cube.py) instead of data/scored_reddit.csv, only with '\
+        '--engine vectorized or --sweep')
+parser.add_argument('--results-db', default='data/results/results.sqlite',
+    help='Also record the results in this results store (see '\
+        'results_store.py), default: data/results/results.sqlite')
+parser.add_argument('--no-results-db', action='store_true',
+    help='Do not record the results in the results store')
+parser.add_argument('--metrics',
+    help='Write timings and counters to this file (.prom for Prometheus)')
+parser.add_argument('--profile', help='Write cProfile stats to this file')
+# Replaced by the real command line arguments when run as a script
+args = parser.parse_args([])
+
+metrics = instrument.Metrics('simulate')
+metrics.rate('trader_days_per_second', 'trader_days', 'simulate')
+
+
+SENTIMENTS = ['pos', 'neu', 'neg', 'compound']
+
+# The only columns of the scored data the simulation uses
+COMPACT_COLUMNS = ['subreddit', 'stock', 'date', 'score'] + SENTIMENTS
+
+
+def read_scored_data(scored_data, compact=False):
+    '''
+    Reads the output of sentiment_analyzer.py. Files written by older
+    versions of sentiment_analyzer.py held each post's scores in a single
+    sentiment_score column, as the string form of a dictionary
+    (ex: "{'neg': 0.0, 'neu': 1.0, 'pos': 0.0}"), those are upgraded to the
+    current pos, neu, neg and compound float columns (compound is missing
+    from those files, so it is left as NaN)
+
+    Parameters
+    ----------
+    scored_data : str
+        The file path to scored_reddit.csv
+
+    compact : bool
+        Whether to only read the columns the simulation uses, see
+        compact_data(). The title and body are never read into memory
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+    '''
+    header = pd.read_csv(scored_data, nrows=0).columns
+    if compact and 'pos' in header:
+        dtypes = {'subreddit': 'category', 'stock': 'category'}
+        dtypes.update((sentiment, np.float32) for sentiment in SENTIMENTS)
+        data = pd.read_csv(scored_data,
+            usecols=[column for column in COMPACT_COLUMNS if column in header],
+            dtype=dtypes)
+        return compact_data(data)
+
+    data = pd.read_csv(scored_data)
+    if 'sentiment_score' in data.columns and 'pos' not in data.columns:
+        if args.verbose:
+            print(f'Upgrading legacy sentiment_score column in {scored_data}')
+        scores = pd.DataFrame([ast.literal_eval(score)
+            for score in data['sentiment_score']], index=data.index)
+        for sentiment in SENTIMENTS:
+            if sentiment in scores.columns:
+                data[sentiment] = scores[sentiment].astype(np.float64)
+            else:
+                data[sentiment] = np.nan
+        data = data.drop(columns='sentiment_score')
+
+    return compact_data(data) if compact else data
+
+
+def compact_data(data):
+    '''
+    Shrinks scored reddit data down to what the simulation uses: the
+    subreddit and stock as categoricals, the date as int32 day numbers (days
+    since 1970-01-01), the score as int32 and the sentiments as float32. The
+    title, body and any other columns are dropped. Traders built from the
+    result behave exactly as they would from <data>
+
+    Parameters
+    ----------
+    data : pandas.core.frame.DataFrame
+        As returned by read_scored_data()
+
+    Returns
+    -------
+    compact : pandas.core.frame.DataFrame
+    '''
+    compact = pd.DataFrame({
+        'subreddit' : pd.Categorical(data['subreddit']),
+        'stock' : pd.Categorical(data['stock']),
+        'date' : day_numbers(data['date']),
+        'score' : data['score'].to_numpy(dtype=np.int32),
+    })
+    for sentiment in SENTIMENTS:
+        if sentiment in data.columns:
+            compact[sentiment] = data[sentiment].to_numpy(dtype=np.float32)
+        else:
+            compact[sentiment] = np.float32(np.nan)
+
+    return compact
+
+
+def day_numbers(dates):
+    '''
+    Converts <dates> (YYYY-MM-DD strings, anything after the day is ignored)
+    to the number of days since 1970-01-01, dates that are already day
+    numbers are returned as they are
+
+    Returns
+    -------
+    numpy.ndarray<int32>
+    '''
+    dates = pd.Series(dates)
+    if pd.api.types.is_integer_dtype(dates.dtype):
+        return dates.to_numpy(dtype=np.int32)
+
+    dates = pd.to_datetime(dates.astype(str).str[:10], format='%Y-%m-%d')
+    return dates.to_numpy(dtype='datetime64[D]').astype(np.int32)
+
+
+def build_price_matrix(stocks, symbols, days, asof=False):
+    '''
+    Looks up the opening price of every stock on every day
+
+    Parameters
+    ----------
+    stocks : StockCache
+        See Market.stocks
+
+    symbols : List<str>
+        The stocks to look up, these become the columns of the matrix
+
+    days : List<datetime.date>
+        The days to look up, these become the rows of the matrix
+
+    asof : bool
+        See Stock.get_open
+
+    Returns
+    -------
+    prices : numpy.ndarray<float64>
+        (days x symbols) matrix of opening prices, 0 where Stock.get_open
+        would return 0
+    '''
+    days = np.array(days, dtype='datetime64[D]')
+    prices = np.zeros((len(days), len(symbols)))
+    for j, symbol in enumerate(symbols):
+        prices[:, j] = stocks[symbol].get_opens(days, asof)
+
+    return prices
+
+
+def build_signal_tensor(traders, symbols, days):
+    '''
+    Lays out each trader's daily_buy_sell as a dense array
+
+    Parameters
+    ----------
+    traders : List<Trader>
+        The traders, these become the first axis of the tensor
+
+    symbols : List<str>
+        The stocks, these become the last axis of the tensor
+
+    days : List<datetime.date>
+        The trading days, these become the middle axis of the tensor
+
+    Returns
+    -------
+    signals : numpy.ndarray<float64>
+        (traders x days x symbols) tensor of the net upvotes behind each
+        stock, 0 where a stock was not discussed
+    '''
+    columns = {symbol: j for j, symbol in enumerate(symbols)}
+    signals = np.zeros((len(traders), len(days), len(symbols)))
+    for t, trader in enumerate(traders):
+        for d, day in enumerate(days):
+            for stock, buyscore in trader.daily_buy_sell.get(str(day), []):
+                signals[t, d, columns[stock]] = buyscore
+
+    return signals
+
+
+def cube_traders(cube, subreddits):
+    '''
+    Builds a Trader for each of <subreddits> from a sentiment cube rather
+    than from the scored data. Each holds the stocks its subreddit mentioned,
+    in the same order a Trader built from the scored data would, but has no
+    data of its own, so it can only be simulated with the signals from
+    <cube> (see Market.simulate_vectorized and run_sweep)
+
+    Parameters
+    ----------
+    cube : sentiment_cube.SentimentCube
+
+    subreddits : List<str>
+
+    Returns
+    -------
+    traders : List<Trader>
+    '''
+    empty = pd.DataFrame(columns=COMPACT_COLUMNS)
+    traders = []
+    for subreddit in subreddits:
+        trader = Trader(subreddit, empty)
+        trader.owned_stocks = dict.fromkeys(cube.mentioned.get(subreddit, []),
+            0)
+        traders.append(trader)
+
+    return traders
+
+
+def backtest(prices, signals, buy_threshold=0, sell_threshold=0, shares=1):
+    '''
+    Vectorized equivalent of running Trader.day_trade and
+    Trader.evaluate_portfolio every day: a share is bought whenever a stock's
+    signal is positive and sold whenever it is negative, as long as at least
+    one share is owned
+
+    Parameters
+    ----------
+    prices : numpy.ndarray<float64>
+        (days x symbols) matrix returned from build_price_matrix()
+
+    signals : numpy.ndarray<float64>
+        (traders x days x symbols) tensor returned from build_signal_tensor()
+
+    buy_threshold : float
+        Buy when a stock's signal is above this, instead of above 0
+
+    sell_threshold : float
+        Sell when a stock's signal is below minus this, instead of below 0
+
+    shares : int
+        How many shares to buy/sell at a time, instead of 1. When fewer
+        shares than this are owned, all of them are sold
+
+    Returns
+    -------
+    (positions, cost_basis, values) : tuple(numpy.ndarray)
+        positions is the (traders x days x symbols) number of shares owned at
+        the end of each day, cost_basis and values are the (traders x days)
+        amount spent on, and the worth of, each trader's portfolio
+
+    Notes
+    -----
+    Not being able to sell a share that is not owned makes the position a
+    running sum of buy/sell steps that is held at 0 instead of going
+    negative, that is the running sum minus the lowest (negative) value it
+    has reached so far
+    '''
+    steps = shares * ((signals > buy_threshold).astype(np.int64)
+        - (signals < -sell_threshold))
+    totals = np.cumsum(steps, axis=1)
+    positions = totals - np.minimum(np.minimum.accumulate(totals, axis=1), 0)
+
+    trades = np.diff(positions, axis=1, prepend=0)
+    cost_basis = np.cumsum(np.einsum('tds,ds->td', trades, prices), axis=1)
+    values = np.einsum('tds,ds->td', positions, prices)
+
+    return positions, cost_basis, values
+
+
+def trading_days(start_date, end_date):
+    '''
+    Steps through the days of a simulation running from <start_date> to
+    <end_date> (inclusive)
+
+    Yields
+    ------
+    current_date : datetime.date
+
+    Notes
+    -----
+    The New York Stock Exchange (NYSE) is closed on weekends and holidays,
+    so those days are skipped (see trading_calendar)
+    '''
+    yield from trading_calendar.sessions(start_date, end_date).tolist()
 
 
 class Market():
@@ -67,84 +444,223 @@ class Market():
     self.end_date : datetime.date
         The last day of the simulation
 
-    self.stocks : dict
-        A dictionary of the available stocks, each entry takes the form:
-        {symbol : Stock} (see Stock object)
+    self.stock_data_dir : str
+        Filepath to directory containing all the csv files for each stock
+
+    self.cache_size : int
+        The maximum number of stocks kept loaded in memory at once
+
+    self.store : price_store.PriceStore OR None
+        If given, stock prices are read from here instead of from the csv
+        files in self.stock_data_dir
+
+    self.asof : bool
+        See Stock.get_open
+
+    self.stocks : StockCache
+        The available stocks, indexed like a dictionary taking the form:
+        {symbol : Stock} (see Stock and StockCache objects)
 
     Methods
     -------
     read_in_stocks(stock_data_dir -> str) -> None
+    trading_days() -> generator<datetime.date>
     simulate() -> None
+    simulate_vectorized() -> None
     '''
-    def __init__(self, traders, stock_data_dir, start_date, end_date):
+    def __init__(self, traders, stock_data_dir, start_date, end_date,
+            cache_size=1024, store=None, asof=False):
         self.traders = traders
         self.start_date = start_date
         self.end_date = end_date
+        self.stock_data_dir = stock_data_dir
+        self.cache_size = cache_size
+        self.store = store
+        self.asof = asof
         self.stocks = {}
 
 
     def read_in_stocks(self, stock_data_dir):
         '''
-        Populates self.stocks by loading in the stock data
+        Populates self.stocks with the stocks the traders can actually trade,
+        that is every symbol mentioned in a trader's data (or held from a
+        checkpoint, see Trader.restore) that also has a csv file in
+        <stock_data_dir>. Mentioned symbols without one are priced at 0 (see
+        StockCache). The stock data itself is only read in the first time a
+        stock is accessed
 
         Parameters
         ---------
         stock_data_dir : str
             Filepath to directory containing all the csv files for each stock
         '''
-        for root, dirs, files in os.walk(stock_data_dir):
-            for name in files:
-                stock_name = name.strip('.csv')
-                self.stocks[stock_name] = Stock(stock_name)
+        wanted = set()
+        for trader in self.traders:
+            wanted.update(trader.owned_stocks)
+        if self.store is not None:
+            available = set(self.store.symbols)
+        else:
+            available = {os.path.splitext(name)[0]
+                for name in os.listdir(stock_data_dir) if name.endswith('.csv')}
+
+        self.stocks = StockCache(stock_data_dir, wanted & available,
+            self.cache_size, self.store)
+        if args.verbose:
+            print(f'{len(wanted)} stocks mentioned, {len(self.stocks)} of '\
+                f'them have stock data in {stock_data_dir}')
+
+
+    def trading_days(self):
+        '''
+        Steps through the days of the simulation, see trading_days()
+
+        Yields
+        ------
+        current_date : datetime.date
+        '''
+        return trading_days(self.start_date, self.end_date)
 
 
     def simulate(self):
         '''
         Simulates the stock market and the impacts on each trader's
         portfolios, when finished, writes each portfolio to a csv file
+        '''
+        with metrics.timer('read'):
+            self.read_in_stocks(self.stock_data_dir)
+        for current_date in self.trading_days():
+            for trader in self.traders:
+                with metrics.timer('trade'):
+                    trader.day_trade(str(current_date), self.stocks,
+                        args.verbose and current_date.day == 1, self.asof)
+                with metrics.timer('valuation'):
+                    trader.evaluate_portfolio(self.stocks, current_date,
+                        self.asof)
+            metrics.count('trader_days', len(self.traders))
 
-        Notes
-        -----
-        The New York Stock Exchange (NYSE) is closed on weekends, so this
-        method skips those days.
 
-        TODO
-        ----
-        The NYSE is also closed for:
-            * New Years Day
-            * Martin Luther King, Jr. Day
-            * Washington's Birthday
-            * Good Friday
-            * Memorial Day
-            * Juneteenth National Independence Day
-            * Independnce Day
-            * Labor Day
-            * Thanksgiving Day
-            * Christmas Day
-        It would be nice if skipping these days could be added as well. This
-        problem is trickier than it iniitiall sounds as holidays are not
-        observed on the same date every year, (ex: New Years Day is January
-        1st, but in 2022 it was observed January 3rd; in 2023 it will be
-        observed January 2nd).
+        with metrics.timer('write'):
+            for trader in self.traders:
+                trader.write_portfolio_to_csv()
+
+
+    def simulate_vectorized(self, cube=None):
         '''
-        self.read_in_stocks('data/stock_data')
-        current_date = self.start_date
-        weekend = set([5, 6]) # Skip weekends
-        while current_date <= self.end_date:
-            current_date += datetime.timedelta(days=1)
-            if current_date.weekday() in weekend:
-                current_date += datetime.timedelta(days=1)
+        Same as simulate(), but instead of stepping through the days one at a
+        time, builds a (days x stocks) matrix of opening prices and a
+        (traders x days x stocks) tensor of each trader's signals, and
+        simulates every day for every trader at once (see backtest()). Leaves
+        each trader in the same state simulate() would, and writes the same
+        csv files (both round portfolio values and cost basis to the cent)
 
-            for trader in self.traders:
-                if args.verbose and current_date.day == 1:
-                    trader.day_trade(str(current_date), self.stocks, True)
-                else:
-                    trader.day_trade(str(current_date), self.stocks)
-                trader.evaluate_portfolio(self.stocks, current_date)
+        Parameters
+        ----------
+        cube : sentiment_cube.SentimentCube OR None
+            If given, the signals are read from the cube instead of from each
+            trader's data (see cube_traders)
+        '''
+        with metrics.timer('read'):
+            self.read_in_stocks(self.stock_data_dir)
+            days = list(self.trading_days())
+            symbols = sorted(set().union(*(trader.owned_stocks
+                for trader in self.traders)))
+            prices = build_price_matrix(self.stocks, symbols, days, self.asof)
+        # Trading and valuation happen together in backtest()
+        with metrics.timer('trade'):
+            if cube is not None:
+                signals = cube.signals([trader.subreddit
+                    for trader in self.traders], symbols, days)
+            else:
+                signals = build_signal_tensor(self.traders, symbols, days)
+            positions, cost_basis, values = backtest(prices, signals)
+        metrics.count('trader_days', len(self.traders) * len(days))
+        metrics.count('trades', int(np.abs(np.diff(positions, axis=1,
+            prepend=0)).sum()))
+
+        columns = {symbol: j for j, symbol in enumerate(symbols)}
+        for t, trader in enumerate(self.traders):
+            if days:
+                trader.owned_stocks = {stock: int(positions[t, -1, columns[stock]])
+                    for stock in trader.owned_stocks}
+                trader.cost_basis = round(float(cost_basis[t, -1]), 2)
+            trader.dated_portfolio_values = dict(zip(days,
+                to_cents(values[t])))
+            trader.dated_cost_basis = dict(zip(days, to_cents(cost_basis[t])))
+            if args.verbose and days:
+                print(f"r/{trader.subreddit}'s portfolio is worth "\
+                    f"${values[t, -1]} on {days[-1]}. They spent "\
+                    f"${trader.cost_basis} for a profit/loss of "\
+                    f"${values[t, -1] - trader.cost_basis}")
+            with metrics.timer('write'):
+                trader.write_portfolio_to_csv()
+
+
+
+class StockCache():
+    '''
+    Dictionary-like collection of stocks that reads each stock's csv file (or
+    its column of a price store) on first access. At most <maxsize> stocks
+    are kept in memory, the least recently used stock is dropped (and read
+    again if it is needed later) once that limit is reached
+
+    Attributes
+    ----------
+    self.stock_data_dir : str
+        Filepath to directory containing all the csv files for each stock
 
+    self.symbols : set<str>
+        The symbols that have stock data. Any other symbol is served as a
+        Stock with no prices, so it is priced at 0 (ex: a delisted symbol
+        collect_stock_data.py could not download)
+
+    self.maxsize : int
+        The maximum number of stocks to keep in memory at once
+
+    self.store : price_store.PriceStore OR None
+        If given, stocks are read from here instead of from csv files
+
+    Methods
+    -------
+    keys() -> set<str>
+    '''
+    def __init__(self, stock_data_dir, symbols, maxsize=1024, store=None):
+        self.stock_data_dir = stock_data_dir
+        self.symbols = set(symbols)
+        self.maxsize = maxsize
+        self.store = store
+        self._loaded = OrderedDict()
+        self._missing = {}
+
+
+    def __getitem__(self, symbol):
+        stock = self._loaded.get(symbol)
+        if stock is not None:
+            self._loaded.move_to_end(symbol)
+            return stock
+        if symbol not in self.symbols:
+            if symbol not in self._missing:
+                self._missing[symbol] = Stock(symbol, None)
+            return self._missing[symbol]
+
+        stock = Stock(symbol, self.stock_data_dir, self.store)
+        metrics.count('stocks_loaded')
+        self._loaded[symbol] = stock
+        if len(self._loaded) > self.maxsize:
+            self._loaded.popitem(last=False)
+
+        return stock
+
+
+    def __contains__(self, symbol):
+        return symbol in self.symbols
 
-        for trader in self.traders:
-            trader.write_portfolio_to_csv()
+
+    def __len__(self):
+        return len(self.symbols)
+
+
+    def keys(self):
+        return self.symbols
 
 
 
@@ -157,49 +673,123 @@ class Stock():
     self.symbol : str
         The stock's NASDAQ symbol
 
-    self.data : pandas.core.frame.DataFrame
-        The stock's open price on each date
+    self.dates : numpy.ndarray<datetime64[D]>
+        The sorted dates the stock has an opening price for
+
+    self.opens : numpy.ndarray<float64>
+        The stock's open price (rounded to 2 decimal places) on each date in
+        self.dates
+
+    A stock with no stock data (<stock_data_dir> is None, it has no csv file
+    or it is not in the price store) has no dates, so it is priced at 0
 
     Methods
     -------
-    get_open(date -> str) -> float
+    get_open(date -> str, asof -> bool) -> float
+    get_opens(dates -> numpy.ndarray, asof -> bool) -> numpy.ndarray
     '''
-    def __init__(self, stock_name):
+    def __init__(self, stock_name, stock_data_dir='data/stock_data', store=None):
         self.symbol = stock_name
-        self.data = pd.read_csv(f'data/stock_data/{stock_name}.csv').loc[:, 'Date':'Open']
-
-
-    def get_open(self, date):
+        if store is not None:
+            has_data = stock_name in store
+        else:
+            path = None if stock_data_dir is None \
+                else os.path.join(stock_data_dir, f'{stock_name}.csv')
+            has_data = path is not None and os.path.exists(path)
+        if not has_data:
+            self.dates = np.empty(0, dtype='datetime64[D]')
+            self.opens = np.empty(0, dtype=np.float64)
+            return
+
+        if store is not None:
+            # Rounded straight from the memory mapped column, which is only
+            # copied once more if the stock is missing some dates
+            opens = np.round(store.column(stock_name, 'Open'), 2)
+            found = ~np.isnan(opens)
+            if found.all():
+                self.dates = store.dates
+                self.opens = opens
+            else:
+                self.dates = store.dates[found]
+                self.opens = opens[found]
+        else:
+            data = pd.read_csv(path, usecols=['Date', 'Open']).dropna()
+            # Dates may carry a time/timezone suffix, only the day matters here
+            dates = data['Date'].str[:10].to_numpy(dtype=str).astype('datetime64[D]')
+            order = np.argsort(dates, kind='stable')
+            self.dates = dates[order]
+            self.opens = np.round(data['Open'].to_numpy(dtype=np.float64)[order],
+                2)
+
+
+    def get_open(self, date, asof=False):
         '''
         Gets the opening price of the stock on <date>
 
         Parameters
         ----------
-        date : str
+        date : str OR datetime.date
             The date of the opening price to be accessed
 
+        asof : bool
+            If True and there is no opening price on <date>, fall back to the
+            last known opening price before <date>
+
         Returns
         -------
         stock_open -> float
             The opening price of the stock on <date> (rounded to 2 decimal
-            places)
+            places), or 0 if no price could be found
 
-        TODO
-        ----
-        If a stock's opening price cannot be found on a given date, this
-        method currently simply retruns 0. Determine a better way to handle
-        these situations
+        Notes
+        -----
+        Lookups are a binary search over self.dates, so they cost O(log n)
+        no matter how much history the stock has
+        '''
+        day = np.datetime64(str(date)[:10], 'D')
+        i = np.searchsorted(self.dates, day, side='right') - 1
+        if i >= 0 and (asof or self.dates[i] == day):
+            return float(self.opens[i])
+
+        metrics.count('failed_price_lookups')
+        if args.verbose and args.debug:
+            print(f'WARNING: stock_open was unable to be found for '
+                f'{self.symbol} on {date}, returning 0.')
+        return 0
+
+
+    def get_opens(self, dates, asof=False):
+        '''
+        Vectorized get_open(), looks up the opening price on many dates at
+        once
+
+        Parameters
+        ----------
+        dates : numpy.ndarray<datetime64[D]>
+            The dates of the opening prices to be accessed
+
+        asof : bool
+            See get_open
+
+        Returns
+        -------
+        opens : numpy.ndarray<float64>
+            The opening price on each of <dates>, 0 where get_open would
+            return 0
         '''
-        date = str(date)
-        stock_open = 0
-        try:
-            stock_open = round(float(self.data.loc[self.data['Date'] == date]['Open']), 2)
-        except:
-            if args.verbose and args.debug:
-                print(f'WARNING: stock_open was unable to be parsed for '
-                    f'{self.symbol} on {date}, returning 0. {stock_open}')
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        if len(self.dates) == 0:
+            metrics.count('failed_price_lookups', len(dates))
+            return np.zeros(len(dates))
+
+        i = np.searchsorted(self.dates, dates, side='right') - 1
+        found = i >= 0
+        i = np.maximum(i, 0)
+        if not asof:
+            found &= self.dates[i] == dates
 
-        return stock_open
+        metrics.count('failed_price_lookups', len(found) - int(found.sum()))
+        return np.where(found, self.opens[i], 0.0)
 
 
 class Trader():
@@ -213,7 +803,16 @@ class Trader():
         The subreddit name (ex: investing)
 
     self.data : pandas.core.frame.DataFrame
-        All the scored comments from the subreddit
+        The scored comments of every subreddit (ideally compacted, see
+        compact_data), shared with every other Trader built from it rather
+        than copied
+
+    self.rows : numpy.ndarray<int64>
+        The positions in self.data of this subreddit's comments
+
+    self.daily_buy_sell : dict{<str>, List<tuple(<str>, <int>)>}
+        A dictionary containing dates as the keys, and the net upvotes of
+        each stock discussed on that date as the values (see day_trade)
 
     self.owned_stocks : dict{<str>, <int>}
         A dictionary containing the name of stocks this Trader has bought as
@@ -222,29 +821,88 @@ class Trader():
     self.cost_basis : float
        How much money this Trader has spent buying stocks
 
+    self.dated_cost_basis : dict{<datetime.date>, <float>}
+        self.cost_basis at the end of each day simulated
+
     self.data_portfolio_values : dict{<str>, <float>}
         A dictionary containing dates as the keys and how much this Trader's
         portfolio was worth on those dates as the values
 
     Methods
     -------
-    day_trade(date -> str, stocks -> List<Stock>, verbose -> bool) -> None
-    evaluate_portfolio(stocks -> List<Stock>, date -> str) -> None
-    write_portfolio_to_csv() -> None
+    column(name -> str) -> pandas.core.series.Series
+    index_by_day() -> dict
+    day_trade(date -> str, stocks -> List<Stock>, verbose -> bool,
+        asof -> bool) -> None
+    evaluate_portfolio(stocks -> List<Stock>, date -> str, asof -> bool)
+        -> None
+    write_portfolio_to_csv(results_dir -> str) -> None
+    checkpoint() -> dict
+    restore(checkpoint -> dict) -> None
     '''
     def __init__(self, subreddit, data):
         self.subreddit = subreddit
-        self.data = data.loc[data['subreddit'] == subreddit]
-        self.owned_stocks = {stock:0 for stock in self.data['stock']}
+        self.data = data
+        self.rows = np.flatnonzero((data['subreddit'] == subreddit).to_numpy())
+        if args.debug:
+            self.rows = self.rows[:10]
+            print(f'{subreddit} trader initialized. Data:\n'\
+                f'{self.data.iloc[self.rows]}')
+
+        self.owned_stocks = dict.fromkeys(self.column('stock').unique(), 0)
         self.cost_basis = 0.0
         self.dated_portfolio_values = {}
+        self.dated_cost_basis = {}
+        self.daily_buy_sell = self.index_by_day()
 
-        if args.debug:
-            self.data = self.data.head(10)
-            print(f'{subreddit} trader initialized. Data:\n{self.data}')
 
+    def column(self, name):
+        '''
+        Returns
+        -------
+        pandas.core.series.Series
+            This subreddit's rows of the column <name> of self.data
+        '''
+        return self.data[name].iloc[self.rows]
+
+
+    def index_by_day(self):
+        '''
+        Totals up the upvotes behind each stock on each date ahead of time,
+        so that day_trade is a dictionary lookup instead of a scan over all
+        of self.data. Posts/comments with a positive sentiment add their
+        upvotes to the stock's total, all others subtract them
 
-    def day_trade(self, date, stocks, verbose=False):
+        Returns
+        -------
+        daily_buy_sell : dict{<str>, List<tuple(<str>, <int>)>}
+            For each date, the (stock, net upvotes) of every stock discussed
+            that day, in the order the stocks first appear in self.data
+        '''
+        score = self.column('score').astype(np.int64)
+        upvotes = score.where(self.column('pos') > self.column('neg'), -score)
+        # Categoricals are grouped by their codes, which keeps the groups in
+        # order of first appearance on every version of pandas
+        dates = self.column('date')
+        stocks = self.column('stock')
+        names = None
+        if isinstance(stocks.dtype, pd.CategoricalDtype):
+            names, stocks = stocks.cat.categories, stocks.cat.codes
+        totals = upvotes.groupby([dates, stocks], sort=False).sum()
+
+        day_numbers = pd.api.types.is_integer_dtype(dates.dtype)
+        daily_buy_sell = {}
+        for (date, stock), buyscore in totals.items():
+            if day_numbers:
+                date = str(np.datetime64(int(date), 'D'))
+            if names is not None:
+                stock = names[stock]
+            daily_buy_sell.setdefault(date, []).append((stock, buyscore))
+
+        return daily_buy_sell
+
+
+    def day_trade(self, date, stocks, verbose=False, asof=False):
         '''
         Simulate buying/selling <stocks> on <date>
 
@@ -263,6 +921,12 @@ class Trader():
         stocks : List<Stock>
             List containing stocks and their historical opening prices
 
+        verbose : bool
+            Whether to print the trades made
+
+        asof : bool
+            See Stock.get_open
+
         Modifies
         --------
         self.owned_stocks
@@ -278,28 +942,19 @@ class Trader():
         with a negative sentiment with 7,000 upvotes, the Trader will elect to
         BUY a share of GME
         '''
-        todays_posts = pd.DataFrame(self.data.loc[self.data['date'] == date])
-        stock_buy_sell = {stock:0 for stock in todays_posts['stock']}
         if verbose:
             print(f'{"-" * 50}\n Now day trading as r/{self.subreddit} on '\
                 f'{date}\n{"-" * 50}')
 
-        for _, row in todays_posts.iterrows():
-            name = row['stock']
-            score = ast.literal_eval(row['sentiment_score'])
-            upvotes = row['score']
-            if score['pos'] > score['neg']:
-                stock_buy_sell[name] += upvotes
-            else:
-                stock_buy_sell[name] -= upvotes
-
-        for stock, buyscore in stock_buy_sell.items():
+        trades = 0
+        for stock, buyscore in self.daily_buy_sell.get(date, []):
             stock_data = stocks[stock]
-            stock_open = stock_data.get_open(date)
+            stock_open = stock_data.get_open(date, asof)
 
             if buyscore > 0:
                 self.owned_stocks[stock] += 1
                 self.cost_basis += stock_open
+                trades += 1
 
                 if verbose:
                     print(f'{self.subreddit} bought {stock} for ${stock_open}')
@@ -308,6 +963,8 @@ class Trader():
                 self.cost_basis -= stock_open
                 if verbose:
                     print(f'{self.subreddit} sold {stock} for ${stock_open}')
+                trades += 1
+        metrics.count('trades', trades)
 
         if verbose:
             print(f"r/{self.subreddit}'s portfolio on {date}:")
@@ -317,7 +974,7 @@ class Trader():
             print()
 
 
-    def evaluate_portfolio(self, stocks, date):
+    def evaluate_portfolio(self, stocks, date, asof=False):
         '''
         Determines the dollar value of Trader's portfolio on <date>
 
@@ -329,53 +986,383 @@ class Trader():
         date : str
             The date to evaluate the simulated portfolio
 
+        asof : bool
+            See Stock.get_open
+
         Modifies
         --------
         self.dated_portfolio_values
+        self.dated_cost_basis
         '''
         if args.debug:
             print(f"Evaluating r/{self.subreddit}'s portfolio:\n"\
             f"{self.owned_stocks}")
         portfolio_value = 0
         for stock, quantity in self.owned_stocks.items():
-            portfolio_value += round(stocks[stock].get_open(date) * quantity, 2)
-
+            # Stocks that are not held are worth nothing, and looking them up
+            # would keep every mentioned stock loaded in the StockCache
+            if quantity == 0:
+                continue
+            portfolio_value += round(stocks[stock].get_open(date, asof) * quantity, 2)
+
+        # Summing prices builds up float error, which would otherwise end up
+        # in the results
+        portfolio_value = round(portfolio_value, 2)
+        self.cost_basis = round(self.cost_basis, 2)
         self.dated_portfolio_values[date] = portfolio_value
+        self.dated_cost_basis[date] = self.cost_basis
         if args.verbose:
             print(f"r/{self.subreddit}'s portfolio is worth ${portfolio_value} "\
                 f"on {date}. They spent ${self.cost_basis} for a profit/loss of "\
                 f"${portfolio_value - self.cost_basis}")
 
 
-    def write_portfolio_to_csv(self):
+    def write_portfolio_to_csv(self, results_dir='data/results'):
         '''
         Writes self.owned_stocks and self.date_portfolio_values to a csv file
-        in the data/results/ directory; those files will be named
-        <subreddit>_stocks.csv and <subreddit>_p_value.csv respectively
+        in the <results_dir> directory, see write_portfolio()
         '''
-        stocks = pd.DataFrame.from_dict(self.owned_stocks, orient='index')
-        stocks.to_csv(f'data/results/{self.subreddit}_stocks.csv')
+        write_portfolio(self.subreddit, self.owned_stocks,
+            self.dated_portfolio_values, results_dir)
 
-        p_value = pd.DataFrame.from_dict(self.dated_portfolio_values, orient='index')
-        p_value.to_csv(f'data/results/{self.subreddit}_p_value.csv')
 
+    def checkpoint(self):
+        '''
+        Captures this Trader's portfolio, so a later simulation can pick up
+        where this one left off (see restore)
 
-if __name__ == '__main__':
-    start = time.time()
-    data = pd.read_csv('data/scored_reddit.csv')
-    if not os.path.exists('data/results'):
-        if args.verbose:
-            print('results data directory not found, creating a new one')
-        os.mkdir('data/results')
+        Returns
+        -------
+        checkpoint : dict
+            JSON serializable owned_stocks, cost_basis,
+            dated_portfolio_values and dated_cost_basis (keyed by ISO dates)
+        '''
+        return {
+            'owned_stocks' : {stock: int(quantity)
+                for stock, quantity in self.owned_stocks.items()},
+            'cost_basis' : float(self.cost_basis),
+            'dated_portfolio_values' : {str(date): float(value)
+                for date, value in self.dated_portfolio_values.items()},
+            'dated_cost_basis' : {str(date): float(cost_basis)
+                for date, cost_basis in self.dated_cost_basis.items()},
+        }
+
+
+    def restore(self, checkpoint):
+        '''
+        Resumes from a portfolio captured by checkpoint(). Stocks first
+        mentioned in this subreddit's rows of self.data are added to the
+        portfolio with 0 shares
+
+        Modifies
+        --------
+        self.owned_stocks
+        self.cost_basis
+        self.dated_portfolio_values
+        self.dated_cost_basis
+        '''
+        owned_stocks = dict(checkpoint['owned_stocks'])
+        for stock in self.owned_stocks:
+            owned_stocks.setdefault(stock, 0)
+        self.owned_stocks = owned_stocks
+        self.cost_basis = checkpoint['cost_basis']
+        self.dated_portfolio_values = {datetime.date.fromisoformat(date): value
+            for date, value in checkpoint['dated_portfolio_values'].items()}
+        self.dated_cost_basis = {datetime.date.fromisoformat(date): value
+            for date, value in checkpoint.get('dated_cost_basis', {}).items()}
+
+
+def to_cents(values):
+    '''
+    Rounds a row of backtest() values to the cent the same way (with round())
+    Trader.evaluate_portfolio does, so both engines write the same csv files
+
+    Returns
+    -------
+    values : List<float>
+    '''
+    return [round(value, 2) for value in values.tolist()]
 
 
-    wallstreetbets = Trader('wallstreetbets', data)
-    investing = Trader('investing', data)
-    stocks = Trader('stocks', data)
+def write_portfolio(subreddit, owned_stocks, dated_portfolio_values,
+        results_dir='data/results'):
+    '''
+    Writes a trader's <owned_stocks> and <dated_portfolio_values> to csv
+    files in <results_dir>, named <subreddit>_stocks.csv and
+    <subreddit>_p_value.csv respectively
+    '''
+    stocks = pd.DataFrame.from_dict(owned_stocks, orient='index')
+    stocks.to_csv(os.path.join(results_dir, f'{subreddit}_stocks.csv'))
+
+    p_value = pd.DataFrame.from_dict(dated_portfolio_values, orient='index')
+    p_value.to_csv(os.path.join(results_dir, f'{subreddit}_p_value.csv'))
+
+
+def expand_grid(grid):
+    '''
+    Expands a sweep grid into the list of simulations it describes, one for
+    every combination of the grid's values. A grid takes the form:
+        {
+            "windows": [["2019-04-27", "2021-01-27"], ...],
+            "subreddits": [["wallstreetbets", "investing", "stocks"], ...],
+            "buy_thresholds": [0, ...],
+            "sell_thresholds": [0, ...],
+            "shares": [1, ...]
+        }
+    Missing keys default to the values simulate.py uses without --sweep
+
+    Returns
+    -------
+    configs : List<dict>
+        One dictionary per simulation, with the keys run_id, start, end,
+        subreddits, buy_threshold, sell_threshold and shares
+    '''
+    windows = grid.get('windows', [[str(args.start), str(args.end)]])
+    configs = []
+    for run_id, (window, subreddits, buy_threshold, sell_threshold, shares) \
+            in enumerate(itertools.product(windows,
+                grid.get('subreddits', [args.subreddits]),
+                grid.get('buy_thresholds', [0]),
+                grid.get('sell_thresholds', [0]),
+                grid.get('shares', [1]))):
+        configs.append({
+            'run_id' : run_id,
+            'start' : datetime.date.fromisoformat(window[0]),
+            'end' : datetime.date.fromisoformat(window[1]),
+            'subreddits' : list(subreddits),
+            'buy_threshold' : buy_threshold,
+            'sell_threshold' : sell_threshold,
+            'shares' : shares,
+        })
+
+    return configs
+
+
+# Each sweep worker maps the shared price/signal arrays once, when the pool
+# starts
+_sweep_prices = None
+_sweep_signals = None
+
+
+def _init_sweep_worker(prices_path, signals_path):
+    global _sweep_prices, _sweep_signals
+    _sweep_prices = np.load(prices_path, mmap_mode='r')
+    _sweep_signals = np.load(signals_path, mmap_mode='r')
+
+
+def _run_sweep_config(task):
+    config, day_rows, trader_rows, record = task
+    prices = _sweep_prices[day_rows]
+    signals = _sweep_signals[trader_rows][:, day_rows]
+    positions, cost_basis, values = backtest(prices, signals,
+        config['buy_threshold'], config['sell_threshold'], config['shares'])
+
+    results = []
+    for t, subreddit in enumerate(config['subreddits']):
+        # Rounded to the cent like to_cents(), so the table matches the
+        # results store
+        final_value = round(float(values[t, -1]), 2) if len(day_rows) else 0.0
+        spent = round(float(cost_basis[t, -1]), 2) if len(day_rows) else 0.0
+        results.append({
+            'run_id' : config['run_id'],
+            'subreddit' : subreddit,
+            'start' : str(config['start']),
+            'end' : str(config['end']),
+            'buy_threshold' : config['buy_threshold'],
+            'sell_threshold' : config['sell_threshold'],
+            'shares' : config['shares'],
+            'days' : len(day_rows),
+            'final_value' : final_value,
+            'cost_basis' : spent,
+            'profit' : round(final_value - spent, 2),
+        })
+
+    if not record:
+        return results, None
+    final_positions = positions[:, -1] if len(day_rows) \
+        else np.zeros(positions.shape[::2])
+    return results, (final_positions, values, cost_basis)
+
+
+def _record_sweep(outputs, configs, config_days, symbols, results_store):
+    # Records each simulation as it finishes, rather than holding every
+    # simulation's daily values at once
+    results = []
+    for config, days, (rows, daily) in zip(configs, config_days, outputs):
+        results.append(rows)
+        if results_store is None:
+            continue
+        final_positions, values, cost_basis = daily
+        run_id = results_store.start_run({**config, 'script': 'simulate',
+            'engine': 'vectorized', 'sweep_run_id': config['run_id']})
+        for t, subreddit in enumerate(config['subreddits']):
+            results_store.record_portfolio(run_id, subreddit,
+                dict(zip(symbols, final_positions[t].tolist())),
+                dict(zip(days, to_cents(values[t]))),
+                dict(zip(days, to_cents(cost_basis[t]))))
+
+    return results
+
+
+def run_sweep(data, grid, stock_data_dir, workers=1, asof=False, store=None,
+        results_store=None, cube=None):
+    '''
+    Runs every simulation described by <grid> (see expand_grid) with the
+    vectorized engine. The prices and signals for every day, stock and
+    subreddit the grid touches are built once and saved as memory mapped
+    arrays, which every simulation (in every worker process) then shares
+
+    Parameters
+    ----------
+    data : pandas.core.frame.DataFrame OR None
+        returned from read_scored_data(), None when using <cube>
+
+    grid : dict
+        See expand_grid()
+
+    stock_data_dir : str
+        Filepath to directory containing all the csv files for each stock
+
+    workers : int
+        The number of worker processes to use
 
-    start_date = datetime.date(2019, 4, 27)
-    end_date = datetime.date(2021, 1, 27)
-    market = Market([wallstreetbets, investing, stocks], 'data/stock_data', start_date, end_date)
-    market.simulate()
+    asof : bool
+        See Stock.get_open
+
+    store : price_store.PriceStore OR None
+        See Market.store
+
+    results_store : results_store.ResultsStore OR None
+        If given, each simulation is also recorded here as its own run,
+        with its holdings and daily values
+
+    cube : sentiment_cube.SentimentCube OR None
+        If given, the signals are read from the cube instead of from <data>
+
+    Returns
+    -------
+    results : pandas.core.frame.DataFrame
+        One row per (run_id, subreddit), indexed by both
+    '''
+    configs = expand_grid(grid)
+    subreddits = sorted(set().union(*(config['subreddits']
+        for config in configs)))
+    if cube is not None:
+        traders = cube_traders(cube, subreddits)
+    else:
+        traders = [Trader(subreddit, data) for subreddit in subreddits]
+    trader_rows = {subreddit: t for t, subreddit in enumerate(subreddits)}
+
+    config_days = [list(trading_days(config['start'], config['end']))
+        for config in configs]
+    days = sorted(set().union(*config_days))
+    day_rows = {day: d for d, day in enumerate(days)}
+
+    market = Market(traders, stock_data_dir, min(days, default=args.start),
+        max(days, default=args.end), args.cache_size, store, asof)
+    market.read_in_stocks(stock_data_dir)
+    symbols = sorted(set().union(*(trader.owned_stocks for trader in traders)))
+    if args.verbose:
+        print(f'Sweeping {len(configs)} simulations over {len(days)} days, '\
+            f'{len(symbols)} stocks and {len(subreddits)} subreddits')
+
+    tasks = [(config,
+        np.array([day_rows[day] for day in days_], dtype=np.int64),
+        np.array([trader_rows[subreddit] for subreddit in config['subreddits']],
+            dtype=np.int64), results_store is not None)
+        for config, days_ in zip(configs, config_days)]
+    with tempfile.TemporaryDirectory() as shared_dir:
+        prices_path = os.path.join(shared_dir, 'prices.npy')
+        signals_path = os.path.join(shared_dir, 'signals.npy')
+        np.save(prices_path, build_price_matrix(market.stocks, symbols, days,
+            asof))
+        if cube is not None:
+            signals = cube.signals(subreddits, symbols, days)
+        else:
+            signals = build_signal_tensor(traders, symbols, days)
+        np.save(signals_path, signals)
+
+        if workers <= 1:
+            _init_sweep_worker(prices_path, signals_path)
+            results = _record_sweep(map(_run_sweep_config, tasks), configs,
+                config_days, symbols, results_store)
+        else:
+            with multiprocessing.Pool(workers, _init_sweep_worker,
+                    (prices_path, signals_path)) as pool:
+                results = _record_sweep(pool.imap(_run_sweep_config, tasks),
+                    configs, config_days, symbols, results_store)
+
+    results = pd.DataFrame([row for rows in results for row in rows])
+    return results.set_index(['run_id', 'subreddit'])
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.cube and args.engine != 'vectorized' and not args.sweep:
+        parser.error('--cube needs --engine vectorized or --sweep')
+    start = time.time()
+    with instrument.profiled(args.profile), metrics.timer('simulate'):
+        with metrics.timer('read'):
+            if args.cube:
+                cube = SentimentCube(args.cube)
+                data = None
+            else:
+                cube = None
+                data = read_scored_data('data/scored_reddit.csv', compact=True)
+        if not os.path.exists('data/results'):
+            if args.verbose:
+                print('results data directory not found, creating a new one')
+            os.mkdir('data/results')
+
+
+        if args.all_subreddits and cube is not None:
+            subreddits = sorted(cube.subreddits)
+        elif args.all_subreddits:
+            subreddits = sorted(data['subreddit'].unique())
+        else:
+            subreddits = args.subreddits
+
+        store = PriceStore(args.price_store) if args.price_store else None
+        results_db = None if args.no_results_db \
+            else ResultsStore(args.results_db)
+        if args.sweep:
+            with open(args.sweep) as f:
+                grid = json.load(f)
+            if args.all_subreddits:
+                grid.setdefault('subreddits', [subreddits])
+            with metrics.timer('sweep'):
+                results = run_sweep(data, grid, 'data/stock_data', args.workers,
+                    args.asof, store, results_db, cube)
+            results.to_csv('data/results/sweep_results.csv')
+            if args.verbose:
+                print(results)
+        else:
+            with metrics.timer('index'):
+                if cube is not None:
+                    traders = cube_traders(cube, subreddits)
+                else:
+                    traders = [Trader(subreddit, data)
+                        for subreddit in subreddits]
+            market = Market(traders, 'data/stock_data', args.start, args.end,
+                args.cache_size, store, args.asof)
+            if args.engine == 'vectorized':
+                market.simulate_vectorized(cube)
+            else:
+                market.simulate()
+            if results_db is not None:
+                with metrics.timer('write'):
+                    run_id = results_db.start_run({'script': 'simulate',
+                        'engine': args.engine, 'subreddits': subreddits,
+                        'start': args.start, 'end': args.end,
+                        'asof': args.asof, 'price_store': args.price_store,
+                        'cube': args.cube})
+                    for trader in traders:
+                        results_db.record_portfolio(run_id, trader.subreddit,
+                            trader.owned_stocks, trader.dated_portfolio_values,
+                            trader.dated_cost_basis)
+        if results_db is not None:
+            results_db.close()
     if args.verbose:
         print(f'Took {time.time() - start} seconds to complete')
+    if args.metrics:
+        metrics.write(args.metrics)
@@ -0,0 +1,461 @@
+'''
+Concurrent, rate limited downloading of historic stock market data. Symbols
+are fetched in batches (several tickers per request) by a bounded pool of
+worker threads, requests to each host are rate limited, failed requests are
+retried with exponential backoff, and every symbol that could not be
+downloaded is reported along with the reason why.
+
+Where the data comes from is up to the backend: YahooBackend downloads it
+from Yahoo Finance, LocalBackend serves csv files from a local directory
+(useful for working offline or testing). A backend is any object with a host
+attribute and a fetch(symbols, start, end, period) method returning a
+dictionary of {symbol : pandas.core.frame.DataFrame}.
+
+Objects
+-------
+RateLimiter
+    acquire() -> None
+YahooBackend
+    fetch(symbols -> List<str>, start -> str, end -> str, period -> str)
+        -> dict
+LocalBackend
+    fetch(symbols -> List<str>, start -> str, end -> str, period -> str)
+        -> dict
+DownloadReport
+Manifest
+    missing_ranges(symbol -> str, start -> str, end -> str) -> List<tuple>
+    record(symbol -> str, start -> str, end -> str) -> None
+    save() -> None
+
+Methods
+-------
+host_limiter(host -> str, rate -> float, burst -> int) -> RateLimiter
+download(symbols -> List<str>, date_range -> str OR tuple, backend,
+    on_result -> callable) -> DownloadReport
+period_to_range(period -> str, today -> datetime.date) -> tuple(<str>, <str>)
+covered_end(end -> str, data -> pandas.core.frame.DataFrame,
+    today -> datetime.date) -> str
+'''
+import datetime
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+# The reason given for symbols a backend returned no data for
+NO_DATA = 'no data returned'
+
+# One RateLimiter per host, shared by every download() call in the process
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class RateLimiter():
+    '''
+    Token bucket rate limiter, shared by every thread talking to one host
+
+    Attributes
+    ----------
+    self.rate : float
+        The number of requests allowed per second
+
+    self.burst : int
+        The number of requests that can be made at once before waiting
+
+    Methods
+    -------
+    acquire() -> None
+    '''
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def acquire(self):
+        '''
+        Blocks until a request is allowed
+        '''
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst,
+                    self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def host_limiter(host, rate, burst=1):
+    '''
+    Gets the RateLimiter for <host>, shared by every download() from it, so
+    downloading in several calls (ex: one per missing date range) does not
+    start each call with a fresh burst. The limiter is created on first use,
+    later calls update its <rate> and <burst>
+
+    Returns
+    -------
+    limiter : RateLimiter
+    '''
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = RateLimiter(rate, burst)
+        limiter = _limiters[host]
+    with limiter._lock:
+        limiter.rate = rate
+        limiter.burst = burst
+    return limiter
+
+
+class YahooBackend():
+    '''
+    Downloads stock data from Yahoo Finance with yfinance
+    '''
+    host = 'query1.finance.yahoo.com'
+
+    def fetch(self, symbols, start=None, end=None, period=None):
+        '''
+        Downloads the data for <symbols>, either from <start> to <end> or over
+        <period>
+
+        Returns
+        -------
+        frames : dict<str, pandas.core.frame.DataFrame>
+            The data for each symbol that returned any, indexed by Date
+        '''
+        import yfinance as yf
+
+        data = yf.download(symbols, start=start, end=end, period=period,
+            group_by='ticker', threads=False, progress=False)
+        if len(symbols) == 1:
+            frames = {symbols[0]: data}
+        else:
+            returned = set(data.columns.get_level_values(0))
+            frames = {symbol: data[symbol] for symbol in symbols
+                if symbol in returned}
+
+        frames = {symbol: frame.dropna(how='all')
+            for symbol, frame in frames.items()}
+        return {symbol: frame for symbol, frame in frames.items()
+            if not frame.empty}
+
+
+class LocalBackend():
+    '''
+    Serves stock data from <SYMBOL>.csv files in a local directory, in the
+    same layout collect_stock_data.py writes them
+
+    Attributes
+    ----------
+    self.source_dir : str
+        The directory holding the csv files
+    '''
+    host = 'local'
+
+    def __init__(self, source_dir):
+        self.source_dir = source_dir
+
+
+    def symbols(self):
+        '''
+        Returns
+        -------
+        symbols : List<str>
+            Every symbol there is a csv file for
+        '''
+        return sorted(os.path.splitext(name)[0]
+            for name in os.listdir(self.source_dir) if name.endswith('.csv'))
+
+
+    def fetch(self, symbols, start=None, end=None, period=None):
+        '''
+        Reads the data for <symbols> from <start> up to (not including) <end>,
+        <period> is ignored and all the data is returned
+
+        Returns
+        -------
+        frames : dict<str, pandas.core.frame.DataFrame>
+            The data for each symbol that has any, indexed by Date
+        '''
+        frames = {}
+        for symbol in symbols:
+            path = os.path.join(self.source_dir, f'{symbol}.csv')
+            if not os.path.exists(path):
+                continue
+            frame = pd.read_csv(path, index_col='Date')
+            dates = frame.index.str[:10]
+            if start is not None:
+                frame = frame[dates >= start]
+                dates = frame.index.str[:10]
+            if end is not None:
+                frame = frame[dates < end]
+            if not frame.empty:
+                frames[symbol] = frame
+
+        return frames
+
+
+class DownloadReport():
+    '''
+    The outcome of download()
+
+    Attributes
+    ----------
+    self.succeeded : List<str>
+        The symbols that were downloaded
+
+    self.failed : dict<str, str>
+        The symbols that could not be downloaded, and why
+    '''
+    def __init__(self):
+        self.succeeded = []
+        self.failed = {}
+
+
+    def to_frame(self):
+        '''
+        Returns
+        -------
+        failures : pandas.core.frame.DataFrame
+            One row per failed symbol, with the reason it failed
+        '''
+        return pd.DataFrame(list(self.failed.items()),
+            columns=['symbol', 'reason'])
+
+
+def _fetch_batch(backend, limiter, batch, date_range, retries, backoff):
+    if isinstance(date_range, tuple):
+        kwargs = {'start': date_range[0], 'end': date_range[1]}
+    else:
+        kwargs = {'period': date_range}
+
+    frames = {}
+    pending = list(batch)
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        limiter.acquire()
+        try:
+            fetched = backend.fetch(pending, **kwargs)
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+            continue
+        frames.update(fetched)
+        pending = [symbol for symbol in pending if symbol not in frames]
+        if not pending:
+            break
+        error = NO_DATA
+
+    return frames, {symbol: error for symbol in pending}
+
+
+def download(symbols, date_range, backend, on_result, batch_size=50,
+        workers=4, rate=2.0, retries=3, backoff=1.0, verbose=False):
+    '''
+    Downloads the data for <symbols> from <backend>, <batch_size> symbols per
+    request, with <workers> requests in flight at once
+
+    Parameters
+    ----------
+    symbols : List<str>
+        The symbols to download
+
+    date_range : str OR tuple(<str>, <str>)
+        Either a period (ex: '1mo') or a (start, end) pair of dates, see
+        collect_stock_data.validate_args()
+
+    backend : YahooBackend OR LocalBackend
+        Where to download the data from
+
+    on_result : callable(symbol -> str, frame -> pandas.core.frame.DataFrame)
+        Called with each symbol's data as soon as its batch finishes. Always
+        called from the calling thread, never from a worker thread
+
+    batch_size : int
+        The number of symbols to fetch per request
+
+    workers : int
+        The number of requests to have in flight at once
+
+    rate : float
+        The maximum number of requests per second to <backend>'s host, across
+        every download() from it (see host_limiter)
+
+    retries : int
+        The number of times to retry a failed request (or the symbols a
+        request returned nothing for)
+
+    backoff : float
+        Seconds to wait before the first retry, doubling on each retry
+
+    verbose : bool
+        Whether to report progress
+
+    Returns
+    -------
+    report : DownloadReport
+    '''
+    limiter = host_limiter(backend.host, rate, burst=workers)
+    batches = [symbols[i:i + batch_size]
+        for i in range(0, len(symbols), batch_size)]
+    report = DownloadReport()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_fetch_batch, backend, limiter, batch,
+            date_range, retries, backoff) for batch in batches]
+        for done, future in enumerate(as_completed(futures), 1):
+            frames, failed = future.result()
+            for symbol, frame in frames.items():
+                on_result(symbol, frame)
+                report.succeeded.append(symbol)
+            report.failed.update(failed)
+            if verbose:
+                print(f'{done}/{len(batches)} batches downloaded, '\
+                    f'{len(report.succeeded)} symbols succeeded, '\
+                    f'{len(report.failed)} failed')
+
+    return report
+
+
+def period_to_range(period, today=None):
+    '''
+    Converts a yfinance style period (ex: '1mo') into the (start, end) dates
+    it covers, end being the day after <today> as end dates are exclusive
+
+    Returns
+    -------
+    date_range : tuple(<str>, <str>)
+    '''
+    today = pd.Timestamp(today or datetime.date.today())
+    if period == 'max':
+        start = pd.Timestamp('1900-01-01')
+    elif period == 'ytd':
+        start = pd.Timestamp(today.year, 1, 1)
+    elif period.endswith('mo'):
+        start = today - pd.DateOffset(months=int(period[:-2]))
+    elif period.endswith('y'):
+        start = today - pd.DateOffset(years=int(period[:-1]))
+    else:
+        start = today - pd.DateOffset(days=int(period[:-1]))
+
+    end = today + pd.DateOffset(days=1)
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+
+def covered_end(end, data=None, today=None):
+    '''
+    Finds how much of a download of the dates up to <end> (exclusive) can be
+    recorded as covered. A bar is only final once its day is over, and a day
+    missing from the end of the data may just not have been published yet,
+    so the coverage stops at <today> and at the day after the last date in
+    <data> (the symbol's downloaded data, if any). Those dates are downloaded
+    again next run
+
+    Returns
+    -------
+    end : str
+        The exclusive end date to record, as YYYY-MM-DD
+    '''
+    today = pd.Timestamp(today or datetime.date.today())
+    end = min(end, today.strftime('%Y-%m-%d'))
+    if data is not None and len(data):
+        last = pd.Timestamp(str(data.index.max())[:10])
+        end = min(end, (last + pd.DateOffset(days=1)).strftime('%Y-%m-%d'))
+    return end
+
+
+class Manifest():
+    '''
+    Records which dates have already been downloaded for each symbol, so that
+    later runs only download the dates that are missing. Each symbol covers a
+    single range of dates, [start, end) (end is exclusive, like yfinance's)
+
+    The manifest is a JSON file taking the form:
+        {"symbols": {"AAPL": {"start": "2019-04-27", "end": "2021-01-27"}}}
+
+    Attributes
+    ----------
+    self.path : str
+        The file path of the manifest
+
+    self.coverage : dict<str, tuple(<str>, <str>)>
+        The (start, end) dates covered for each symbol
+
+    self.save_every : int
+        The manifest is saved after this many calls to record()
+
+    Methods
+    -------
+    missing_ranges(symbol -> str, start -> str, end -> str) -> List<tuple>
+    record(symbol -> str, start -> str, end -> str) -> None
+    save() -> None
+    '''
+    def __init__(self, path, save_every=50):
+        self.path = path
+        self.save_every = save_every
+        self.coverage = {}
+        self._unsaved = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                symbols = json.load(f)['symbols']
+            self.coverage = {symbol: (dates['start'], dates['end'])
+                for symbol, dates in symbols.items()}
+
+
+    def missing_ranges(self, symbol, start, end):
+        '''
+        Finds the dates from <start> to <end> not yet covered for <symbol>.
+        When the requested dates do not overlap the covered ones, the gap
+        between them is included, so the coverage stays a single range
+
+        Returns
+        -------
+        ranges : List<tuple(<str>, <str>)>
+            The (start, end) ranges to download, empty if there are none
+        '''
+        if symbol not in self.coverage:
+            return [(start, end)]
+
+        covered_start, covered_end = self.coverage[symbol]
+        ranges = []
+        if start < covered_start:
+            ranges.append((start, covered_start))
+        if end > covered_end:
+            ranges.append((covered_end, end))
+        return ranges
+
+
+    def record(self, symbol, start, end, replace=False):
+        '''
+        Marks <start> to <end> as covered for <symbol>, extending what is
+        already covered unless <replace> is True
+        '''
+        if symbol in self.coverage and not replace:
+            covered_start, covered_end = self.coverage[symbol]
+            start, end = min(start, covered_start), max(end, covered_end)
+        self.coverage[symbol] = (start, end)
+
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+
+
+    def save(self):
+        '''
+        Writes the manifest out, replacing the previous file in one step so a
+        crash never leaves a half written manifest behind
+        '''
+        symbols = {symbol: {'start': start, 'end': end}
+            for symbol, (start, end) in sorted(self.coverage.items())}
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump({'symbols': symbols}, f, indent=1)
+        os.replace(f'{self.path}.tmp', self.path)
+        self._unsaved = 0
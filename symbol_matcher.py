@@ -0,0 +1,211 @@
+'''
+Finds which stocks a piece of text mentions. Symbols are matched by
+intersecting the text's words with a set of every known symbol, company names
+are (optionally) matched in a single pass over the text's words using an
+Aho-Corasick automaton built over the names' words.
+
+Usage example
+-------------
+>>> matcher = SymbolMatcher({'AAPL': 'Apple Inc. - Common Stock'},
+...     names=True)
+>>> matcher.match('Bought more apple today')
+['AAPL']
+
+Objects
+-------
+SymbolMatcher
+    match(text -> str) -> List<str>
+PhraseAutomaton
+    search(words -> List<str>) -> set<str>
+
+Methods
+-------
+tokenize(text -> str) -> List<str>
+short_name(name -> str) -> List<str>
+'''
+import re
+
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+# Words that only describe the type of company/security, these are removed from
+# the end of company names so that (for example) 'Apple Inc. - Common Stock'
+# is matched by 'Apple'
+NAME_SUFFIXES = {
+    'inc', 'incorporated', 'corp', 'corporation', 'co', 'company', 'companies',
+    'ltd', 'limited', 'plc', 'llc', 'lp', 'nv', 'sa', 'ag', 'se', 'holdings',
+    'holding', 'group', 'trust', 'class', 'a', 'b', 'c', 'common', 'stock',
+    'shares', 'share', 'ordinary', 'sponsored', 'american', 'depositary',
+    'adr', 'ads', 'units', 'warrants', 'rights', 'the',
+}
+
+# Company names shorter than this are too likely to be ordinary words
+MIN_NAME_LENGTH = 3
+
+
+def tokenize(text):
+    '''
+    Strips punctuation from <text> and splits it into words
+
+    Returns
+    -------
+    words : List<str>
+    '''
+    return PUNCTUATION.sub('', text).split()
+
+
+def short_name(name):
+    '''
+    Reduces a security name from symbols_names.csv to the words people
+    actually use when talking about the company
+    (ex: 'Apple Inc. - Common Stock' -> ['apple'])
+
+    Returns
+    -------
+    words : List<str>
+        The lower cased words of the name, empty if nothing is left
+    '''
+    words = tokenize(name.split(' - ')[0].lower())
+    while words and words[-1] in NAME_SUFFIXES:
+        words.pop()
+    while words and words[0] == 'the':
+        words.pop(0)
+
+    return words
+
+
+class PhraseAutomaton():
+    '''
+    Aho-Corasick automaton over words rather than characters, finds every
+    phrase occurring in a list of words in a single pass
+
+    Attributes
+    ----------
+    self.goto : List<dict<str, int>>
+        The trie transitions for each state
+
+    self.fail : List<int>
+        The state to fall back to when a word has no transition
+
+    self.out : List<set<str>>
+        The values of all phrases that end at each state
+
+    Methods
+    -------
+    search(words -> List<str>) -> set<str>
+    '''
+    def __init__(self, phrases):
+        '''
+        Parameters
+        ----------
+        phrases : dict<tuple<str>, str>
+            Maps each phrase (as a tuple of words) to the value reported when
+            that phrase is found
+        '''
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [set()]
+        for phrase, value in phrases.items():
+            state = 0
+            for word in phrase:
+                if word not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(set())
+                    self.goto[state][word] = len(self.goto) - 1
+                state = self.goto[state][word]
+            self.out[state].add(value)
+
+        # Breadth first so each state's fail state is finished before its own
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for word, child in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(word, 0)
+                self.out[child] |= self.out[self.fail[child]]
+                queue.append(child)
+
+
+    def search(self, words):
+        '''
+        Finds the phrases in <words>
+
+        Returns
+        -------
+        found : set<str>
+            The values of every phrase found
+        '''
+        found = set()
+        state = 0
+        for word in words:
+            while state and word not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(word, 0)
+            if self.out[state]:
+                found |= self.out[state]
+
+        return found
+
+
+class SymbolMatcher():
+    '''
+    Finds the stocks mentioned in a piece of text. Built once from the stocks
+    returned by clean_reddit_data.read_stock_data() and reused for every post
+
+    Attributes
+    ----------
+    self.symbols : set<str>
+        Every symbol that can be matched
+
+    self.names : PhraseAutomaton OR None
+        Matches company names, None when company names are not matched
+
+    Methods
+    -------
+    match(text -> str) -> List<str>
+    '''
+    def __init__(self, stocks, stops=(), names=False):
+        '''
+        Parameters
+        ----------
+        stocks : dict<symbol, name>
+            Returned from clean_reddit_data.read_stock_data()
+
+        stops : set<str>
+            Stopwords, these are never matched as symbols
+
+        names : bool
+            Whether to also match company names (ex: 'Apple' for AAPL)
+        '''
+        self._order = {symbol: i for i, symbol in enumerate(stocks)}
+        self.symbols = set(stocks) - set(stops)
+        self.names = None
+        if names:
+            phrases = {}
+            for symbol, name in stocks.items():
+                phrase = tuple(short_name(name))
+                if len(' '.join(phrase)) < MIN_NAME_LENGTH:
+                    continue
+                # Share classes (ex: GOOG and GOOGL) have the same name, only
+                # the first listed symbol is used for those
+                phrases.setdefault(phrase, symbol)
+            self.names = PhraseAutomaton(phrases)
+
+
+    def match(self, text):
+        '''
+        Finds the stocks mentioned in <text>
+
+        Returns
+        -------
+        matches : List<str>
+            The symbols mentioned, in the same order as the stocks dictionary
+            the matcher was built from
+        '''
+        words = tokenize(text)
+        matches = self.symbols.intersection(words)
+        if self.names is not None:
+            matches |= self.names.search([word.lower() for word in words])
+
+        return sorted(matches, key=self._order.__getitem__)
@@ -0,0 +1,101 @@
+import datetime
+
+import pandas as pd
+
+import collect_stock_data
+import simulate
+import stock_downloader
+
+
+def test_failed_symbol_gets_placeholder_priced_at_zero(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(collect_stock_data.args, 'retries', 0)
+    (tmp_path / 'data' / 'stock_data').mkdir(parents=True)
+    source = tmp_path / 'source'
+    source.mkdir()
+    pd.DataFrame({'Date': ['2020-01-02', '2020-01-03'], 'Open': [10.0, 11.0]}
+        ).to_csv(source / 'AAPL.csv', index=False)
+
+    report = collect_stock_data.collect_data(['AAPL', 'GONE'],
+        ('2020-01-01', '2020-01-04'), stock_downloader.LocalBackend(str(source)))
+
+    assert report.succeeded == ['AAPL']
+    assert list(report.failed) == ['GONE']
+    placeholder = pd.read_csv('data/stock_data/GONE.csv')
+    assert placeholder.empty
+    assert 'Open' in placeholder.columns
+    assert simulate.Stock('GONE').get_open('2020-01-02') == 0
+
+    # Mentioned by a trader, the failed symbol is traded at 0 by both engines
+    data = pd.DataFrame({'subreddit': ['stocks'] * 2, 'stock': ['AAPL', 'GONE'],
+        'date': ['2020-01-02'] * 2, 'score': [5, 5], 'pos': [1.0, 1.0],
+        'neg': [0.0, 0.0]})
+    for engine in ('simulate', 'simulate_vectorized'):
+        trader = simulate.Trader('stocks', data)
+        market = simulate.Market([trader], 'data/stock_data',
+            datetime.date(2020, 1, 2), datetime.date(2020, 1, 3))
+        (tmp_path / 'data' / 'results').mkdir(exist_ok=True)
+        getattr(market, engine)()
+        assert trader.owned_stocks == {'AAPL': 1, 'GONE': 1}
+        assert trader.cost_basis == 10.0
+        assert list(trader.dated_portfolio_values.values()) == [10.0, 11.0]
+
+
+def test_symbol_downloaded_in_two_ranges_is_counted_once(tmp_path,
+        monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(collect_stock_data.args, 'retries', 0)
+    (tmp_path / 'data' / 'stock_data').mkdir(parents=True)
+    source = tmp_path / 'source'
+    source.mkdir()
+    dates = pd.bdate_range('2020-01-01', '2020-01-31').strftime('%Y-%m-%d')
+    for symbol in ('AAPL', 'GME', 'TSLA'):
+        pd.DataFrame({'Date': dates, 'Open': 1.0}).to_csv(
+            source / f'{symbol}.csv', index=False)
+    backend = stock_downloader.LocalBackend(str(source))
+
+    collect_stock_data.collect_data(['AAPL', 'GME', 'TSLA'],
+        ('2020-01-10', '2020-01-20'), backend)
+    # Missing dates both before and after the ones already downloaded
+    downloaded = collect_stock_data.metrics.counters['symbols_downloaded']
+    report = collect_stock_data.collect_data(['AAPL', 'GME', 'TSLA'],
+        ('2020-01-01', '2020-02-01'), backend)
+
+    assert sorted(report.succeeded) == ['AAPL', 'GME', 'TSLA']
+    assert collect_stock_data.metrics.counters['symbols_downloaded'] \
+        - downloaded == 3
+    assert len(pd.read_csv('data/stock_data/GME.csv')) == len(dates)
+
+
+def test_refresh_downloads_days_published_after_the_last_run(tmp_path,
+        monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(collect_stock_data.args, 'retries', 0)
+    (tmp_path / 'data' / 'stock_data').mkdir(parents=True)
+    source = tmp_path / 'source'
+    source.mkdir()
+    backend = stock_downloader.LocalBackend(str(source))
+    # -p 5d run on 2020-01-10, before that day's bar exists
+    date_range = stock_downloader.period_to_range('5d', datetime.date(2020,
+        1, 10))
+    pd.DataFrame({'Date': ['2020-01-08', '2020-01-09'], 'Open': [1.0, 2.0]}
+        ).to_csv(source / 'AAPL.csv', index=False)
+    collect_stock_data.collect_data(['AAPL'], date_range, backend)
+
+    pd.DataFrame({'Date': ['2020-01-08', '2020-01-09', '2020-01-10'],
+        'Open': [1.0, 2.0, 3.0]}).to_csv(source / 'AAPL.csv', index=False)
+    collect_stock_data.collect_data(['AAPL'], date_range, backend)
+
+    data = pd.read_csv('data/stock_data/AAPL.csv')
+    assert data['Date'].tolist() == ['2020-01-08', '2020-01-09', '2020-01-10']
+
+
+def test_coverage_stops_before_today():
+    data = pd.DataFrame({'Open': [1.0, 2.0]},
+        index=pd.Index(['2020-01-09', '2020-01-10'], name='Date'))
+    assert stock_downloader.covered_end('2020-01-11', data,
+        datetime.date(2020, 1, 10)) == '2020-01-10'
+    assert stock_downloader.covered_end('2020-01-11', data,
+        datetime.date(2020, 2, 1)) == '2020-01-11'
+    assert stock_downloader.covered_end('2020-01-11', None,
+        datetime.date(2020, 1, 10)) == '2020-01-10'
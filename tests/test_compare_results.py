@@ -0,0 +1,10 @@
+import pytest
+
+import compare_results
+
+
+def test_missing_db_is_not_created(tmp_path):
+    path = tmp_path / 'typo.sqlite'
+    with pytest.raises(FileNotFoundError):
+        compare_results.read_db_results(str(path))
+    assert not path.exists()
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+import sentiment_cube
+
+ROWS = {
+    'stock': ['GME', 'AAPL', 'GME', 'GME'],
+    'title': ['GME to the moon', 'AAPL', 'GME', 'sell GME'],
+    'body': ['', '', '', ''],
+    'subreddit': ['wallstreetbets', 'stocks', 'wallstreetbets', 'stocks'],
+    'score': [10, 3, 4, 7],
+    # A Saturday post, left out of the cube
+    'date': ['2020-03-02', '2020-03-02', '2020-03-03', '2020-03-07'],
+}
+SCORES = [(0.5, 0.5, 0.0), (0.0, 0.8, 0.2), (0.1, 0.6, 0.3), (0.4, 0.6, 0.0)]
+
+
+def test_build_from_legacy_scored_csv(tmp_path):
+    legacy = pd.DataFrame(ROWS)
+    legacy['sentiment_score'] = [str({'neg': neg, 'neu': neu, 'pos': pos})
+        for pos, neu, neg in SCORES]
+    legacy.to_csv(tmp_path / 'legacy.csv')
+    current = pd.DataFrame(ROWS)
+    current[['pos', 'neu', 'neg']] = SCORES
+    current['compound'] = 0.0
+    current.to_csv(tmp_path / 'current.csv')
+
+    sentiment_cube.build_from_scored_csv(str(tmp_path / 'legacy.csv'),
+        str(tmp_path / 'legacy_cube'))
+    sentiment_cube.build_from_scored_csv(str(tmp_path / 'current.csv'),
+        str(tmp_path / 'current_cube'))
+
+    legacy_cube = sentiment_cube.SentimentCube(str(tmp_path / 'legacy_cube'))
+    current_cube = sentiment_cube.SentimentCube(str(tmp_path / 'current_cube'))
+    assert legacy_cube.subreddits == ['stocks', 'wallstreetbets']
+    assert legacy_cube.stocks == ['AAPL', 'GME']
+    assert legacy_cube.mentioned == current_cube.mentioned
+    for field in sentiment_cube.FIELDS:
+        assert np.array_equal(legacy_cube.field(field),
+            current_cube.field(field))
+
+    net = legacy_cube.slice(subreddit='wallstreetbets')
+    assert net['GME'].tolist() == [10, -4, 0, 0, 0]
+    assert legacy_cube.slice('posts').to_numpy().sum() == 3
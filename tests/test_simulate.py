@@ -0,0 +1,63 @@
+import datetime
+
+import pandas as pd
+
+import simulate
+
+# Prices whose sums are not exact in floating point (ex: 0.1 + 0.2)
+PRICES = {
+    'AAA': [0.1, 0.2, 0.3, 0.7, 1.1, 2.2],
+    'BBB': [10.01, 20.02, 30.03, 40.07, 50.11, 60.13],
+    'CCC': [3.33, 3.34, 3.35, 3.36, 3.37, 3.38],
+}
+DATES = ['2020-01-06', '2020-01-07', '2020-01-08', '2020-01-09',
+    '2020-01-10', '2020-01-13']
+
+
+def run(engine, tmp_path, monkeypatch):
+    results_dir = tmp_path / engine
+    (results_dir / 'data' / 'results').mkdir(parents=True)
+    for symbol, opens in PRICES.items():
+        pd.DataFrame({'Date': DATES, 'Open': opens}).to_csv(
+            tmp_path / f'{symbol}.csv', index=False)
+
+    posts = [
+        ('stocks', 'AAA', 0, 5, 1.0, 0.0), ('stocks', 'BBB', 0, 3, 1.0, 0.0),
+        ('stocks', 'AAA', 1, 2, 1.0, 0.0), ('stocks', 'CCC', 1, 9, 0.9, 0.1),
+        ('stocks', 'BBB', 2, 4, 0.0, 1.0), ('stocks', 'AAA', 3, 1, 1.0, 0.0),
+        ('stocks', 'CCC', 4, 7, 0.1, 0.9), ('stocks', 'AAA', 5, 6, 1.0, 0.0),
+        ('investing', 'BBB', 0, 8, 1.0, 0.0),
+        ('investing', 'BBB', 1, 8, 1.0, 0.0),
+        ('investing', 'CCC', 2, 1, 1.0, 0.0),
+        ('investing', 'BBB', 3, 2, 0.2, 0.8),
+    ]
+    data = pd.DataFrame(posts, columns=['subreddit', 'stock', 'date', 'score',
+        'pos', 'neg'])
+    data['date'] = [DATES[d] for d in data['date']]
+    traders = [simulate.Trader(subreddit, data[data['subreddit'] == subreddit])
+        for subreddit in ('stocks', 'investing')]
+    market = simulate.Market(traders, str(tmp_path),
+        datetime.date(2020, 1, 6), datetime.date(2020, 1, 13))
+
+    monkeypatch.chdir(results_dir)
+    getattr(market, engine)()
+    return results_dir / 'data' / 'results', traders
+
+
+def test_engines_write_the_same_files(tmp_path, monkeypatch):
+    loop_dir, loop_traders = run('simulate', tmp_path, monkeypatch)
+    vectorized_dir, vectorized_traders = run('simulate_vectorized', tmp_path,
+        monkeypatch)
+
+    files = sorted(path.name for path in loop_dir.iterdir())
+    assert files == ['investing_p_value.csv', 'investing_stocks.csv',
+        'stocks_p_value.csv', 'stocks_stocks.csv']
+    assert files == sorted(path.name for path in vectorized_dir.iterdir())
+    for name in files:
+        assert (loop_dir / name).read_bytes() \
+            == (vectorized_dir / name).read_bytes()
+
+    for loop, vectorized in zip(loop_traders, vectorized_traders):
+        assert loop.dated_portfolio_values == vectorized.dated_portfolio_values
+        assert loop.dated_cost_basis == vectorized.dated_cost_basis
+        assert loop.cost_basis == vectorized.cost_basis
@@ -0,0 +1,27 @@
+import pandas as pd
+
+import stock_downloader
+
+
+def test_downloads_from_one_host_share_a_limiter(tmp_path, monkeypatch):
+    for symbol in ('AAPL', 'GME'):
+        pd.DataFrame({'Date': ['2020-01-02'], 'Open': [1.0]}).to_csv(
+            tmp_path / f'{symbol}.csv', index=False)
+    backend = stock_downloader.LocalBackend(str(tmp_path))
+    limiters = []
+    acquire = stock_downloader.RateLimiter.acquire
+    def record(limiter):
+        limiters.append(limiter)
+        acquire(limiter)
+    monkeypatch.setattr(stock_downloader.RateLimiter, 'acquire', record)
+
+    # As collect_stock_data.collect_data() does, one call per missing range
+    for date_range in (('2020-01-01', '2020-01-03'),
+            ('2020-01-02', '2020-01-04')):
+        stock_downloader.download(['AAPL', 'GME'], date_range, backend,
+            lambda symbol, frame: None, batch_size=1, workers=2, rate=100)
+
+    assert len(limiters) == 4
+    assert all(limiter is limiters[0] for limiter in limiters)
+    assert limiters[0] is stock_downloader.host_limiter('local', 100, 2)
+    assert stock_downloader.host_limiter('other', 100) is not limiters[0]
@@ -0,0 +1,42 @@
+import datetime
+
+import numpy as np
+
+import trading_calendar
+
+date = datetime.date
+
+
+def test_saturday_new_years_day_is_not_observed():
+    # 2022-01-01 was a Saturday, the Friday before is the last session of 2021
+    assert [day for day in trading_calendar.nyse_holidays(2022)
+        if day.month == 1] == [date(2022, 1, 17)]
+    assert trading_calendar.sessions(date(2021, 12, 30),
+        date(2022, 1, 4)).tolist() == [date(2021, 12, 30), date(2021, 12, 31),
+        date(2022, 1, 3), date(2022, 1, 4)]
+    # A Sunday New Years Day is observed the Monday after
+    assert date(2023, 1, 2) in trading_calendar.nyse_holidays(2023)
+
+
+def test_juneteenth_from_2022():
+    assert date(2021, 6, 18) not in trading_calendar.nyse_holidays(2021)
+    # 2022-06-19 was a Sunday
+    assert date(2022, 6, 20) in trading_calendar.nyse_holidays(2022)
+    assert date(2023, 6, 19) in trading_calendar.nyse_holidays(2023)
+
+
+def test_good_friday():
+    for good_friday in (date(2019, 4, 19), date(2020, 4, 10),
+            date(2021, 4, 2), date(2024, 3, 29)):
+        assert good_friday in trading_calendar.nyse_holidays(good_friday.year)
+        assert good_friday not in trading_calendar.sessions(
+            good_friday - datetime.timedelta(days=7), good_friday).tolist()
+
+
+def test_sessions():
+    assert np.array_equal(trading_calendar.sessions(date(2020, 12, 24),
+        date(2020, 12, 29)), np.array(['2020-12-24', '2020-12-28',
+        '2020-12-29'], dtype='datetime64[D]'))
+    # Every weekday of 2020 but its 9 holidays
+    assert len(trading_calendar.sessions(date(2020, 1, 1),
+        date(2020, 12, 31))) == 253
@@ -0,0 +1,160 @@
+'''
+The New York Stock Exchange (NYSE) trading calendar: every weekday that is
+not an exchange holiday. Holidays are computed from the rules the NYSE uses
+rather than listed by hand, including the shift to the nearest weekday when a
+holiday falls on a weekend (ex: New Years Day is January 1st, but in 2023 it
+fell on a Sunday and was observed Monday January 2nd).
+
+Usage example
+-------------
+>>> sessions(datetime.date(2020, 12, 24), datetime.date(2020, 12, 29))
+array(['2020-12-24', '2020-12-28', '2020-12-29'], dtype='datetime64[D]')
+
+Methods
+-------
+easter(year -> int) -> datetime.date
+nth_weekday(year -> int, month -> int, weekday -> int, n -> int)
+    -> datetime.date
+observed(holiday -> datetime.date) -> datetime.date
+nyse_holidays(year -> int) -> List<datetime.date>
+sessions(start -> datetime.date, end -> datetime.date) -> numpy.ndarray
+'''
+import datetime
+from functools import lru_cache
+
+import numpy as np
+
+MONDAY, THURSDAY, FRIDAY, SATURDAY, SUNDAY = 0, 3, 4, 5, 6
+
+# Days the NYSE closed outside of its regular holidays
+SPECIAL_CLOSURES = [
+    datetime.date(1994, 4, 27),  # President Nixon's funeral
+    datetime.date(2001, 9, 11),  # September 11th attacks
+    datetime.date(2001, 9, 12),
+    datetime.date(2001, 9, 13),
+    datetime.date(2001, 9, 14),
+    datetime.date(2004, 6, 11),  # President Reagan's funeral
+    datetime.date(2007, 1, 2),   # President Ford's funeral
+    datetime.date(2012, 10, 29), # Hurricane Sandy
+    datetime.date(2012, 10, 30),
+    datetime.date(2018, 12, 5),  # President George H.W. Bush's funeral
+    datetime.date(2025, 1, 9),   # President Carter's funeral
+]
+
+
+def easter(year):
+    '''
+    Computes the date of Easter Sunday in <year> (Gregorian calendar), using
+    the anonymous Gregorian algorithm
+
+    Returns
+    -------
+    datetime.date
+    '''
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+
+def nth_weekday(year, month, weekday, n):
+    '''
+    Finds the <n>th <weekday> (0 is Monday) of <month>, a negative <n> counts
+    from the end of the month (ex: -1 is the last <weekday> of <month>)
+
+    Returns
+    -------
+    datetime.date
+    '''
+    if n > 0:
+        first = datetime.date(year, month, 1)
+        offset = (weekday - first.weekday()) % 7
+        return first + datetime.timedelta(days=offset + 7 * (n - 1))
+
+    if month == 12:
+        last = datetime.date(year, 12, 31)
+    else:
+        last = datetime.date(year, month + 1, 1) - datetime.timedelta(days=1)
+    offset = (last.weekday() - weekday) % 7
+    return last - datetime.timedelta(days=offset + 7 * (-n - 1))
+
+
+def observed(holiday):
+    '''
+    Holidays falling on a Saturday are observed the Friday before, holidays
+    falling on a Sunday are observed the Monday after
+
+    Returns
+    -------
+    datetime.date
+    '''
+    if holiday.weekday() == SATURDAY:
+        return holiday - datetime.timedelta(days=1)
+    if holiday.weekday() == SUNDAY:
+        return holiday + datetime.timedelta(days=1)
+    return holiday
+
+
+@lru_cache(maxsize=None)
+def nyse_holidays(year):
+    '''
+    Lists the days the NYSE is closed for holidays in <year>
+
+    Returns
+    -------
+    holidays : List<datetime.date>
+
+    Notes
+    -----
+    New Years Day is the one holiday that is not moved to the Friday before
+    when it falls on a Saturday, as that Friday is the last trading day of
+    the previous year. Martin Luther King, Jr. Day has been observed since
+    1998 and Juneteenth National Independence Day since 2022
+    '''
+    holidays = []
+    new_years = datetime.date(year, 1, 1)
+    if new_years.weekday() != SATURDAY:
+        holidays.append(observed(new_years))
+    if year >= 1998:
+        holidays.append(nth_weekday(year, 1, MONDAY, 3))  # MLK Jr. Day
+    holidays.append(nth_weekday(year, 2, MONDAY, 3))      # Washington's Birthday
+    holidays.append(easter(year) - datetime.timedelta(days=2))  # Good Friday
+    holidays.append(nth_weekday(year, 5, MONDAY, -1))     # Memorial Day
+    if year >= 2022:
+        holidays.append(observed(datetime.date(year, 6, 19)))  # Juneteenth
+    holidays.append(observed(datetime.date(year, 7, 4)))  # Independence Day
+    holidays.append(nth_weekday(year, 9, MONDAY, 1))      # Labor Day
+    holidays.append(nth_weekday(year, 11, THURSDAY, 4))   # Thanksgiving Day
+    holidays.append(observed(datetime.date(year, 12, 25)))  # Christmas Day
+    holidays.extend(day for day in SPECIAL_CLOSURES if day.year == year)
+
+    return sorted(holidays)
+
+
+def sessions(start, end):
+    '''
+    Lists every day the NYSE is open from <start> to <end> (inclusive)
+
+    Parameters
+    ----------
+    start : datetime.date
+
+    end : datetime.date
+
+    Returns
+    -------
+    sessions : numpy.ndarray<datetime64[D]>
+        The trading days, in order
+    '''
+    days = np.arange(np.datetime64(start, 'D'),
+        np.datetime64(end, 'D') + 1, dtype='datetime64[D]')
+    holidays = [holiday for year in range(start.year, end.year + 1)
+        for holiday in nyse_holidays(year)]
+    return days[np.is_busday(days, holidays=holidays)]